@@ -0,0 +1,220 @@
+import asyncio
+import logging
+from typing import Optional
+
+from fastapi import HTTPException
+
+from api.providers import METEOMATICS, NASA_POWER, NASA_POWER_HOURLY, fetch_nodes
+from services import fast_json
+from services.deadline import Deadline, DeadlineExceeded
+from services.prefetch import prefetcher
+from services.tiling import blend, locate
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Límites de una consulta agrupada
+BATCH_MAX_ITEMS = 500
+MAX_SPAN_DAYS = {METEOMATICS: 10, NASA_POWER: 366, NASA_POWER_HOURLY: 31}
+
+
+# ---------- PLANIFICACIÓN ----------
+
+def plan_groups(resolved: list) -> list:
+    """
+    Agrupa consultas por proveedor y tile de la malla (mismos nodos de interpolación); dentro
+    de cada tile junta las fechas en ventanas contiguas de como máximo MAX_SPAN_DAYS días.
+    resolved: lista de (índice, proveedor, lat, lon, fecha, fecha/hora consultada).
+    Retorna: lista de grupos {"provider", "tile", "nodes", "start", "end", "items", "weights"}
+    donde weights[índice] = [(nodo, peso), ...] de cada consulta.
+    """
+    by_tile: dict = {}
+    for index, provider, lat, lon, day, _ in resolved:
+        tile, nodes, weights = locate(provider, lat, lon)
+        by_tile.setdefault((provider, tile), []).append((day, index, list(zip(nodes, weights))))
+
+    groups = []
+    for (provider, tile), entries in by_tile.items():
+        entries.sort(key=lambda entry: (entry[0], entry[1]))
+        current = None
+        for day, index, node_weights in entries:
+            if current is None or (day - current["start"]).days >= MAX_SPAN_DAYS.get(provider, 1):
+                current = {"provider": provider, "tile": tile, "nodes": [], "start": day, "end": day, "items": [], "weights": {}}
+                groups.append(current)
+            current["end"] = day
+            current["items"].append(index)
+            current["weights"][index] = node_weights
+            current["nodes"] += [node for node, _ in node_weights if node not in current["nodes"]]
+    return groups
+
+
+async def fetch_group(group: dict) -> dict:
+    """
+    Todos los nodos del grupo a la vez (Meteomatics los une en una llamada multipunto; el
+    dataset local los lee en una sola selección).
+    """
+    start, end = group["start"].isoformat(), group["end"].isoformat()
+    series = await fetch_nodes(group["provider"], group["nodes"], start, end)
+    return dict(zip(group["nodes"], series))
+
+
+# ---------- EJECUCIÓN EN STREAMING ----------
+
+def _error_line(index: int, status_code: int, detail: str) -> bytes:
+    return fast_json.dumps_line({"index": index, "status": "error", "status_code": status_code, "detail": detail})
+
+
+async def stream_batch(engine, queries: list, raw_data: bool = False, deadline: Optional[Deadline] = None):
+    """
+    Resuelve, agrupa y consulta una lista de WeatherQueryData; produce una línea NDJSON por
+    consulta, en el mismo orden de entrada, en cuanto su grupo termina. Las consultas se agrupan
+    por tandas a medida que se resuelve su ubicación (las que traen coordenadas, de inmediato):
+    ninguna espera a la geocodificación de las demás.
+    Las etapas de ubicación, fecha, proveedor y respuesta son las del WeatherQueryEngine; con
+    deadline la geocodificación y las llamadas de cada grupo usan lo que queda del plazo (al
+    agotarse esas líneas son partial).
+    """
+    if len(queries) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Máximo {BATCH_MAX_ITEMS} consultas por lote.")
+
+    loop = asyncio.get_running_loop()
+    results = [loop.create_future() for _ in queries]
+    tasks: set = set()
+
+    def settle(index: int, result=None, error: Optional[BaseException] = None):
+        future = results[index]
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def launch(coro):
+        task = asyncio.ensure_future(coro)
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    def run(stage: str, awaitable):
+        return deadline.run(stage, awaitable) if deadline is not None else awaitable
+
+    async def resolve(query):
+        query_dt, provider = engine.plan(query)
+        try:
+            lat, lon = await run("location", engine.resolve_location(
+                query.lat, query.lon, query.country, query.city, query.locality, deadline))
+        except DeadlineExceeded as e:
+            return engine.partial(e, query_dt, provider)
+        prefetcher.record(provider, lat, lon, query_dt.date())
+        return provider, lat, lon, query_dt.date(), query_dt
+
+    async def answer(resolution, by_node: dict, node_weights: list) -> dict:
+        """
+        Respuesta de una consulta del grupo con la misma validación que engine.fetch. Si la ventana
+        no trae datos para su día (p. ej. NASA POWER en los días recientes) se prueba con las
+        otras fuentes que cubren la fecha, como en la carrera de una consulta suelta.
+        """
+        _, provider, lat, lon, day, query_dt = resolution
+        data = blend([by_node[node] for node, _ in node_weights], [w for _, w in node_weights])
+        try:
+            winner, day_data = provider, engine.validate_series(provider, data.slice_dates(day.isoformat(), day.isoformat()))
+        except HTTPException:
+            others = engine.candidates(query_dt, provider)[1:]
+            if not others:
+                raise
+            try:
+                winner, day_data = await run("weather", engine.fetch_any(
+                    others, lat, lon, day.isoformat(), deadline.at if deadline is not None else None))
+            except DeadlineExceeded as e:
+                return engine.partial(e, query_dt, provider, (lat, lon))
+        return engine.respond(winner, lat, lon, day_data, raw_data, at=query_dt)
+
+    async def answer_group(group: dict, resolved: dict):
+        """
+        Una llamada por grupo; si falla se reintenta una vez y, si vuelve a fallar, todas sus
+        consultas responden con la climatología (degraded): un fallo no se multiplica por consulta.
+        Si se agota el plazo, todas responden partial.
+        """
+        def fail(error: Exception):
+            for index in group["items"]:
+                _, provider, lat, lon, day, query_dt = resolved[index]
+                try:
+                    if isinstance(error, DeadlineExceeded):
+                        settle(index, engine.partial(error, query_dt, provider, (lat, lon)))
+                    else:
+                        settle(index, engine.fallback(provider, lat, lon, day, error))
+                except Exception as e:
+                    settle(index, error=e)
+
+        try:
+            by_node = await run("weather", fetch_group(group))
+        except DeadlineExceeded as e:
+            fail(e)
+            return
+        except Exception as e:
+            logger.warning(f"Lote: falló el grupo {group['provider']} {group['tile']} ({e}); se reintenta")
+            try:
+                by_node = await run("weather", fetch_group(group))
+            except Exception as e:
+                fail(e)
+                return
+
+        async def one(index):
+            try:
+                settle(index, await answer(resolved[index], by_node, group["weights"][index]))
+            except Exception as e:
+                settle(index, error=e)
+        await asyncio.gather(*(one(index) for index in group["items"]))
+
+    async def dispatch():
+        """Agrupa y lanza cada tanda de consultas resueltas (las que terminan juntas)."""
+        pending = {asyncio.ensure_future(resolve(query)): index for index, query in enumerate(queries)}
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                wave = []
+                for task in done:
+                    index = pending.pop(task)
+                    if task.exception() is not None:
+                        settle(index, error=task.exception())
+                    elif isinstance(task.result(), dict):
+                        settle(index, task.result())
+                    else:
+                        wave.append((index, *task.result()))
+                groups = plan_groups(wave)
+                if groups:
+                    logger.info(f"Lote de {len(queries)} consultas: {len(wave)} resueltas, agrupadas en {len(groups)} llamadas")
+                resolved = {entry[0]: entry for entry in wave}
+                for group in groups:
+                    launch(answer_group(group, resolved))
+        except Exception as e:
+            # Ninguna línea queda esperando para siempre
+            logger.error(f"Error agrupando el lote: {e}")
+            for index in range(len(results)):
+                settle(index, error=e)
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def lines():
+        launch(dispatch())
+        try:
+            for index, result in enumerate(results):
+                try:
+                    yield fast_json.dumps_line({"index": index, **await result})
+                except HTTPException as e:
+                    yield _error_line(index, e.status_code, str(e.detail))
+                except Exception as e:
+                    logger.error(f"Error en lote (consulta {index}): {e}")
+                    yield _error_line(index, 502, str(e))
+        finally:
+            # Si el cliente se desconecta se cancelan la resolución y las llamadas pendientes
+            for task in list(tasks):
+                task.cancel()
+            for future in results:
+                if not future.done():
+                    future.cancel()
+                elif not future.cancelled():
+                    future.exception()
+
+    return lines()
@@ -0,0 +1,448 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Optional
+from urllib.parse import parse_qsl, urlencode
+
+from fastapi import HTTPException
+from fastapi.responses import RedirectResponse, Response, StreamingResponse
+
+import config
+from api.batch import stream_batch
+from api.models import WeatherQueryData
+from api.providers import PROVIDERS, cached_point, choose_provider, fetch_point
+from api.stream import stream_query, streaming_response, wants_ndjson
+from models.risk_model import RISK_LABELS
+from models.timeseries import TimeSeries
+from services import fast_json
+from services.cache import weather_cache
+from services.climatology import climatology_store, degraded_response
+from services.deadline import Deadline, DeadlineExceeded, deadline_counters
+from services.geocoder import geocoder
+from services.governor import ProviderUnavailable, governor_stats
+from services.hedging import hedger
+from services.http_cache import cache_control, etag_for, etag_index, matches, not_modified
+from services.metrics import stage
+from services.prefetch import prefetcher
+from services.risk_grid import output_axes, risk_surface, to_json, to_npy, to_png
+from services.single_flight import provider_flights
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class WeatherQueryEngine:
+    """
+    Pipeline único de una consulta de clima, usado por app.py (api/routes.py) y run_queries.py:
+
+        ubicación -> proveedor -> datos (malla + cache) -> derivados -> respuesta
+
+    Cada etapa es un método (se puede reemplazar en una subclase) y los proveedores son
+    WeatherProvider registrados en api/providers.py. El lote y el streaming reutilizan las
+    mismas etapas, así que cache, agrupación y métricas se aplican en todas las entradas.
+    """
+
+    def __init__(self, providers: dict, choose=choose_provider, hedge=hedger):
+        self.providers = providers
+        self._choose = choose
+        self.hedger = hedge
+
+    # ---------- ETAPAS ----------
+
+    @staticmethod
+    def validate_date(date_str: str) -> datetime:
+        """Valida y convierte una cadena YYYY-MM-DDTHH:MM o YYYY-MM-DD a datetime."""
+        for fmt in ("%Y-%m-%dT%H:%M", "%Y-%m-%d"):
+            try:
+                return datetime.strptime(date_str, fmt)
+            except ValueError:
+                continue
+        raise HTTPException(status_code=400, detail=f"Fecha/Hora inválida: {date_str}. Usar YYYY-MM-DDTHH:MM o YYYY-MM-DD")
+
+    @staticmethod
+    def validate_lat_lon(lat: float, lon: float):
+        if not (-90 <= lat <= 90) or not (-180 <= lon <= 180):
+            raise HTTPException(status_code=400, detail=f"Lat/Lon fuera de rango: lat={lat}, lon={lon}")
+
+    async def resolve_location(self, lat: Optional[float], lon: Optional[float], country: Optional[str] = None,
+                               city: Optional[str] = None, locality: Optional[str] = None,
+                               deadline: Optional[Deadline] = None):
+        """
+        Lat/Lon explícitos (tienen prioridad) o el índice local de lugares con Nominatim como respaldo.
+        Con deadline la llamada a Nominatim no espera más que lo que queda del plazo.
+        """
+        if lat is not None and lon is not None:
+            self.validate_lat_lon(lat, lon)
+            return lat, lon
+
+        query_parts = [p for p in [locality, city, country] if p and p.strip()]
+        if not query_parts:
+            raise HTTPException(status_code=400, detail="Debe proporcionar coordenadas o al menos un campo de ubicación.")
+        query = ", ".join(query_parts)
+
+        with stage("geocode"):
+            try:
+                timeout = deadline.cap(config.NOMINATIM_TIMEOUT) if deadline is not None else None
+                location = await geocoder.geocode(country, city, locality, timeout)
+            except Exception as e:
+                if deadline is not None and deadline.expired:
+                    raise DeadlineExceeded("location") from e
+                logger.error(f"Error en geocodificación: {e}")
+                raise HTTPException(status_code=500, detail="Error al contactar al servicio de ubicación (Nominatim).")
+        if not location:
+            raise HTTPException(status_code=404, detail=f"No se encontró la ubicación: {query}. Intente ser más específico.")
+        return location
+
+    def choose(self, query_dt: datetime, with_time: bool = False) -> str:
+        return self._choose(query_dt, with_time)
+
+    def plan(self, query: WeatherQueryData) -> tuple:
+        """Fecha/hora validada y proveedor de la consulta: (query_dt, proveedor)."""
+        query_dt = self.validate_date(query.dateTime)
+        return query_dt, self.choose(query_dt, "T" in query.dateTime)
+
+    def candidates(self, query_dt: datetime, provider: str) -> list:
+        """
+        Proveedores que pueden responder la consulta, el elegido primero. Con HEDGE_ENABLED se
+        agregan los de otras APIs cuya ventana incluye la fecha (p. ej. días recientes:
+        NASA POWER y Meteomatics).
+        Hoy no tiene respaldo: NASA POWER publica con días de retraso (covers lo excluye) y
+        Meteomatics es la única fuente; si cae se responde con la climatología (degraded).
+        """
+        names = [provider]
+        if not config.HEDGE_ENABLED:
+            return names
+        day = query_dt.date()
+        upstreams = {self.providers[provider].upstream}
+        for name, spec in self.providers.items():
+            if spec.upstream in upstreams or not spec.covers(day) or spec.unavailable():
+                continue
+            upstreams.add(spec.upstream)
+            names.append(name)
+        return names
+
+    def unavailable(self) -> dict:
+        """Proveedores registrados que no pueden usarse: {nombre: motivo}."""
+        return {name: reason for name, spec in self.providers.items() if (reason := spec.unavailable())}
+
+    def check_providers(self):
+        """Se llama en el lifespan: un proveedor sin configurar no impide arrancar, solo se avisa."""
+        for name, reason in self.unavailable().items():
+            logger.warning(f"Proveedor {name} no disponible: {reason}")
+
+    async def fetch(self, provider: str, lat: float, lon: float, day: str) -> TimeSeries:
+        """Serie del día en el punto exacto (nodos de la malla, cache y llamadas agrupadas)."""
+        spec = self.providers[provider]
+        reason = spec.unavailable()
+        if reason:
+            raise ProviderUnavailable(reason)
+        with stage(provider):
+            data = await fetch_point(provider, lat, lon, day, day)
+        return self.validate_series(provider, data)
+
+    def validate_series(self, provider: str, data: TimeSeries) -> TimeSeries:
+        """Rechaza (502) la serie vacía o con solo valores de relleno (p. ej. NASA POWER en los días más recientes)."""
+        if len(data) == 0 or not data.has_values():
+            raise HTTPException(status_code=502, detail=f"{self.providers[provider].source} devolvió una respuesta sin datos")
+        return data
+
+    async def fetch_any(self, providers: list, lat: float, lon: float, day: str, deadline: Optional[float] = None) -> tuple:
+        """
+        Carrera entre los proveedores (ver services/hedging.py): el siguiente se consulta cuando
+        el anterior tarda más que su percentil de latencia o falla; gana el primero que responde.
+        Retorna: (proveedor, serie).
+        """
+        attempts = [(name, lambda name=name: self.fetch(name, lat, lon, day)) for name in providers]
+        return await self.hedger.race(attempts, deadline)
+
+    def respond(self, provider: str, lat: float, lon: float, data: TimeSeries, raw_data: bool = False,
+                at: Optional[datetime] = None) -> dict:
+        """Variables resumidas (en la hora at si el proveedor es horario) y predicción de lluvia; raw_data añade la serie completa."""
+        spec = self.providers[provider]
+        result = {
+            "status": "success",
+            "source": spec.source,
+            "location": {"lat": lat, "lon": lon},
+            **spec.summary(data, at),
+            "rain_prediction": spec.rain_prediction(lat, lon, data),
+        }
+        if raw_data:
+            result["raw_data"] = data.to_records()
+        return result
+
+    # ---------- ENTRADAS ----------
+
+    async def answer(self, query_dt: datetime, provider: str, lat: float, lon: float,
+                     deadline: Optional[Deadline] = None) -> tuple:
+        """
+        Datos de una consulta ya planificada: (proveedor que respondió, serie). Si el proveedor
+        falla se responde con la climatología (degraded) cuando la hay: (None, respuesta).
+        Con deadline la carrera no lanza respaldos que no alcanzarían a responder; al agotarse
+        el plazo se relanza asyncio.TimeoutError (Deadline.run lo convierte en DeadlineExceeded).
+        """
+        day = query_dt.date()
+        prefetcher.record(provider, lat, lon, day)
+
+        try:
+            return await self.fetch_any(self.candidates(query_dt, provider), lat, lon, day.isoformat(),
+                                        deadline.at if deadline is not None else None)
+        except (HTTPException, asyncio.TimeoutError):
+            raise
+        except Exception as e:
+            return None, self.fallback(provider, lat, lon, day, e)
+
+    def fallback(self, provider: str, lat: float, lon: float, day, error: Exception) -> dict:
+        """
+        Proveedor caído o sin cuota: respuesta con la climatología (degraded) si la celda existe;
+        si no, HTTPException 503 (no disponible) o 500.
+        """
+        source = self.providers[provider].source
+        logger.error(f"Error en query_weather ({source}): {error}")
+        fallback = degraded_response(lat, lon, day, f"{source} no disponible: {error}")
+        if fallback is not None:
+            return fallback
+        status_code = 503 if isinstance(error, ProviderUnavailable) else 500
+        raise HTTPException(status_code=status_code, detail=f"Error al obtener datos de {source}: {str(error)}")
+
+    def cached_answer(self, query_dt: datetime, provider: str, lat: float, lon: float) -> Optional[dict]:
+        """Respuesta con la serie que siga en memoria (aunque esté vencida), sin red; None si no hay."""
+        day = query_dt.date().isoformat()
+        for name in self.candidates(query_dt, provider):
+            data = cached_point(name, lat, lon, day, day)
+            if data is not None and len(data) and data.has_values():
+                return self.respond(name, lat, lon, data, at=query_dt)
+        return None
+
+    def partial(self, error: DeadlineExceeded, query_dt: datetime, provider: str, location: Optional[tuple] = None) -> dict:
+        """
+        Respuesta cuando se agota el plazo (status "partial"), sin esperar más a la red: la
+        ubicación si ya se resolvió y la serie que siga en memoria aunque esté vencida (stale),
+        o si no la climatología del día. missing lista lo que no se alcanzó a obtener.
+        """
+        deadline_counters["partial"] += 1
+        body = {
+            "status": "partial",
+            "source": None,
+            "location": None,
+            "temperature": "--",
+            "precipitation": "--",
+            "wind": "--",
+            "solarRadiation": "--",
+            "rain_prediction": None,
+        }
+        missing = ["location", "weather", "rain_prediction"]
+        if location is not None:
+            lat, lon = location
+            body["location"] = {"lat": lat, "lon": lon}
+            missing.remove("location")
+            cached = self.cached_answer(query_dt, provider, lat, lon)
+            if cached is not None:
+                body.update(cached, status="partial", stale=True)
+                missing = []
+            else:
+                fallback = degraded_response(lat, lon, query_dt.date(), str(error))
+                if fallback is not None:
+                    body.update(fallback, status="partial")
+                    missing = ["weather"]
+        body["missing"] = missing
+        body["detail"] = str(error)
+        return body
+
+    async def query(self, query: WeatherQueryData, raw_data: bool = False, deadline: Optional[Deadline] = None):
+        """
+        Una consulta completa; si el proveedor falla responde con la climatología (degraded) cuando la hay.
+        Todas las etapas comparten el plazo (deadline, REQUEST_DEADLINE_MS por defecto): si se agota
+        se responde lo que haya (partial) y si el cliente se desconecta se cancela la consulta.
+        """
+        deadline = deadline or Deadline.from_request()
+        query_dt, provider = self.plan(query)
+        location = None
+        async with deadline.watch():
+            try:
+                location = await deadline.run("location", self.resolve_location(
+                    query.lat, query.lon, query.country, query.city, query.locality, deadline))
+                lat, lon = location
+                winner, data = await deadline.run("weather", self.answer(query_dt, provider, lat, lon, deadline=deadline))
+            except DeadlineExceeded as e:
+                return fast_json.response(self.partial(e, query_dt, provider, location))
+        if winner is None:
+            return data
+        body = self.respond(winner, lat, lon, data, at=query_dt)
+        # raw_data va precodificado con la serie (se codifica una vez por serie del cache)
+        return fast_json.response(body, raw_data=data.records_json() if raw_data else None)
+
+    def canonical_params(self, query_dt: datetime, provider: str, lat: float, lon: float, raw_data: bool = False) -> list:
+        """
+        Parámetros de la URL canónica de GET /query_weather: coordenadas a 4 decimales (~11 m) y
+        la fecha con la granularidad del proveedor (hora solo si la respuesta depende de ella).
+        """
+        date_time = query_dt.strftime("%Y-%m-%dT%H:00" if self.providers[provider].hourly else "%Y-%m-%d")
+        params = [("lat", str(round(lat, 4))), ("lon", str(round(lon, 4))), ("dateTime", date_time)]
+        if raw_data:
+            params.append(("raw_data", "true"))
+        return params
+
+    async def query_cached(self, query: WeatherQueryData, raw_data: bool, if_none_match: Optional[str],
+                           path: str, query_string: str, deadline: Optional[Deadline] = None):
+        """
+        GET /query_weather: la misma consulta con semántica de cache HTTP para navegadores y CDN.
+        - Una URL no canónica (nombres de lugar, más decimales, otra hora u orden) se redirige (308)
+          a la canónica, así todas las variantes comparten una entrada en el CDN.
+        - ETag fuerte según los datos y Cache-Control con el max-age de la fuente.
+        - If-None-Match que coincide con un ETag aún fresco -> 304 sin consultar al proveedor.
+        - Plazo agotado -> respuesta partial con no-store (como query).
+        """
+        deadline = deadline or Deadline.from_request()
+        query_dt, provider = self.plan(query)
+        async with deadline.watch():
+            try:
+                lat, lon = await deadline.run("location", self.resolve_location(
+                    query.lat, query.lon, query.country, query.city, query.locality, deadline))
+            except DeadlineExceeded as e:
+                return self._no_store(self.partial(e, query_dt, provider))
+            params = self.canonical_params(query_dt, provider, lat, lon, raw_data)
+            max_age = self.providers[provider].http_max_age
+            key = f"{path}?{urlencode(params)}"
+            if parse_qsl(query_string, keep_blank_values=True) != params:
+                etag_index.counters["redirects"] += 1
+                return RedirectResponse(key, status_code=308, headers={"Cache-Control": cache_control(max_age)})
+
+            known = etag_index.get(key)
+            if known is not None and matches(if_none_match, known):
+                etag_index.counters["not_modified_indexed"] += 1
+                return not_modified(known, max_age)
+
+            canonical_lat, canonical_lon = float(params[0][1]), float(params[1][1])
+            try:
+                winner, data = await deadline.run("weather", self.answer(query_dt, provider, canonical_lat, canonical_lon,
+                                                                         deadline=deadline))
+            except DeadlineExceeded as e:
+                return self._no_store(self.partial(e, query_dt, provider, (canonical_lat, canonical_lon)))
+            if winner is None:
+                # Climatología mientras el proveedor está caído: no se guarda en caches
+                return self._no_store(data)
+            provider = winner
+            max_age = self.providers[provider].http_max_age
+            etag = etag_for(provider, key, data)
+            etag_index.put(key, etag, max_age)
+            if matches(if_none_match, etag):
+                etag_index.counters["not_modified"] += 1
+                return not_modified(etag, max_age)
+
+            etag_index.counters["full"] += 1
+            body = self.respond(provider, canonical_lat, canonical_lon, data, at=query_dt)
+            response = fast_json.response(body, raw_data=data.records_json() if raw_data else None)
+            response.headers["ETag"] = etag
+            response.headers["Cache-Control"] = cache_control(max_age)
+            return response
+
+    @staticmethod
+    def _no_store(body: dict) -> Response:
+        """Respuestas degradadas o parciales: no se guardan en navegadores ni CDN."""
+        response = fast_json.response(body)
+        response.headers["Cache-Control"] = "no-store"
+        return response
+
+    async def batch(self, queries: list, raw_data: bool = False, deadline: Optional[Deadline] = None) -> StreamingResponse:
+        """Lote de consultas agrupadas por celda/fechas; NDJSON en el orden de entrada."""
+        lines = await stream_batch(self, queries, raw_data, deadline or Deadline.from_request())
+        return StreamingResponse(lines, media_type="application/x-ndjson")
+
+    async def stream(self, query: WeatherQueryData, accept: Optional[str], raw_data: bool = False,
+                     deadline: Optional[Deadline] = None) -> StreamingResponse:
+        """Consulta en streaming: SSE, o NDJSON si Accept lo pide."""
+        ndjson = wants_ndjson(accept)
+        deadline = deadline or Deadline.from_request()
+        return streaming_response(await stream_query(self, query, ndjson, raw_data, deadline), ndjson)
+
+    async def risk_grid(self, south: float, west: float, north: float, east: float, resolution: float,
+                        date_str: str, fmt: str = "json", layer: str = "wet", deadline: Optional[Deadline] = None):
+        """
+        Mapa de riesgo de un rectángulo para un día: una consulta de área/regional al proveedor,
+        el modelo de riesgo vectorizado sobre todos los nodos y la malla de salida en JSON,
+        .npy (4 × filas × columnas float32) o PNG (una capa coloreada, transparente sin riesgo).
+        La consulta de área y el cálculo de riesgos comparten el plazo (deadline): al agotarse se
+        responde 504 y si el cliente se desconecta se cancela.
+        """
+        deadline = deadline or Deadline.from_request()
+        self.validate_lat_lon(south, west)
+        self.validate_lat_lon(north, east)
+        if south >= north or west >= east:
+            raise HTTPException(status_code=400, detail="El rectángulo debe cumplir south < north y west < east")
+        if north - south > config.RISK_GRID_MAX_SPAN_DEG or east - west > config.RISK_GRID_MAX_SPAN_DEG:
+            raise HTTPException(status_code=400, detail=f"Cada lado del rectángulo puede medir hasta {config.RISK_GRID_MAX_SPAN_DEG}°")
+        if resolution <= 0:
+            raise HTTPException(status_code=400, detail="La resolución debe ser mayor que 0")
+        if fmt not in ("json", "npy", "png"):
+            raise HTTPException(status_code=400, detail=f"Formato inválido: {fmt}. Usar json, npy o png")
+        if layer not in RISK_LABELS:
+            raise HTTPException(status_code=400, detail=f"Capa inválida: {layer}. Usar {', '.join(RISK_LABELS)}")
+        lats, lons = output_axes(south, west, north, east, resolution)
+        if len(lats) * len(lons) > config.RISK_GRID_MAX_CELLS:
+            raise HTTPException(status_code=400, detail=f"La malla tendría {len(lats) * len(lons)} nodos (máximo {config.RISK_GRID_MAX_CELLS}); usar una resolución mayor")
+
+        query_dt = self.validate_date(date_str)
+        provider = self.choose(query_dt)
+        spec = self.providers[provider]
+        day = query_dt.date().isoformat()
+        reason = spec.unavailable()
+        if reason:
+            raise HTTPException(status_code=503, detail=f"{spec.source} no disponible: {reason}")
+        async with deadline.watch():
+            try:
+                with stage(f"{provider}_area"):
+                    area = await deadline.run("area", spec.fetch_area(south, west, north, east, resolution, day))
+            except NotImplementedError:
+                raise HTTPException(status_code=400, detail=f"{spec.source} no admite consultas de área")
+            except DeadlineExceeded as e:
+                raise HTTPException(status_code=504, detail=str(e))
+            except RuntimeError as e:
+                raise HTTPException(status_code=502, detail=f"Error al obtener el área de {spec.source}: {e}")
+            try:
+                with stage("risk"):
+                    # El hilo no se puede interrumpir: al agotarse el plazo se responde sin esperarlo
+                    surface = await deadline.run("risk", asyncio.to_thread(risk_surface, area, lats, lons))
+            except DeadlineExceeded as e:
+                raise HTTPException(status_code=504, detail=str(e))
+
+        if fmt == "json":
+            return {
+                "status": "success",
+                "source": spec.source,
+                "date": day,
+                "bbox": [south, west, north, east],
+                "resolution": resolution,
+                "shape": [len(lats), len(lons)],
+                "lats": lats.tolist(),
+                "lons": lons.tolist(),
+                "risk": to_json(surface),
+            }
+        headers = {
+            "X-Grid-Source": spec.source,
+            "X-Grid-Date": day,
+            "X-Grid-Bbox": f"{south},{west},{north},{east}",
+            "X-Grid-Resolution": str(resolution),
+            "X-Grid-Shape": f"{len(lats)},{len(lons)}",
+        }
+        if fmt == "npy":
+            headers["X-Grid-Layers"] = ",".join(RISK_LABELS)
+            return Response(to_npy(surface), media_type="application/octet-stream", headers=headers)
+        headers["X-Grid-Layer"] = layer
+        return Response(to_png(surface[RISK_LABELS.index(layer)]), media_type="image/png", headers=headers)
+
+    def stats(self) -> dict:
+        """Contadores de cache, deduplicación, geocodificación, climatología y proveedores."""
+        return {
+            **weather_cache.stats(),
+            "single_flight": provider_flights.stats(),
+            "geocoder": geocoder.stats(),
+            "climatology": climatology_store.stats(),
+            "providers": governor_stats(),
+            "hedging": self.hedger.stats(),
+            "http_cache": etag_index.stats(),
+            "deadlines": {**deadline_counters},
+            "unavailable": self.unavailable(),
+        }
+
+
+engine = WeatherQueryEngine(PROVIDERS)
@@ -1,9 +1,154 @@
-import xarray as xr
+import asyncio
+import importlib.util
+import logging
+import threading
+from typing import Optional
+
+import numpy as np
+
+import config
+from models.timeseries import TimeSeries
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Con dask los datos se leen por bloques y solo cuando se piden
+_HAS_DASK = importlib.util.find_spec("dask") is not None
+
+
+def _xarray():
+    """xarray (y con él pandas) se importa al abrir el primer dataset, no al arrancar la app."""
+    import xarray
+    return xarray
+
+
+class GriddedDataset:
+    """
+    Conjunto de datos en malla (NetCDF o Zarr) abierto una sola vez y leído de forma perezosa.
+    Las selecciones de muchos puntos se resuelven en una sola pasada vectorizada.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        xr = _xarray()
+        if path.rstrip("/").endswith(".zarr"):
+            self.ds = xr.open_zarr(path)
+        else:
+            self.ds = xr.open_dataset(path, chunks={} if _HAS_DASK else None, cache=False)
+        self.lat_name = "lat" if "lat" in self.ds.coords else "latitude"
+        self.lon_name = "lon" if "lon" in self.ds.coords else "longitude"
+        self.time_name = "time" if "time" in self.ds.coords else None
+        logger.info(f"Dataset abierto: {path} ({', '.join(self.ds.data_vars)})")
+
+    def covers(self, start: str, end: str) -> bool:
+        """True si el rango de fechas (YYYY-MM-DD) está dentro del eje de tiempo del dataset."""
+        if self.time_name is None:
+            return False
+        times = self.ds[self.time_name].values
+        return len(times) > 0 and times[0] <= np.datetime64(start) and np.datetime64(end) <= times[-1]
+
+    def select_points(self, varnames: list, lats, lons, start: Optional[str] = None, end: Optional[str] = None) -> dict:
+        """
+        Punto más cercano de la malla para N pares lat/lon en una sola selección.
+        Retorna: {"time": datetime64[T], variable: arreglo (N × T) float32}.
+        """
+        xr = _xarray()
+        points = {
+            self.lat_name: xr.DataArray(np.asarray(lats), dims="points"),
+            self.lon_name: xr.DataArray(np.asarray(lons), dims="points"),
+        }
+        subset = self.ds[varnames].sel(points, method="nearest")
+        if self.time_name is not None and (start or end):
+            # end inclusivo: se incluye todo el día final
+            end_exclusive = np.datetime64(end, "D") + np.timedelta64(1, "D") if end else None
+            subset = subset.sel({self.time_name: slice(start, end_exclusive)})
+            if end_exclusive is not None and len(subset[self.time_name]) and subset[self.time_name].values[-1] >= end_exclusive:
+                subset = subset.isel({self.time_name: slice(0, -1)})
+        subset = subset.load()
+        result = {"time": subset[self.time_name].values if self.time_name else np.empty(0, dtype="datetime64[s]")}
+        for name in varnames:
+            result[name] = subset[name].transpose("points", ...).values.astype(np.float32)
+        return result
+
+    def timeseries(self, lat: float, lon: float, varnames: list, start: Optional[str] = None, end: Optional[str] = None) -> TimeSeries:
+        selected = self.select_points(varnames, [lat], [lon], start, end)
+        return TimeSeries(selected["time"], {name: selected[name][0] for name in varnames})
+
+
+_datasets: dict = {}
+_datasets_lock = threading.Lock()
+
+
+def open_gridded(path: str) -> GriddedDataset:
+    """Devuelve el dataset ya abierto para esa ruta (lo abre la primera vez)."""
+    with _datasets_lock:
+        dataset = _datasets.get(path)
+        if dataset is None:
+            dataset = GriddedDataset(path)
+            _datasets[path] = dataset
+        return dataset
+
+
+def close_gridded():
+    with _datasets_lock:
+        for dataset in _datasets.values():
+            dataset.ds.close()
+        _datasets.clear()
+
 
 def read_netcdf_timeseries(path, varname, lat, lon):
-    ds = xr.open_dataset(path)
+    ds = open_gridded(path)
     # Seleccionar punto más cercano
-    sel = ds[varname].sel(lat=lat, lon=lon, method="nearest")
+    sel = ds.ds[varname].sel({ds.lat_name: lat, ds.lon_name: lon}, method="nearest")
     # Convertir a pandas Series
     sr = sel.to_series()
     return sr.reset_index().rename(columns={0: varname})
+
+
+# ---------- PROVEEDOR SIN RED (archivo NASA/ERA local) ----------
+
+def _offline_variables() -> dict:
+    """OFFLINE_DATASET_VARIABLES='T2M:t2m,PRECTOT:tp' -> {"T2M": "t2m", "PRECTOT": "tp"}."""
+    mapping = {}
+    for item in config.OFFLINE_DATASET_VARIABLES.split(","):
+        if not item.strip():
+            continue
+        name, _, source = item.partition(":")
+        mapping[name.strip()] = source.strip() or name.strip()
+    return mapping
+
+
+def _offline_nodes(nodes: list, start: str, end: str) -> Optional[list]:
+    dataset = open_gridded(config.OFFLINE_DATASET_PATH)
+    if not dataset.covers(start, end):
+        return None
+    mapping = {name: source for name, source in _offline_variables().items() if source in dataset.ds.data_vars}
+    if not mapping:
+        return None
+    # Todos los nodos en una sola selección vectorizada
+    lats, lons = zip(*nodes)
+    selected = dataset.select_points(list(mapping.values()), lats, lons, start, end)
+    # Se renombran a los nombres de NASA POWER que esperan los formateadores
+    return [TimeSeries(selected["time"], {name: selected[source][i] for name, source in mapping.items()})
+            for i in range(len(nodes))]
+
+
+async def fetch_offline_nodes(nodes: list, start: str, end: str) -> Optional[list]:
+    """
+    Series históricas de varios nodos [(lat, lon), ...] desde el dataset local
+    (OFFLINE_DATASET_PATH), sin llamadas a la red y en una sola lectura del archivo.
+    Retorna None si no hay dataset configurado o no cubre las fechas.
+    """
+    if not config.OFFLINE_DATASET_PATH or not nodes:
+        return None
+    try:
+        return await asyncio.to_thread(_offline_nodes, list(nodes), start, end)
+    except Exception as e:
+        logger.error(f"Error leyendo el dataset local {config.OFFLINE_DATASET_PATH}: {e}")
+        return None
+
+
+async def fetch_offline_timeseries(lat: float, lon: float, start: str, end: str) -> Optional[TimeSeries]:
+    """Serie histórica de un punto desde el dataset local (ver fetch_offline_nodes)."""
+    series = await fetch_offline_nodes([(lat, lon)], start, end)
+    return series[0] if series is not None else None
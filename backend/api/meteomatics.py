@@ -1,33 +1,46 @@
-import os
-import requests
+import httpx
 import logging
-from dotenv import load_dotenv
+
+import numpy as np
+
+import config
+from services import http_client, fast_json
+from services.cache import cached_area, cached_provider
+from services.metrics import registry, stage
+from api.meteomatics_planner import MeteomaticsPlanner
+from models.timeseries import AreaSeries, TimeSeries
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
-load_dotenv()
+PARAMETERS = "t_2m:C,precip_1h:mm,wind_speed_10m:ms"
 
-METEO_USER = os.getenv("METEO_USER")
-METEO_PASS = os.getenv("METEO_PASS")
 
-if not METEO_USER or not METEO_PASS:
-    raise ValueError("Meteomatics credentials not found in .env")
+def missing_credentials() -> bool:
+    """Sin METEO_USER/METEO_PASS el proveedor queda no disponible (la app arranca igual)."""
+    return not config.METEO_USER or not config.METEO_PASS
 
-def fetch_meteomatics_timeseries(lat, lon, start, end):
-    """
-    Consulta la API de Meteomatics y devuelve series temporales limpias.
-    """
-    parameters = "t_2m:C,precip_1h:mm,wind_speed_10m:ms"
-    url = f"https://api.meteomatics.com/{start}T00:00:00Z--{end}T00:00:00Z:PT1H/{parameters}/{lat},{lon}/json"
+
+def build_url(points, start, end, interval="PT1H"):
+    """URL de Meteomatics para uno o varios puntos ('lat,lon+lat,lon')."""
+    coordinates = "+".join(f"{lat},{lon}" for lat, lon in points)
+    # La ventana cubre el día final completo (end inclusivo, igual que NASA POWER)
+    return f"https://api.meteomatics.com/{start}T00:00:00Z--{end}T23:00:00Z:{interval}/{PARAMETERS}/{coordinates}/json"
+
+
+async def _request(url: str) -> dict:
+    """Una llamada a Meteomatics; devuelve el JSON ya validado."""
+    if missing_credentials():
+        raise RuntimeError("Meteomatics credentials not found in .env")
 
     try:
         logger.info(f"Consultando Meteomatics: {url}")
-        response = requests.get(url, auth=(METEO_USER, METEO_PASS), timeout=20)
+        response = await http_client.get(url, auth=(config.METEO_USER, config.METEO_PASS), timeout=config.METEOMATICS_TIMEOUT)
         response.raise_for_status()
 
         try:
-            data = response.json()
+            with stage("parse_meteomatics"):
+                data = fast_json.loads(response.content)
         except ValueError:
             logger.error("Respuesta no es JSON válido.")
             raise RuntimeError("Respuesta no válida de Meteomatics (no es JSON).")
@@ -36,29 +49,91 @@ def fetch_meteomatics_timeseries(lat, lon, start, end):
             logger.error(f"Estructura inesperada: {data}")
             raise RuntimeError("Estructura inesperada recibida desde Meteomatics.")
 
-        series = {}
-        for variable in data.get("data", []):
-            variable_name = variable.get("parameter")
-            coordinates = variable.get("coordinates", [])
-            if not variable_name or not coordinates:
-                continue
-            dates_list = coordinates[0].get("dates", [])
-            values = [{"datetime": val.get("date"), "value": val.get("value")} for val in dates_list if val.get("date") and val.get("value") is not None]
-            series[variable_name] = values
+        return data
 
-        if not series:
-            logger.warning("No se extrajeron datos de Meteomatics.")
-        else:
-            logger.info("Datos de Meteomatics obtenidos correctamente.")
-
-        return series
-
-    except requests.exceptions.HTTPError as http_err:
+    except httpx.HTTPStatusError as http_err:
         logger.error(f"HTTPError: {http_err}")
         raise RuntimeError(f"Error HTTP al consultar Meteomatics: {http_err}")
-    except requests.exceptions.RequestException as req_err:
+    except httpx.RequestError as req_err:
         logger.error(f"Error de conexión con Meteomatics: {req_err}")
         raise RuntimeError(f"Error de conexión con Meteomatics: {req_err}")
+    except RuntimeError:
+        raise
     except Exception as e:
         logger.error(f"Error desconocido Meteomatics: {e}")
         raise RuntimeError(f"Error desconocido al consultar Meteomatics: {e}")
+
+
+async def fetch_meteomatics_points(points, start, end, interval="PT1H"):
+    """
+    Una sola llamada a Meteomatics para varios puntos.
+    Retorna: {(lat, lon): TimeSeries}
+    """
+    data = await _request(build_url(points, start, end, interval))
+
+    raw_by_point = {point: {} for point in points}
+    for variable in data.get("data", []):
+        variable_name = variable.get("parameter")
+        coordinates = variable.get("coordinates", [])
+        if not variable_name or not coordinates:
+            continue
+        # Meteomatics devuelve las coordenadas en el mismo orden en que se pidieron
+        for point, coordinate in zip(points, coordinates):
+            raw_by_point[point][variable_name] = coordinate.get("dates", [])
+    by_point = {point: TimeSeries.from_meteomatics(variables) for point, variables in raw_by_point.items()}
+
+    if not any(len(series) for series in by_point.values()):
+        logger.warning("No se extrajeron datos de Meteomatics.")
+    else:
+        logger.info(f"Datos de Meteomatics obtenidos correctamente ({len(points)} puntos).")
+
+    return by_point
+
+
+# Agrupa las consultas concurrentes de distintos usuarios en llamadas multipunto
+planner = MeteomaticsPlanner(
+    fetch_meteomatics_points,
+    build_url,
+    window_ms=config.METEOMATICS_BATCH_WINDOW_MS,
+    max_points=config.METEOMATICS_MAX_POINTS_PER_CALL,
+    max_url_length=config.METEOMATICS_MAX_URL_LENGTH,
+    merge_max_days=config.METEOMATICS_MERGE_MAX_DAYS,
+)
+registry.register_stats("checknow_meteomatics_planner", "Consultas y llamadas multipunto a Meteomatics", planner.stats)
+
+
+@cached_provider("meteomatics", ttl=config.CACHE_TTL_METEOMATICS)
+async def fetch_meteomatics_node(lat, lon, start, end, interval="PT1H"):
+    """Serie de un nodo de la malla (cached_provider ya ajustó lat/lon al nodo)."""
+    return await planner.submit(lat, lon, start, end, interval)
+
+
+# ---------- ÁREAS (mapa de riesgo) ----------
+
+@cached_area("meteomatics_area", ttl=config.CACHE_TTL_METEOMATICS)
+async def fetch_meteomatics_area(south: float, west: float, north: float, east: float, resolution: float,
+                                 start: str, end: str, interval: str = "PT3H") -> AreaSeries:
+    """
+    Una sola llamada de área a Meteomatics ('norte,oeste_sur,este:res,res'): la API devuelve la
+    malla completa a la resolución pedida, en vez de una llamada por punto.
+    """
+    area = f"{north},{west}_{south},{east}:{resolution},{resolution}"
+    url = f"https://api.meteomatics.com/{start}T00:00:00Z--{end}T23:00:00Z:{interval}/{PARAMETERS}/{area}/json"
+    data = await _request(url)
+
+    variables = [v for v in data.get("data", []) if v.get("parameter") and v.get("coordinates")]
+    if not variables:
+        logger.warning("No se extrajeron datos de área de Meteomatics.")
+        return AreaSeries.concat([])
+    # Todas las variables traen las mismas coordenadas y fechas, en el mismo orden
+    coordinates = variables[0]["coordinates"]
+    points = np.array([(c["lat"], c["lon"]) for c in coordinates], dtype=np.float64)
+    times = np.array([d["date"].rstrip("Z") for d in coordinates[0].get("dates", [])], dtype="datetime64[s]")
+    values = np.full((len(points), len(times), len(variables)), np.nan, dtype=np.float32)
+    with stage("parse_meteomatics"):
+        for v, variable in enumerate(variables):
+            for n, coordinate in enumerate(variable["coordinates"]):
+                row = [np.nan if d.get("value") is None else d["value"] for d in coordinate.get("dates", [])]
+                values[n, :len(row), v] = row
+    logger.info(f"Área de Meteomatics obtenida ({len(points)} nodos).")
+    return AreaSeries(points, times, [v["parameter"] for v in variables], values)
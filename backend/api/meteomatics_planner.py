@@ -0,0 +1,135 @@
+import asyncio
+import logging
+from datetime import date
+
+from models.timeseries import TimeSeries
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class PendingQuery:
+    """Consulta de un usuario esperando a ser incluida en una llamada agrupada."""
+
+    def __init__(self, lat: float, lon: float, start: str, end: str, interval: str, future: asyncio.Future):
+        self.lat = lat
+        self.lon = lon
+        self.start = start
+        self.end = end
+        self.interval = interval
+        self.future = future
+
+
+class PlannedCall:
+    """Una llamada a Meteomatics: varios puntos y la unión de sus ventanas de tiempo."""
+
+    def __init__(self, interval: str, start: str, end: str):
+        self.interval = interval
+        self.start = start
+        self.end = end
+        self.points: list = []
+        self.queries: list = []
+
+    def span_days(self, start: str, end: str) -> int:
+        return (date.fromisoformat(max(end, self.end)) - date.fromisoformat(min(start, self.start))).days + 1
+
+
+class MeteomaticsPlanner:
+    """
+    Junta las consultas que llegan dentro de una ventana corta (window_ms) y las resuelve con
+    el menor número de llamadas: varios puntos 'lat,lon+lat,lon' y ventanas de días unidas,
+    respetando el máximo de puntos por llamada, el largo de la URL y el de la ventana unida.
+
+    fetch_points(points, start, end, interval) -> {(lat, lon): TimeSeries}   (async)
+    build_url(points, start, end, interval) -> str
+    """
+
+    def __init__(self, fetch_points, build_url, window_ms: float = 10, max_points: int = 50,
+                 max_url_length: int = 4000, merge_max_days: int = 3):
+        self.fetch_points = fetch_points
+        self.build_url = build_url
+        self.window = window_ms / 1000
+        self.max_points = max_points
+        self.max_url_length = max_url_length
+        self.merge_max_days = merge_max_days
+        self._pending: list = []
+        self._flush_handle = None
+        # Referencias fuertes: el loop solo guarda las tareas débilmente y una llamada en curso
+        # podría recolectarse dejando sin respuesta a las consultas que la esperan
+        self._calls: set = set()
+        self.counters = {"queries": 0, "upstream_calls": 0}
+
+    async def submit(self, lat: float, lon: float, start: str, end: str, interval: str = "PT1H") -> TimeSeries:
+        """Encola una consulta y espera su serie (solo las fechas start..end del punto)."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append(PendingQuery(lat, lon, start, end, interval, future))
+        self.counters["queries"] += 1
+        if len(self._pending) >= self.max_points:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        pending, self._pending = self._pending, []
+        pending = [q for q in pending if not q.future.done()]
+        if not pending:
+            return
+        calls = self.plan(pending)
+        logger.info(f"Meteomatics: {len(pending)} consultas agrupadas en {len(calls)} llamadas")
+        for call in calls:
+            task = asyncio.ensure_future(self._execute(call))
+            self._calls.add(task)
+            task.add_done_callback(self._calls.discard)
+
+    def plan(self, pending: list) -> list:
+        """Reparte las consultas en llamadas (mismo intervalo, ventanas cercanas, límites de URL)."""
+        calls: list = []
+        for query in sorted(pending, key=lambda q: (q.interval, q.start, q.end)):
+            point = (query.lat, query.lon)
+            for call in calls:
+                if call.interval != query.interval:
+                    continue
+                inside = call.start <= query.start and query.end <= call.end
+                if not inside and call.span_days(query.start, query.end) > self.merge_max_days:
+                    continue
+                if point not in call.points:
+                    if len(call.points) >= self.max_points:
+                        continue
+                    url = self.build_url(call.points + [point], min(call.start, query.start), max(call.end, query.end), call.interval)
+                    if len(url) > self.max_url_length:
+                        continue
+                    call.points.append(point)
+                call.start, call.end = min(call.start, query.start), max(call.end, query.end)
+                call.queries.append(query)
+                break
+            else:
+                call = PlannedCall(query.interval, query.start, query.end)
+                call.points.append(point)
+                call.queries.append(query)
+                calls.append(call)
+        return calls
+
+    async def _execute(self, call: PlannedCall):
+        self.counters["upstream_calls"] += 1
+        try:
+            by_point = await self.fetch_points(call.points, call.start, call.end, call.interval)
+        except Exception as e:
+            for query in call.queries:
+                if not query.future.done():
+                    query.future.set_exception(e)
+            return
+
+        for query in call.queries:
+            if query.future.done():
+                continue
+            series = by_point.get((query.lat, query.lon))
+            # Solo las fechas que pidió esta consulta (la llamada puede cubrir más días)
+            query.future.set_result(series.slice_dates(query.start, query.end) if series is not None else TimeSeries.empty())
+
+    def stats(self) -> dict:
+        return {**self.counters, "pending": len(self._pending), "in_flight": len(self._calls)}
@@ -0,0 +1,267 @@
+import asyncio
+import logging
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+import numpy as np
+
+from api.io import fetch_offline_nodes
+from api.meteomatics import fetch_meteomatics_area, fetch_meteomatics_node, missing_credentials
+from models.timeseries import AreaSeries, TimeSeries
+from services.cache import MISSING, weather_cache
+from services.climatology import climatology_store, rain_prediction_text
+from services.metrics import stage
+import config
+from services.nasa_power import HOURLY, fetch_nasa_power, fetch_nasa_power_range, fetch_nasa_power_regional
+from services.tiling import blend, locate
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+METEOMATICS = "meteomatics"
+NASA_POWER = "nasa_power"
+NASA_POWER_HOURLY = "nasa_power_hourly"
+
+
+def calculate_rain_prediction(data: TimeSeries) -> str:
+    """Calcula una probabilidad simple de lluvia para el día (horas con precipitación significativa)."""
+    precip_data = data.get("precip_1h:mm")
+    precip_data = precip_data[~np.isnan(precip_data)]
+    total_hours = len(precip_data)
+    if total_hours == 0:
+        return "No hay datos de precipitación disponibles"
+    rainy_hours = int(np.count_nonzero(precip_data > 0.1))
+    rain_prob = round((rainy_hours / total_hours) * 100, 1)
+    return f"Probabilidad aproximada de lluvia: {rain_prob}%"
+
+
+# ---------- PROVEEDORES ----------
+
+class WeatherProvider:
+    """
+    Un proveedor del pipeline de consulta (ver api/engine.py): cómo pedir un nodo de su malla,
+    cómo derivar la predicción de lluvia y cómo resumir sus variables en la respuesta.
+    Para agregar uno: subclase + register_provider(...).
+    """
+
+    name = ""
+    source = ""
+    # API externa detrás del proveedor: en una carrera (hedging) no se repite la misma API
+    upstream = ""
+    # Segundos que navegadores y CDN pueden reutilizar la respuesta (GET /query_weather)
+    http_max_age = 0
+    # La respuesta depende de la hora consultada (si no, la URL canónica lleva solo la fecha)
+    hourly = False
+
+    def unavailable(self) -> Optional[str]:
+        """Motivo por el que el proveedor no puede usarse (p. ej. faltan credenciales) o None."""
+        return None
+
+    def covers(self, day: date) -> bool:
+        """True si el proveedor tiene datos para ese día."""
+        return True
+
+    async def fetch_node(self, lat: float, lon: float, start: str, end: str) -> TimeSeries:
+        raise NotImplementedError
+
+    async def fetch_nodes(self, nodes: list, start: str, end: str) -> list:
+        """Series de varios nodos [(lat, lon), ...] en el mismo orden; por defecto un fetch_node por nodo."""
+        return list(await asyncio.gather(*(self.fetch_node(lat, lon, start, end) for lat, lon in nodes)))
+
+    def cache_key(self, lat: float, lon: float, start: str, end: str) -> Optional[str]:
+        """Clave del cache de fetch_node para el nodo (None si no se puede leer sin la red)."""
+        return None
+
+    async def fetch_area(self, south: float, west: float, north: float, east: float, resolution: float,
+                         day: str) -> AreaSeries:
+        """Todos los nodos de un rectángulo en una consulta de área (mapa de riesgo)."""
+        raise NotImplementedError
+
+    def rain_prediction(self, lat: float, lon: float, data: TimeSeries) -> str:
+        raise NotImplementedError
+
+    def summary(self, data: TimeSeries, at: Optional[datetime] = None) -> dict:
+        """Variables de la respuesta; at es la fecha/hora consultada (los diarios la ignoran)."""
+        raise NotImplementedError
+
+
+class MeteomaticsProvider(WeatherProvider):
+    """Pronóstico horario (hoy y días futuros)."""
+
+    name = METEOMATICS
+    source = "Meteomatics"
+    upstream = "meteomatics"
+    http_max_age = config.HTTP_MAX_AGE_METEOMATICS
+
+    def unavailable(self) -> Optional[str]:
+        return "faltan METEO_USER/METEO_PASS" if missing_credentials() else None
+
+    def covers(self, day: date) -> bool:
+        # Pronóstico y los últimos METEOMATICS_PAST_DAYS días
+        return day >= datetime.now().date() - timedelta(days=config.METEOMATICS_PAST_DAYS)
+
+    async def fetch_node(self, lat: float, lon: float, start: str, end: str) -> TimeSeries:
+        return await fetch_meteomatics_node(lat, lon, start, end)
+
+    def cache_key(self, lat: float, lon: float, start: str, end: str) -> Optional[str]:
+        return fetch_meteomatics_node.cache_key(lat, lon, start, end)
+
+    async def fetch_area(self, south: float, west: float, north: float, east: float, resolution: float,
+                         day: str) -> AreaSeries:
+        # Meteomatics interpola directamente a la resolución pedida
+        return await fetch_meteomatics_area(south, west, north, east, resolution, day, day,
+                                            interval=config.RISK_GRID_METEOMATICS_INTERVAL)
+
+    def rain_prediction(self, lat: float, lon: float, data: TimeSeries) -> str:
+        return calculate_rain_prediction(data)
+
+    def summary(self, data: TimeSeries, at: Optional[datetime] = None) -> dict:
+        # Valores de la primera hora
+        temp = data.first("t_2m:C")
+        precip = data.first("precip_1h:mm")
+        wind = data.first("wind_speed_10m:ms")
+        solar = data.first("global_rad:wm2")
+        return {
+            "temperature": f"{temp}°C" if temp is not None else "--",
+            "precipitation": f"{precip} mm" if precip is not None else "--",
+            "wind": f"{wind} m/s" if wind is not None else "--",
+            "solarRadiation": f"{solar} W/m²" if solar is not None else "--",
+        }
+
+
+class NasaPowerProvider(WeatherProvider):
+    """Histórico diario: primero el dataset local (sin red), luego NASA POWER."""
+
+    name = NASA_POWER
+    source = "NASA POWER"
+    upstream = "nasa_power"
+    http_max_age = config.HTTP_MAX_AGE_NASA_POWER
+
+    def covers(self, day: date) -> bool:
+        # Hoy nunca: NASA POWER publica con días de retraso (solo valores de relleno)
+        return day < datetime.now().date()
+
+    async def fetch_node(self, lat: float, lon: float, start: str, end: str) -> TimeSeries:
+        [series] = await self.fetch_nodes([(lat, lon)], start, end)
+        return series
+
+    async def fetch_nodes(self, nodes: list, start: str, end: str) -> list:
+        # Todos los nodos salen del dataset local en una sola lectura; si no lo cubre, NASA POWER por nodo
+        with stage("offline"):
+            offline = await fetch_offline_nodes(nodes, start, end)
+        if offline is not None:
+            return offline
+        return list(await asyncio.gather(*(fetch_nasa_power(lat, lon, start, end) for lat, lon in nodes)))
+
+    def cache_key(self, lat: float, lon: float, start: str, end: str) -> Optional[str]:
+        return fetch_nasa_power.cache_key(lat, lon, start, end)
+
+    async def fetch_area(self, south: float, west: float, north: float, east: float, resolution: float,
+                         day: str) -> AreaSeries:
+        # Malla nativa (0.5° × 0.625°); se lleva a la resolución pedida por nodo más cercano
+        return await fetch_nasa_power_regional(south, west, north, east, day, day)
+
+    def rain_prediction(self, lat: float, lon: float, data: TimeSeries) -> str:
+        # Probabilidad climatológica del día (si la celda ya fue precalculada)
+        with stage("climatology"):
+            climatology = climatology_store.lookup(lat, lon, data.times[0].astype(object).date()) if len(data) else None
+        return rain_prediction_text(climatology) or "Datos históricos no incluyen predicción de lluvia."
+
+    def summary(self, data: TimeSeries, at: Optional[datetime] = None) -> dict:
+        # Valores del día consultado; el set de parámetros simple no trae viento
+        temp = data.first("T2M")
+        precip = data.first("PRECTOT")
+        solar = data.first("ALLSKY_SFC_SW_DWN")
+        return {
+            "temperature": f"{temp}°C" if temp is not None else "--",
+            "precipitation": f"{precip} mm" if precip is not None else "--",
+            "wind": "N/A",
+            "solarRadiation": f"{solar} W/m²" if solar is not None else "--",
+        }
+
+
+class NasaPowerHourlyProvider(NasaPowerProvider):
+    """Histórico horario (consultas pasadas con hora): endpoint horario de NASA POWER, hora solar local."""
+
+    name = NASA_POWER_HOURLY
+    source = "NASA POWER (horario)"
+    hourly = True
+
+    async def fetch_node(self, lat: float, lon: float, start: str, end: str) -> TimeSeries:
+        return await fetch_nasa_power_range(lat, lon, start, end, resolution=HOURLY)
+
+    async def fetch_nodes(self, nodes: list, start: str, end: str) -> list:
+        # El dataset local es diario: sin lectura agrupada
+        return await WeatherProvider.fetch_nodes(self, nodes, start, end)
+
+    def cache_key(self, lat: float, lon: float, start: str, end: str) -> Optional[str]:
+        # El rango horario se guarda por tramos: no hay una clave única por nodo
+        return None
+
+    def summary(self, data: TimeSeries, at: Optional[datetime] = None) -> dict:
+        # Valores de la hora consultada (o la primera del día si no se indica)
+        def value(name):
+            return data.value_at(name, at) if at is not None else data.first(name)
+
+        temp = value("T2M")
+        precip = value("PRECTOTCORR")
+        wind = value("WS10M")
+        solar = value("ALLSKY_SFC_SW_DWN")
+        return {
+            "temperature": f"{temp}°C" if temp is not None else "--",
+            "precipitation": f"{precip} mm" if precip is not None else "--",
+            "wind": f"{wind} m/s" if wind is not None else "--",
+            "solarRadiation": f"{solar} W/m²" if solar is not None else "--",
+        }
+
+
+PROVIDERS: dict = {}
+
+
+def register_provider(provider: WeatherProvider):
+    PROVIDERS[provider.name] = provider
+
+
+register_provider(MeteomaticsProvider())
+register_provider(NasaPowerProvider())
+register_provider(NasaPowerHourlyProvider())
+
+
+def choose_provider(query_dt: datetime, with_time: bool = False) -> str:
+    """
+    Pronóstico (hoy o futuro) -> Meteomatics; pasado -> NASA POWER, horario si la consulta
+    trae hora (YYYY-MM-DDTHH:MM) y NASA_POWER_HOURLY está activo.
+    """
+    if query_dt.date() >= datetime.now().date():
+        return METEOMATICS
+    return NASA_POWER_HOURLY if with_time and config.NASA_POWER_HOURLY else NASA_POWER
+
+
+# ---------- DATOS EN LA MALLA ----------
+
+async def fetch_nodes(provider: str, nodes: list, start: str, end: str) -> list:
+    """Series de varios nodos de la malla del proveedor, en el orden de nodes."""
+    return await PROVIDERS[provider].fetch_nodes(nodes, start, end)
+
+
+async def fetch_point(provider: str, lat: float, lon: float, start: str, end: str) -> TimeSeries:
+    """Serie interpolada en el punto exacto a partir de los nodos que lo rodean."""
+    _, nodes, weights = locate(provider, lat, lon)
+    return blend(await fetch_nodes(provider, nodes, start, end), weights)
+
+
+def cached_point(provider: str, lat: float, lon: float, start: str, end: str) -> Optional[TimeSeries]:
+    """
+    Serie en el punto solo con lo que ya está en memoria, aunque haya vencido (sin red).
+    None si falta algún nodo. Se usa para responder algo cuando se agota el plazo de la consulta.
+    """
+    spec = PROVIDERS[provider]
+    _, nodes, weights = locate(provider, lat, lon)
+    series = []
+    for node_lat, node_lon in nodes:
+        key = spec.cache_key(node_lat, node_lon, start, end)
+        value = MISSING if key is None else weather_cache.memory.get_stale(key)
+        if value is MISSING:
+            return None
+        series.append(value)
+    return blend(series, weights)
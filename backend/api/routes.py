@@ -1,114 +1,23 @@
-from fastapi import APIRouter, Query, HTTPException
+from fastapi import APIRouter, Query, HTTPException, Header, Request
 from typing import Optional
-from datetime import datetime, date
-from api.meteomatics import fetch_meteomatics_timeseries 
-from geopy.geocoders import Nominatim
-from services.nasa_power import fetch_nasa_power 
+from api.models import WeatherQueryData
+from api.engine import engine
+from services import fast_json
+from services.climatology import climatology_store, rain_prediction_text
+from services.deadline import Deadline
+from services.nasa_power import DAILY, HOURLY, fetch_nasa_power_climatology, fetch_nasa_power_range
 import logging
 
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
-geolocator = Nominatim(user_agent="check_now_app")
-
-# ---------- VALIDACIONES Y UTILS ----------
-
-def validate_date_input(date_str: str):
-    """Valida y convierte una cadena YYYY-MM-DD o YYYY-MM-DDT... a objeto datetime."""
-    try:
-        # Intenta parsear como datetime completo (con hora)
-        return datetime.strptime(date_str, "%Y-%m-%dT%H:%M")
-    except ValueError:
-        try:
-            # Si falla, intenta parsear solo la fecha
-            return datetime.strptime(date_str, "%Y-%m-%d")
-        except ValueError:
-            raise HTTPException(status_code=400, detail=f"Fecha/Hora inválida: {date_str}. Usar YYYY-MM-DDTmm:ss o YYYY-MM-DD")
-
-def validate_lat_lon(lat: float, lon: float):
-    if not (-90 <= lat <= 90) or not (-180 <= lon <= 180):
-        raise HTTPException(status_code=400, detail=f"Lat/Lon fuera de rango: lat={lat}, lon={lon}")
-
-def get_lat_lon_from_location(country: Optional[str], city: Optional[str], locality: Optional[str]):
-    """Obtiene Lat/Lon usando Nominatim basado en los campos disponibles."""
-    query_parts = [p for p in [locality, city, country] if p]
-    if not query_parts:
-        raise HTTPException(status_code=400, detail="Debe proporcionar coordenadas o al menos un campo de ubicación.")
-    
-    query = ", ".join(query_parts)
-    location = geolocator.geocode(query, timeout=10)
-    
-    if not location:
-        raise HTTPException(status_code=404, detail=f"No se encontró la ubicación: {query}")
-        
-    return location.latitude, location.longitude
-
-def calculate_rain_prediction(data: dict) -> str:
-    """Calcula una probabilidad simple de lluvia para el día."""
-    precip_data = data.get("precip_1h:mm", [])
-    total_hours = len(precip_data)
-    if total_hours == 0:
-        return "No hay datos de precipitación disponibles"
-    else:
-        # Cuenta horas con precipitación significativa
-        rainy_hours = sum(1 for h in precip_data if h["value"] > 0.1)
-        rain_prob = round((rainy_hours / total_hours) * 100, 1)
-        return f"Probabilidad aproximada de lluvia: {rain_prob}%"
-
-def format_weather_response(data: dict, rain_prediction: str) -> dict:
-    """Extrae y formatea los valores clave de los datos de Meteomatics (pronóstico)."""
-    
-    # Intenta obtener el valor de la temperatura, precipitación, etc., para la primera hora
-    def get_first_value(key):
-        values = data.get(key, [])
-        return values[0]['value'] if values and values[0].get('value') is not None else None
-
-    temp = get_first_value("t_2m:C")
-    precip = get_first_value("precip_1h:mm")
-    wind = get_first_value("wind_speed_10m:ms")
-    solar = get_first_value("global_rad:wm2")
-
-    return {
-        "temperature": f"{temp}°C" if temp is not None else "--",
-        "precipitation": f"{precip} mm" if precip is not None else "--",
-        "wind": f"{wind} m/s" if wind is not None else "--",
-        "solarRadiation": f"{solar} W/m²" if solar is not None else "--",
-        "rain_prediction": rain_prediction,
-        "raw_data": data # Opcional: para el debug
-    }
-
-def format_nasa_response(data: dict) -> dict:
-    """Extrae y formatea los valores clave de los datos de NASA POWER (histórico)."""
-    
-    props = data.get("properties", {})
-    parameter = props.get("parameter", {})
-    
-    # Promedios del día consultado (solo si la consulta es de un día)
-    temp = parameter.get("T2M", {}).get("20240101") # Asume que solo se consulta 1 día
-    precip = parameter.get("PRECTOT", {}).get("20240101")
-    solar = parameter.get("ALLSKY_SFC_SW_DWN", {}).get("20240101")
-    
-    # NASA no da viento directamente en el set de parámetros simples
-    wind = None 
-
-    # Se necesita adaptar la extracción de datos al formato real que devuelve NASA POWER
-    # (El formato de ejemplo "20240101" es una suposición, debe coincidir con el código de servicios/nasa_power.py)
-    
-    return {
-        "temperature": f"{temp}°C" if temp is not None else "--",
-        "precipitation": f"{precip} mm" if precip is not None else "--",
-        "wind": f"N/A" if wind is None else f"{wind} m/s", 
-        "solarRadiation": f"{solar} W/m²" if solar is not None else "--",
-        "rain_prediction": "Datos históricos no incluyen predicción de lluvia.",
-        "raw_data": data
-    }
-
-
 # ---------- ENDPOINTS UNIFICADOS ----------
+# Todo el pipeline (ubicación, proveedor, datos, respuesta) vive en api/engine.py
 
 @router.post("/query_weather")
 async def query_weather(
+    request: Request,
     # Lat/Lon son opcionales, si se usan, tienen prioridad
     lat: Optional[float] = None,
     lon: Optional[float] = None,
@@ -117,78 +26,177 @@ async def query_weather(
     city: Optional[str] = None,
     locality: Optional[str] = None,
     # Fecha/hora (requerida)
-    dateTime: str = Query(..., description="Fecha y hora (YYYY-MM-DDTmm:ss)")
+    dateTime: str = Query(..., description="Fecha y hora (YYYY-MM-DDTHH:MM)"),
+    # Serie completa del proveedor (debug); no se envía por defecto
+    raw_data: bool = Query(False, description="Incluir la serie completa en raw_data")
+):
+    query = WeatherQueryData(lat=lat, lon=lon, country=country, city=city, locality=locality, dateTime=dateTime)
+    # Plazo de la consulta: cabecera X-Request-Deadline-Ms o REQUEST_DEADLINE_MS
+    return await engine.query(query, raw_data, Deadline.from_request(request))
+
+
+@router.get("/query_weather")
+async def query_weather_get(
+    request: Request,
+    lat: Optional[float] = None,
+    lon: Optional[float] = None,
+    country: Optional[str] = None,
+    city: Optional[str] = None,
+    locality: Optional[str] = None,
+    dateTime: str = Query(..., description="Fecha y hora (YYYY-MM-DDTHH:MM)"),
+    raw_data: bool = False,
+    if_none_match: Optional[str] = Header(None)
 ):
-    
-    # 1. DETERMINAR LAT/LON
-    if lat is None or lon is None:
-        lat_final, lon_final = get_lat_lon_from_location(country, city, locality)
-    else:
-        validate_lat_lon(lat, lon)
-        lat_final, lon_final = lat, lon
-        
-    # 2. VALIDAR FECHA
-    query_dt = validate_date_input(dateTime)
-    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-    
-    # Para la consulta de datos (la API de Meteomatics requiere solo la fecha)
-    query_date_str = query_dt.strftime("%Y-%m-%d")
-    
-    # 3. ESCOGER LA API (Futuro/Presente vs. Histórico)
-    is_future = query_dt.date() >= today.date()
-    
-    if is_future:
-        # A. Datos de PRONÓSTICO (Meteomatics)
-        try:
-            # Buscamos datos solo para el día y hora especificados
-            data = fetch_meteomatics_timeseries(
-                lat_final, 
-                lon_final, 
-                query_date_str, 
-                query_date_str,
-                interval="PT1H" # Intervalo horario para obtener datos cercanos a la hora
-            )
-
-            if not isinstance(data, dict) or "error" in data:
-                 raise HTTPException(status_code=502, detail=f"Error desde Meteomatics: {data.get('error', str(data))}")
-
-            rain_prediction = calculate_rain_prediction(data)
-            
-            # Formateamos solo el punto de tiempo más cercano a la hora
-            return {
-                "status": "success", 
-                "source": "Meteomatics", 
-                "location": {"lat": lat_final, "lon": lon_final},
-                **format_weather_response(data, rain_prediction)
-            }
-
-        except Exception as e:
-            logger.error(f"Error en query_weather (Meteomatics): {e}")
-            raise HTTPException(status_code=500, detail=f"Error al obtener pronóstico: {str(e)}")
-
-    else:
-        # B. Datos HISTÓRICOS (NASA POWER)
-        try:
-            # NASA POWER requiere solo la fecha de inicio/fin
-            nasa_data = fetch_nasa_power(
-                lat_final, 
-                lon_final, 
-                query_date_str, 
-                query_date_str,
-                parameters="T2M,PRECTOT,ALLSKY_SFC_SW_DWN", 
-                community="AG"
-            )
-            
-            if "errors" in nasa_data or not nasa_data.get("properties"):
-                raise HTTPException(status_code=502, detail="NASA POWER devolvió error o datos vacíos")
-
-            return {
-                "status": "success", 
-                "source": "NASA POWER",
-                "location": {"lat": lat_final, "lon": lon_final},
-                **format_nasa_response(nasa_data)
-            }
-            
-        except Exception as e:
-            logger.error(f"Error en query_weather (NASA): {e}")
-            raise HTTPException(status_code=500, detail=f"Error al obtener datos históricos: {str(e)}")
\ No newline at end of file
+    """
+    Variante cacheable de /query_weather (navegador y CDN): redirige a la URL canónica, envía
+    ETag y Cache-Control según la fuente y responde 304 a If-None-Match.
+    """
+    query = WeatherQueryData(lat=lat, lon=lon, country=country, city=city, locality=locality, dateTime=dateTime)
+    return await engine.query_cached(query, raw_data, if_none_match, request.url.path, request.url.query,
+                                     Deadline.from_request(request))
+
+
+@router.post("/query_weather/batch")
+async def query_weather_batch(request: Request, queries: list[WeatherQueryData], raw_data: bool = False):
+    """
+    Consulta muchas ubicaciones/fechas en una sola petición. Las consultas de la misma celda
+    y fechas cercanas comparten la llamada al proveedor. Responde NDJSON en el orden de entrada.
+    X-Request-Deadline-Ms acota cada geocodificación; al agotarse esa línea es partial.
+    """
+    return await engine.batch(queries, raw_data, Deadline.from_request(request))
+
+
+@router.post("/query_weather/stream")
+async def query_weather_stream(
+    request: Request,
+    lat: Optional[float] = None,
+    lon: Optional[float] = None,
+    country: Optional[str] = None,
+    city: Optional[str] = None,
+    locality: Optional[str] = None,
+    dateTime: str = Query(..., description="Fecha y hora (YYYY-MM-DDTHH:MM)"),
+    raw_data: bool = False,
+    accept: Optional[str] = Header(None)
+):
+    """
+    Igual que /query_weather pero envía cada parte en cuanto está lista (SSE, o NDJSON con
+    Accept: application/x-ndjson): ubicación, climatología, datos del proveedor y riesgos.
+    """
+    query = WeatherQueryData(lat=lat, lon=lon, country=country, city=city, locality=locality, dateTime=dateTime)
+    return await engine.stream(query, accept, raw_data, Deadline.from_request(request))
+
+
+@router.get("/climatology")
+async def climatology(
+    lat: float,
+    lon: float,
+    date_query: str = Query(..., description="Fecha (YYYY-MM-DD), cualquier año")
+):
+    """
+    Probabilidad de lluvia y percentiles de precipitación/temperatura para ese día del año,
+    precalculados con décadas de NASA POWER. No llama a ningún proveedor.
+    """
+    engine.validate_lat_lon(lat, lon)
+    query_dt = engine.validate_date(date_query)
+    result = climatology_store.lookup(lat, lon, query_dt.date())
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"No hay climatología precalculada para lat={lat}, lon={lon}")
+    return {
+        "status": "success",
+        "source": "NASA POWER (climatología)",
+        "location": {"lat": lat, "lon": lon},
+        "date": query_dt.date().isoformat(),
+        "rain_prediction": rain_prediction_text(result),
+        "climatology": result
+    }
+
+
+# ---------- HISTÓRICO NASA POWER ----------
+
+@router.get("/history")
+async def history(
+    lat: float,
+    lon: float,
+    start: str = Query(..., description="Primer día (YYYY-MM-DD)"),
+    end: str = Query(..., description="Último día (YYYY-MM-DD)"),
+    resolution: str = Query(DAILY, description="daily u hourly")
+):
+    """
+    Serie histórica de NASA POWER para un rango de cualquier longitud. El rango se pide en
+    tramos paralelos que quedan en el cache: un rango que se solapa con otro ya consultado
+    solo descarga los días que faltan. Las horas (hourly) son de tiempo solar local.
+    """
+    engine.validate_lat_lon(lat, lon)
+    if resolution not in (DAILY, HOURLY):
+        raise HTTPException(status_code=400, detail=f"Resolución inválida: {resolution}. Usar daily u hourly")
+    first, last = engine.validate_date(start), engine.validate_date(end)
+    if first > last:
+        raise HTTPException(status_code=400, detail="start debe ser anterior o igual a end")
+    try:
+        series = await fetch_nasa_power_range(lat, lon, first.date().isoformat(), last.date().isoformat(), resolution=resolution)
+    except RuntimeError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    body = {
+        "status": "success",
+        "source": "NASA POWER",
+        "location": {"lat": lat, "lon": lon},
+        "resolution": resolution,
+        "start": first.date().isoformat(),
+        "end": last.date().isoformat(),
+        "count": len(series),
+    }
+    return fast_json.response(body, data=series.records_json())
+
+
+@router.get("/history/climatology")
+async def history_climatology(
+    lat: float,
+    lon: float,
+    start_year: int = Query(..., description="Primer año (YYYY)"),
+    end_year: int = Query(..., description="Último año (YYYY)")
+):
+    """Promedios mensuales y anual de NASA POWER (endpoint climatology) para los años indicados."""
+    engine.validate_lat_lon(lat, lon)
+    if start_year > end_year:
+        raise HTTPException(status_code=400, detail="start_year debe ser anterior o igual a end_year")
+    try:
+        monthly = await fetch_nasa_power_climatology(lat, lon, str(start_year), str(end_year))
+    except RuntimeError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    return {
+        "status": "success",
+        "source": "NASA POWER (climatology)",
+        "location": {"lat": lat, "lon": lon},
+        "years": [start_year, end_year],
+        "climatology": monthly
+    }
+
+
+# ---------- MAPA DE RIESGO ----------
+
+@router.get("/risk_grid")
+async def risk_grid(
+    request: Request,
+    south: float,
+    west: float,
+    north: float,
+    east: float,
+    date_query: str = Query(..., alias="date", description="Fecha (YYYY-MM-DD)"),
+    resolution: float = Query(0.25, description="Separación de la malla (grados)"),
+    format: str = Query("json", description="json, npy o png"),
+    layer: str = Query("wet", description="Capa del PNG: hot, cold, windy o wet")
+):
+    """
+    Riesgos (hot, cold, windy, wet) de todo un rectángulo para un día, con una consulta de área
+    al proveedor en vez de una por punto. Para el globo del frontend: PNG de una capa o .npy.
+    """
+    return await engine.risk_grid(south, west, north, east, resolution, date_query, format, layer,
+                                  Deadline.from_request(request))
+
+
+# ---------- DIAGNÓSTICO ----------
+
+@router.get("/cache/stats")
+async def cache_stats():
+    """Contadores de aciertos/fallos del cache, peticiones deduplicadas y geocodificación."""
+    return engine.stats()
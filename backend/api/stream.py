@@ -0,0 +1,115 @@
+import asyncio
+import logging
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+from models.risk_model import compute_risk_probabilities
+from services.climatology import climatology_store, rain_prediction_text
+from services.deadline import DeadlineExceeded, deadline_counters
+from services import fast_json
+from services.metrics import stage
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+NDJSON = "application/x-ndjson"
+SSE = "text/event-stream"
+
+
+def _encode(event: str, payload: dict, ndjson: bool) -> bytes:
+    if ndjson:
+        return fast_json.dumps_line({"event": event, **payload})
+    return b"event: " + event.encode() + b"\ndata: " + fast_json.dumps(payload) + b"\n\n"
+
+
+def _error(e: Exception) -> dict:
+    if isinstance(e, HTTPException):
+        return {"status_code": e.status_code, "detail": str(e.detail)}
+    return {"status_code": 502, "detail": str(e)}
+
+
+async def stream_query(engine, query, ndjson: bool = False, raw_data: bool = False, deadline=None):
+    """
+    Una consulta (WeatherQueryData) como flujo de eventos, cada uno en cuanto está disponible:
+    location -> cached (serie que ya está en memoria, aunque esté vencida) -> climatology (si la
+    celda está precalculada) -> weather -> risk -> done.
+    Los datos se obtienen como en engine.answer: si el proveedor falla, weather es la respuesta
+    con la climatología (degraded) y no hay risk; sin climatología se envía error y el flujo
+    termina. Con deadline (services/deadline.py) una etapa que no alcanza se cancela y se envía
+    un evento partial con lo que falta antes de done.
+    Las etapas son las del WeatherQueryEngine; la fecha y las coordenadas se validan antes de empezar.
+    """
+    query_dt, provider = engine.plan(query)
+    if query.lat is not None and query.lon is not None:
+        engine.validate_lat_lon(query.lat, query.lon)
+    day = query_dt.date()
+
+    async def run(stage_name: str, awaitable):
+        return await (deadline.run(stage_name, awaitable) if deadline is not None else awaitable)
+
+    async def events():
+        try:
+            lat, lon = await run("location", engine.resolve_location(
+                query.lat, query.lon, query.country, query.city, query.locality, deadline))
+        except DeadlineExceeded as e:
+            yield _encode("partial", engine.partial(e, query_dt, provider), ndjson)
+            yield _encode("done", {}, ndjson)
+            return
+        except Exception as e:
+            yield _encode("error", _error(e), ndjson)
+            return
+        yield _encode("location", {"lat": lat, "lon": lon}, ndjson)
+
+        # La llamada al proveedor arranca ya; lo que hay en cache y la climatología se envían mientras tanto
+        fetch = asyncio.ensure_future(run("weather", engine.answer(query_dt, provider, lat, lon, deadline=deadline)))
+        try:
+            cached = engine.cached_answer(query_dt, provider, lat, lon)
+            if cached is not None:
+                yield _encode("cached", {**cached, "status": "cached"}, ndjson)
+            climatology = climatology_store.lookup(lat, lon, day)
+            if climatology is not None:
+                yield _encode("climatology", {"rain_prediction": rain_prediction_text(climatology), "climatology": climatology}, ndjson)
+
+            winner, data = await fetch
+            if winner is None:
+                # Proveedor caído: la misma respuesta degradada que /query_weather, sin serie para los riesgos
+                yield _encode("weather", data, ndjson)
+            else:
+                yield _encode("weather", engine.respond(winner, lat, lon, data, raw_data, at=query_dt), ndjson)
+                try:
+                    with stage("risk"):
+                        risk = await run("risk", asyncio.to_thread(compute_risk_probabilities, data))
+                    yield _encode("risk", {"risk": risk}, ndjson)
+                except RuntimeError as e:
+                    logger.warning(f"Sin riesgos para {lat},{lon} {day}: {e}")
+        except DeadlineExceeded as e:
+            if e.stage == "weather":
+                yield _encode("partial", engine.partial(e, query_dt, provider, (lat, lon)), ndjson)
+            else:
+                # Los datos ya se enviaron: solo faltan los riesgos
+                deadline_counters["partial"] += 1
+                yield _encode("partial", {"status": "partial", "missing": ["risk"], "detail": str(e)}, ndjson)
+        except Exception as e:
+            logger.error(f"Error en consulta en streaming: {e}")
+            yield _encode("error", _error(e), ndjson)
+            return
+        finally:
+            # Si el cliente se desconecta se cancela la llamada pendiente
+            fetch.cancel()
+        yield _encode("done", {}, ndjson)
+
+    return events()
+
+
+def wants_ndjson(accept: str) -> bool:
+    """SSE por defecto; NDJSON si el cliente lo pide en la cabecera Accept."""
+    return NDJSON in (accept or "")
+
+
+def streaming_response(events, ndjson: bool) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type=NDJSON if ndjson else SSE,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
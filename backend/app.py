@@ -2,7 +2,18 @@
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
 from api.routes import router as api_router
+from api.engine import engine
+from services.http_client import close_clients
+from api.io import close_gridded
+from services.geocoder import geocoder
+from services.metrics import registry, metrics_middleware, start_loop_lag_monitor
+from fastapi.responses import PlainTextResponse
+from services.prefetch import prefetcher
+from services.fast_json import FastJSONResponse
+import config
+import asyncio
 import logging
 import os # Necesario para usar getenv
 from dotenv import load_dotenv 
@@ -16,10 +27,31 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Índice local de lugares (GeoNames), fuera del event loop
+    await asyncio.to_thread(geocoder.load)
+    # Un proveedor sin credenciales queda no disponible (503 / climatología) en vez de impedir el arranque
+    engine.check_providers()
+    lag_monitor = start_loop_lag_monitor()
+    # Mantiene calientes en el cache las consultas populares
+    prefetch_task = prefetcher.start() if config.PREFETCH_ENABLED else None
+    yield
+    lag_monitor.cancel()
+    if prefetch_task is not None:
+        prefetch_task.cancel()
+    # Cierra los pools HTTP compartidos de Meteomatics / NASA POWER y los datasets locales
+    await close_clients()
+    close_gridded()
+
+
 app = FastAPI(
     title="Check-now",
     description="API for querying weather conditions and risks using Meteomatics",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse
 )
 
 origins = [
@@ -34,8 +66,15 @@ app.add_middleware(
     allow_methods=["*"],       # Permite todos los métodos, incluyendo OPTIONS y POST
     allow_headers=["*"],       
 )
+app.middleware("http")(metrics_middleware)
 
 # -------------------------------------------------------------
 
 # El router api.routes.py ahora puede importar meteomatics.py, que leerá las variables
-app.include_router(api_router, prefix="/api")
\ No newline at end of file
+app.include_router(api_router, prefix="/api")
+
+
+@app.get("/metrics")
+async def metrics():
+    """Métricas en formato de texto de Prometheus (latencia por etapa, proveedores, caches, event loop)."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,68 @@
+"""
+Servidor Redis falso en memoria para probar el cache compartido sin Redis:
+
+    from services.cache import RedisCache
+    store = RedisCache(FakeRedis())
+
+Implementa solo los comandos que usa RedisCache, con la misma semántica de expiración.
+"""
+import threading
+import time
+
+
+class FakeRedis:
+    def __init__(self):
+        self._data: dict = {}  # clave -> (valor en bytes, expira en time.time() o None)
+        self._lock = threading.Lock()
+
+    def _live(self, name: str):
+        entry = self._data.get(name)
+        if entry is not None and entry[1] is not None and entry[1] <= time.time():
+            del self._data[name]
+            return None
+        return entry
+
+    @staticmethod
+    def _bytes(value) -> bytes:
+        return value if isinstance(value, bytes) else str(value).encode()
+
+    def get(self, name: str):
+        with self._lock:
+            entry = self._live(name)
+            return None if entry is None else entry[0]
+
+    def set(self, name: str, value, nx: bool = False, px: int = None):
+        with self._lock:
+            if nx and self._live(name) is not None:
+                return None
+            self._data[name] = (self._bytes(value), time.time() + px / 1000 if px else None)
+            return True
+
+    def pttl(self, name: str) -> int:
+        with self._lock:
+            entry = self._live(name)
+            if entry is None:
+                return -2
+            return -1 if entry[1] is None else int((entry[1] - time.time()) * 1000)
+
+    def incr(self, name: str) -> int:
+        with self._lock:
+            entry = self._live(name)
+            count = (int(entry[0]) if entry else 0) + 1
+            self._data[name] = (str(count).encode(), entry[1] if entry else None)
+            return count
+
+    def pexpire(self, name: str, ms: int) -> bool:
+        with self._lock:
+            entry = self._live(name)
+            if entry is None:
+                return False
+            self._data[name] = (entry[0], time.time() + ms / 1000)
+            return True
+
+    def expire(self, name: str, seconds: int) -> bool:
+        return self.pexpire(name, seconds * 1000)
+
+    def delete(self, name: str) -> int:
+        with self._lock:
+            return 1 if self._data.pop(name, None) is not None else 0
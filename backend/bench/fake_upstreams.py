@@ -0,0 +1,127 @@
+import asyncio
+import random
+import time
+from collections import Counter
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+import httpx
+
+
+class FakeUpstreams(httpx.AsyncBaseTransport):
+    """
+    Sustitutos locales de Meteomatics y NASA POWER para services.http_client.
+    Responden con datos sintéticos con la latencia (ms, ± jitter) y la tasa de errores indicadas
+    y cuentan las llamadas por host.
+    """
+
+    def __init__(self, latency_ms: float = 200, jitter_ms: float = 50, error_rate: float = 0.0, seed: int = 0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.calls = Counter()
+
+    async def _delay(self):
+        delay = max(0.0, self.latency_ms + self.random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+        await asyncio.sleep(delay)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        self.calls[host] += 1
+        await self._delay()
+        if self.random.random() < self.error_rate:
+            return httpx.Response(503, request=request, text="Fallo simulado")
+        if "meteomatics" in host:
+            return httpx.Response(200, request=request, json=self._meteomatics(request))
+        if "power.larc.nasa.gov" in host:
+            return httpx.Response(200, request=request, json=self._nasa_power(request))
+        return httpx.Response(404, request=request)
+
+    def _meteomatics(self, request: httpx.Request) -> dict:
+        # /{inicio}--{fin}:{intervalo}/{parámetros}/{lat,lon+lat,lon | norte,oeste_sur,este:res,res}/json
+        _, window, parameters, coordinates, _ = request.url.path.split("/", 4)
+        start, end = window.split("--")
+        first, last = date.fromisoformat(start[:10]), date.fromisoformat(end[:10])
+        step = int(end.rsplit(":PT", 1)[1].rstrip("H")) if ":PT" in end else 1
+        stamps = []
+        day = first
+        while day <= last:
+            stamps += [f"{day.isoformat()}T{hour:02d}:00:00Z" for hour in range(0, 24, step)]
+            day += timedelta(days=1)
+        if "_" in coordinates:
+            corners, resolution = coordinates.split(":")
+            (north, west), (south, east) = (tuple(float(x) for x in c.split(",")) for c in corners.split("_"))
+            res = float(resolution.split(",")[0])
+            rows, cols = int(round((north - south) / res)) + 1, int(round((east - west) / res)) + 1
+            points = [(round(north - i * res, 6), round(west + j * res, 6)) for i in range(rows) for j in range(cols)]
+        else:
+            points = [tuple(float(x) for x in p.split(",")) for p in coordinates.split("+")]
+        return {
+            "data": [
+                {
+                    "parameter": parameter,
+                    "coordinates": [
+                        {"lat": lat, "lon": lon, "dates": [{"date": s, "value": round(self.random.uniform(0, 30), 1)} for s in stamps]}
+                        for lat, lon in points
+                    ],
+                }
+                for parameter in parameters.split(",")
+            ]
+        }
+
+    def _nasa_power(self, request: httpx.Request) -> dict:
+        params = request.url.params
+        names = params["parameters"].split(",")
+        if "/climatology/" in request.url.path:
+            months = ["JAN", "FEB", "MAR", "APR", "MAY", "JUN", "JUL", "AUG", "SEP", "OCT", "NOV", "DEC", "ANN"]
+            return {
+                "header": {"fill_value": -999.0},
+                "properties": {"parameter": {name: {m: round(self.random.uniform(0, 30), 2) for m in months} for name in names}},
+            }
+        first = date(int(params["start"][:4]), int(params["start"][4:6]), int(params["start"][6:8]))
+        last = date(int(params["end"][:4]), int(params["end"][4:6]), int(params["end"][6:8]))
+        days = [(first + timedelta(days=i)).strftime("%Y%m%d") for i in range((last - first).days + 1)]
+        if "/regional" in request.url.path:
+            lat_min, lat_max = float(params["latitude-min"]), float(params["latitude-max"])
+            lon_min, lon_max = float(params["longitude-min"]), float(params["longitude-max"])
+            lats = [lat_min + 0.5 * i for i in range(int((lat_max - lat_min) / 0.5) + 1)]
+            lons = [lon_min + 0.625 * j for j in range(int((lon_max - lon_min) / 0.625) + 1)]
+            return {
+                "type": "FeatureCollection",
+                "header": {"fill_value": -999.0},
+                "features": [
+                    {
+                        "geometry": {"type": "Point", "coordinates": [lon, lat, 0.0]},
+                        "properties": {"parameter": {name: {d: round(self.random.uniform(0, 30), 2) for d in days} for name in names}},
+                    }
+                    for lat in lats for lon in lons
+                ],
+            }
+        if "/hourly/" in request.url.path:
+            days = [f"{d}{hour:02d}" for d in days for hour in range(24)]
+        return {
+            "header": {"fill_value": -999.0},
+            "properties": {
+                "parameter": {
+                    name: {d: round(self.random.uniform(0, 30), 2) for d in days}
+                    for name in names
+                }
+            },
+        }
+
+
+class FakeNominatim:
+    """Sustituto de geopy.Nominatim: misma firma geocode(query, timeout) y latencia bloqueante."""
+
+    def __init__(self, latency_ms: float = 300, seed: int = 0):
+        self.latency_ms = latency_ms
+        self.random = random.Random(seed)
+        self.calls = 0
+
+    def geocode(self, query, timeout=None):
+        self.calls += 1
+        time.sleep(self.latency_ms / 1000)
+        # Coordenadas deterministas por nombre, dentro de Guatemala
+        rng = random.Random(query)
+        return SimpleNamespace(latitude=rng.uniform(13.8, 17.8), longitude=rng.uniform(-92.2, -88.3))
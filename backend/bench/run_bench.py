@@ -0,0 +1,169 @@
+"""
+Benchmark sin red de /api/query_weather.
+
+Ejecuta la app FastAPI en el mismo proceso (httpx.ASGITransport) con Meteomatics, NASA POWER y
+Nominatim sustituidos por servidores falsos con latencia y errores configurables, y mide
+p50/p95/p99, peticiones por segundo y llamadas a cada proveedor para varios niveles de concurrencia.
+
+Uso (desde backend/):
+    python -m bench.run_bench --concurrency 1,10,50 --requests 300 --save bench/baselines/main.json
+    python -m bench.run_bench --compare bench/baselines/main.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+# Credenciales ficticias: nunca se llama a la API real
+os.environ.setdefault("METEO_USER", "bench")
+os.environ.setdefault("METEO_PASS", "bench")
+
+import httpx  # noqa: E402
+
+from bench.fake_upstreams import FakeNominatim, FakeUpstreams  # noqa: E402
+from services import http_client  # noqa: E402
+
+
+def build_workload(args) -> list:
+    """Lista de parámetros de consulta con popularidad sesgada (Zipf) entre ubicaciones."""
+    rng = random.Random(args.seed)
+    locations = [(round(rng.uniform(13.8, 17.8), 4), round(rng.uniform(-92.2, -88.3), 4)) for _ in range(args.locations)]
+    weights = [1 / (i + 1) ** args.skew for i in range(len(locations))]
+    today = date.today()
+    workload = []
+    for _ in range(args.requests):
+        index = rng.choices(range(len(locations)), weights)[0]
+        if rng.random() < args.historical:
+            day = today - timedelta(days=rng.randint(30, 3650))
+        else:
+            day = today + timedelta(days=rng.randint(0, args.days))
+        params = {"dateTime": f"{day.isoformat()}T12:00"}
+        if rng.random() < args.named:
+            params.update({"city": f"Lugar {index}", "country": "Guatemala"})
+        else:
+            params.update({"lat": locations[index][0], "lon": locations[index][1]})
+        workload.append(params)
+    return workload
+
+
+async def run_level(client: httpx.AsyncClient, workload: list, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one(params):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.post("/api/query_weather", params=params)
+            latencies.append((time.perf_counter() - started) * 1000)
+            # Las respuestas partial/degraded también son 200: cuenta como error todo lo que no es success
+            if response.status_code != 200 or response.json().get("status") != "success":
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(params) for params in workload))
+    elapsed = time.perf_counter() - started
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        "concurrency": concurrency,
+        "requests": len(workload),
+        "errors": errors,
+        "rps": round(len(workload) / elapsed, 1),
+        "p50_ms": round(float(p50), 1),
+        "p95_ms": round(float(p95), 1),
+        "p99_ms": round(float(p99), 1),
+    }
+
+
+async def main(args):
+    fake = FakeUpstreams(args.latency_ms, args.jitter_ms, args.error_rate, args.seed)
+    http_client.set_transport(fake)
+
+    from app import app
+    from services.cache import weather_cache
+    from services.geocoder import geocoder
+
+    nominatim = FakeNominatim(args.nominatim_latency_ms, args.seed)
+    geocoder._nominatim = nominatim
+
+    workload = build_workload(args)
+    results = []
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            for concurrency in args.concurrency:
+                if not args.warm:
+                    weather_cache.clear()
+                    geocoder.memo.clear()
+                fake.calls.clear()
+                nominatim.calls = 0
+                result = await run_level(client, workload, concurrency)
+                result["upstream_calls"] = {**fake.calls, "nominatim": nominatim.calls}
+                result["cache"] = weather_cache.stats()
+                results.append(result)
+                print_result(result)
+    return results
+
+
+def print_result(result: dict):
+    calls = ", ".join(f"{host}={n}" for host, n in result["upstream_calls"].items())
+    print(
+        f"c={result['concurrency']:<4} n={result['requests']:<5} rps={result['rps']:<8} "
+        f"p50={result['p50_ms']:<8} p95={result['p95_ms']:<8} p99={result['p99_ms']:<8} "
+        f"errores={result['errors']:<4} upstream: {calls}"
+    )
+
+
+def compare(results: list, baseline_path: str):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {r["concurrency"]: r for r in json.load(f)["results"]}
+    print(f"\nComparación con {baseline_path} (negativo = mejor en latencia):")
+    for result in results:
+        before = baseline.get(result["concurrency"])
+        if before is None:
+            continue
+        deltas = []
+        for key in ("rps", "p50_ms", "p95_ms", "p99_ms"):
+            change = (result[key] - before[key]) / before[key] * 100 if before[key] else 0.0
+            deltas.append(f"{key} {before[key]} -> {result[key]} ({change:+.1f}%)")
+        print(f"c={result['concurrency']}: " + ", ".join(deltas))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark sin red de /api/query_weather")
+    parser.add_argument("--concurrency", type=lambda s: [int(x) for x in s.split(",")], default=[1, 10, 50])
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--locations", type=int, default=50)
+    parser.add_argument("--skew", type=float, default=1.1, help="Exponente Zipf de la popularidad")
+    parser.add_argument("--days", type=int, default=7, help="Horizonte de pronóstico (días)")
+    parser.add_argument("--historical", type=float, default=0.3, help="Fracción de consultas históricas")
+    parser.add_argument("--named", type=float, default=0.1, help="Fracción de consultas por nombre (geocodificación)")
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--jitter-ms", type=float, default=50)
+    parser.add_argument("--nominatim-latency-ms", type=float, default=300)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--warm", action="store_true", help="No vaciar los caches entre niveles")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="Guardar resultados como línea base (JSON)")
+    parser.add_argument("--compare", help="Comparar con una línea base guardada")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    args = parse_args()
+    results = asyncio.run(main(args))
+    if args.save:
+        os.makedirs(os.path.dirname(args.save) or ".", exist_ok=True)
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({"config": {k: v for k, v in vars(args).items() if k not in ("save", "compare")}, "results": results}, f, indent=2)
+        print(f"Línea base guardada en {args.save}")
+    if args.compare:
+        compare(results, args.compare)
@@ -0,0 +1,86 @@
+"""
+Perfil de arranque en frío: cuánto tarda cada módulo en importarse y cuánto el lifespan.
+
+Importa la app en un proceso nuevo con `python -X importtime` (como un worker recién creado),
+suma los tiempos por módulo y muestra los más lentos; luego mide el lifespan en este proceso.
+
+Uso (desde backend/):
+    python -m bench.startup_profile --app app:app --top 25
+    python serve.py --profile-startup
+"""
+import argparse
+import asyncio
+import importlib
+import os
+import subprocess
+import sys
+import time
+
+
+def import_times(module: str) -> tuple:
+    """
+    Tiempos de importación de module en un proceso limpio.
+    Retorna: ([(módulo, propio_ms, acumulado_ms, profundidad)] en orden de importación, ms totales del proceso).
+    """
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    wall_ms = (time.perf_counter() - started) * 1000
+    if result.returncode != 0:
+        raise RuntimeError(f"No se pudo importar {module}:\n{result.stderr[-2000:]}")
+
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(own) / 1000, int(cumulative) / 1000, depth))
+    return rows, wall_ms
+
+
+async def lifespan_ms(app_path: str) -> float:
+    """Tiempo del arranque del lifespan (índice de lugares, monitor, precarga)."""
+    module_name, _, attribute = app_path.partition(":")
+    app = getattr(importlib.import_module(module_name), attribute or "app")
+    started = time.perf_counter()
+    async with app.router.lifespan_context(app):
+        elapsed = (time.perf_counter() - started) * 1000
+    return elapsed
+
+
+def report(app_path: str, top: int = 25, lifespan: bool = True):
+    module = app_path.partition(":")[0]
+    rows, wall_ms = import_times(module)
+    total_ms = sum(own for _, own, _, _ in rows)
+
+    print(f"Importación de {module}: {total_ms:.0f} ms en módulos ({wall_ms:.0f} ms con el intérprete)\n")
+    print(f"{'acumulado ms':>13} {'propio ms':>10}  módulo")
+    for name, own, cumulative, depth in sorted(rows, key=lambda r: r[2], reverse=True)[:top]:
+        print(f"{cumulative:13.1f} {own:10.1f}  {'  ' * depth}{name}")
+
+    # Paquetes de terceros de primer nivel: lo que más conviene diferir
+    packages = {}
+    for name, own, _, _ in rows:
+        packages[name.split(".")[0]] = packages.get(name.split(".")[0], 0.0) + own
+    print("\nPor paquete (tiempo propio):")
+    for package, ms in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:10]:
+        print(f"{ms:13.1f}  {package}")
+
+    if lifespan:
+        print(f"\nLifespan: {asyncio.run(lifespan_ms(app_path)):.0f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Perfil de arranque en frío (import time por módulo)")
+    parser.add_argument("--app", default="app:app", help="app ASGI (app:app o run_queries:app)")
+    parser.add_argument("--top", type=int, default=25, help="Módulos a mostrar")
+    parser.add_argument("--no-lifespan", action="store_true", help="No medir el lifespan")
+    args = parser.parse_args()
+    report(args.app, args.top, not args.no_lifespan)
+
+
+if __name__ == "__main__":
+    main()
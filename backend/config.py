@@ -4,4 +4,190 @@ import os
 load_dotenv()  # carga .env en desarrollo
 
 METEO_USER = os.getenv("METEO_USER")
-METEO_PASS = os.getenv("METEO_PASS")
\ No newline at end of file
+METEO_PASS = os.getenv("METEO_PASS")
+
+# ---------- CLIENTES HTTP (pool de conexiones) ----------
+
+# Tiempos máximos (segundos) por proveedor y para abrir la conexión
+METEOMATICS_TIMEOUT = float(os.getenv("METEOMATICS_TIMEOUT", "20"))
+NASA_POWER_TIMEOUT = float(os.getenv("NASA_POWER_TIMEOUT", "20"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+
+# Tamaño del pool keep-alive de cada cliente (uno por host)
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+
+# Peticiones simultáneas permitidas hacia cada host
+HTTP_HOST_CONCURRENCY = int(os.getenv("HTTP_HOST_CONCURRENCY", "32"))
+HOST_CONCURRENCY = {
+    "api.meteomatics.com": int(os.getenv("METEOMATICS_MAX_CONCURRENCY", "16")),
+    "power.larc.nasa.gov": int(os.getenv("NASA_POWER_MAX_CONCURRENCY", "8")),
+}
+
+# ---------- LÍMITES POR PROVEEDOR (governor) ----------
+
+# Peticiones por segundo y cuota diaria de llamadas (0 = sin límite) de cada proveedor
+PROVIDER_RATE = {
+    "meteomatics": float(os.getenv("METEOMATICS_RATE", "10")),
+    "nasa_power": float(os.getenv("NASA_POWER_RATE", "5")),
+    "nominatim": float(os.getenv("NOMINATIM_RATE", "1")),
+}
+PROVIDER_DAILY_QUOTA = {
+    "meteomatics": int(os.getenv("METEOMATICS_DAILY_QUOTA", "0")),
+    "nasa_power": int(os.getenv("NASA_POWER_DAILY_QUOTA", "0")),
+    "nominatim": int(os.getenv("NOMINATIM_DAILY_QUOTA", "0")),
+}
+# SQLite donde se lleva la cuenta diaria (vacío = solo en memoria, se reinicia con el proceso)
+QUOTA_LEDGER_PATH = os.getenv("QUOTA_LEDGER_PATH", "")
+# Espera máxima (s) por un turno del límite de tasa antes de fallar
+PROVIDER_MAX_RATE_WAIT = float(os.getenv("PROVIDER_MAX_RATE_WAIT", "5"))
+# Reintentos ante 429/5xx/errores de red, con espera exponencial aleatoria (s)
+PROVIDER_MAX_RETRIES = int(os.getenv("PROVIDER_MAX_RETRIES", "2"))
+PROVIDER_BACKOFF_BASE = float(os.getenv("PROVIDER_BACKOFF_BASE", "0.25"))
+PROVIDER_BACKOFF_MAX = float(os.getenv("PROVIDER_BACKOFF_MAX", "4"))
+# Fallos seguidos que abren el circuito y segundos hasta volver a probar
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30"))
+
+# ---------- MALLA ESPACIAL ----------
+
+# Separación (grados) de los nodos de Meteomatics; cada punto se interpola de los 4 nodos que lo rodean
+METEOMATICS_GRID_DEG = float(os.getenv("METEOMATICS_GRID_DEG", "0.05"))
+# "bilinear" (4 nodos, una sola llamada multipunto) o "nearest" (nodo más cercano)
+METEOMATICS_INTERPOLATION = os.getenv("METEOMATICS_INTERPOLATION", "bilinear")
+
+# ---------- CACHE DE RESPUESTAS ----------
+
+# Entradas máximas del LRU en memoria y ruta SQLite opcional (vacío = sin cache en disco)
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "2048"))
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", "")
+
+# TTL (segundos): los pronósticos caducan en minutos, el histórico de NASA casi nunca cambia
+CACHE_TTL_METEOMATICS = float(os.getenv("CACHE_TTL_METEOMATICS", "600"))
+CACHE_TTL_NASA_POWER = float(os.getenv("CACHE_TTL_NASA_POWER", str(30 * 24 * 3600)))
+
+# ---------- VARIOS PROCESOS (serve.py) ----------
+
+# Procesos de uvicorn (0 = uno por núcleo); serve.py lo fija para los workers que arranca
+WORKERS = int(os.getenv("WORKERS", "1"))
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8000"))
+# Almacén compartido entre procesos para respuestas de proveedores, geocodificación y cuotas:
+# "redis://host:6379/0" (Redis o compatible) o una ruta SQLite. Vacío = CACHE_DB_PATH,
+# GEOCODER_MEMO_PATH y QUOTA_LEDGER_PATH por separado.
+SHARED_CACHE_URL = os.getenv("SHARED_CACHE_URL", "")
+# Segundos que un worker espera la respuesta que otro worker ya está pidiendo al proveedor
+SHARED_FETCH_WAIT = float(os.getenv("SHARED_FETCH_WAIT", "20"))
+
+# ---------- GEOCODIFICACIÓN ----------
+
+# Volcado GeoNames (cities500.txt, allCountries.txt, ...) y countryInfo.txt opcionales
+GEONAMES_PATH = os.getenv("GEONAMES_PATH", "")
+GEONAMES_COUNTRY_INFO_PATH = os.getenv("GEONAMES_COUNTRY_INFO_PATH", "")
+
+# SQLite donde se recuerdan los resultados de Nominatim (vacío = solo en memoria)
+GEOCODER_MEMO_PATH = os.getenv("GEOCODER_MEMO_PATH", "")
+GEOCODER_MEMO_TTL = float(os.getenv("GEOCODER_MEMO_TTL", str(180 * 24 * 3600)))
+GEOCODER_NEGATIVE_TTL = float(os.getenv("GEOCODER_NEGATIVE_TTL", "3600"))
+
+NOMINATIM_USER_AGENT = os.getenv("NOMINATIM_USER_AGENT", "check_now_app")
+NOMINATIM_TIMEOUT = float(os.getenv("NOMINATIM_TIMEOUT", "10"))
+
+# ---------- AGRUPACIÓN DE LLAMADAS A METEOMATICS ----------
+
+# Espera (ms) para juntar consultas concurrentes en una sola llamada multipunto
+METEOMATICS_BATCH_WINDOW_MS = float(os.getenv("METEOMATICS_BATCH_WINDOW_MS", "10"))
+METEOMATICS_MAX_POINTS_PER_CALL = int(os.getenv("METEOMATICS_MAX_POINTS_PER_CALL", "50"))
+METEOMATICS_MAX_URL_LENGTH = int(os.getenv("METEOMATICS_MAX_URL_LENGTH", "4000"))
+# Máximo de días de una ventana unida a partir de consultas con fechas distintas
+METEOMATICS_MERGE_MAX_DAYS = int(os.getenv("METEOMATICS_MERGE_MAX_DAYS", "3"))
+
+# ---------- NASA POWER: RANGOS LARGOS ----------
+
+# Días máximos de una llamada (los rangos más largos se parten en tramos) y tramos en paralelo
+NASA_POWER_DAILY_CHUNK_DAYS = int(os.getenv("NASA_POWER_DAILY_CHUNK_DAYS", "3650"))
+NASA_POWER_HOURLY_CHUNK_DAYS = int(os.getenv("NASA_POWER_HOURLY_CHUNK_DAYS", "366"))
+NASA_POWER_RANGE_CONCURRENCY = int(os.getenv("NASA_POWER_RANGE_CONCURRENCY", "4"))
+# Consultas históricas con hora (YYYY-MM-DDTHH:MM) usan el endpoint horario de NASA POWER
+NASA_POWER_HOURLY = os.getenv("NASA_POWER_HOURLY", "1").lower() in ("1", "true", "yes")
+
+# ---------- VARIOS PROVEEDORES A LA VEZ (HEDGING) ----------
+
+# Si la fecha está en la ventana de más de un proveedor (p. ej. días recientes), se pide al
+# siguiente cuando el primero tarda más que su percentil HEDGE_PERCENTILE y gana el primero en responder
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "1").lower() in ("1", "true", "yes")
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+# Espera antes del pedido duplicado mientras no haya muestras suficientes, y sus límites (ms)
+HEDGE_DEFAULT_DELAY_MS = float(os.getenv("HEDGE_DEFAULT_DELAY_MS", "800"))
+HEDGE_MIN_DELAY_MS = float(os.getenv("HEDGE_MIN_DELAY_MS", "50"))
+HEDGE_MAX_DELAY_MS = float(os.getenv("HEDGE_MAX_DELAY_MS", "3000"))
+# Días pasados que Meteomatics también sirve (ventana compartida con NASA POWER)
+METEOMATICS_PAST_DAYS = int(os.getenv("METEOMATICS_PAST_DAYS", "7"))
+
+# ---------- CACHE HTTP (GET /query_weather) ----------
+
+# max-age de Cache-Control según la fuente: pronóstico corto, histórico largo
+HTTP_MAX_AGE_METEOMATICS = int(os.getenv("HTTP_MAX_AGE_METEOMATICS", "300"))
+HTTP_MAX_AGE_NASA_POWER = int(os.getenv("HTTP_MAX_AGE_NASA_POWER", "86400"))
+# ETags recordados para responder 304 sin consultar el proveedor
+HTTP_ETAG_ENTRIES = int(os.getenv("HTTP_ETAG_ENTRIES", "10000"))
+
+# ---------- PLAZO POR CONSULTA ----------
+
+# Milisegundos que puede durar una consulta completa (geocodificación, proveedores, derivados);
+# el cliente puede pedir otro con la cabecera X-Request-Deadline-Ms, hasta el máximo
+REQUEST_DEADLINE_MS = float(os.getenv("REQUEST_DEADLINE_MS", "10000"))
+REQUEST_DEADLINE_MAX_MS = float(os.getenv("REQUEST_DEADLINE_MAX_MS", "30000"))
+# Cada cuántos milisegundos se revisa si el cliente se desconectó
+REQUEST_DISCONNECT_POLL_MS = float(os.getenv("REQUEST_DISCONNECT_POLL_MS", "250"))
+
+# ---------- MAPA DE RIESGO (/risk_grid) ----------
+
+# Nodos máximos de la malla de salida y lado máximo (grados) del rectángulo
+RISK_GRID_MAX_CELLS = int(os.getenv("RISK_GRID_MAX_CELLS", "40000"))
+RISK_GRID_MAX_SPAN_DEG = float(os.getenv("RISK_GRID_MAX_SPAN_DEG", "30"))
+# Paso de tiempo de la consulta de área a Meteomatics (el riesgo usa el promedio del día)
+RISK_GRID_METEOMATICS_INTERVAL = os.getenv("RISK_GRID_METEOMATICS_INTERVAL", "PT3H")
+
+# ---------- CLIMATOLOGÍA ----------
+
+# Carpeta con los arreglos precalculados (uno por celda de NASA POWER)
+CLIMATOLOGY_DIR = os.getenv("CLIMATOLOGY_DIR", "data/climatology")
+CLIMATOLOGY_START_YEAR = int(os.getenv("CLIMATOLOGY_START_YEAR", "1991"))
+CLIMATOLOGY_END_YEAR = int(os.getenv("CLIMATOLOGY_END_YEAR", "2020"))
+# Días alrededor de cada fecha que entran en su estadística y umbral de "día lluvioso"
+CLIMATOLOGY_WINDOW_DAYS = int(os.getenv("CLIMATOLOGY_WINDOW_DAYS", "7"))
+CLIMATOLOGY_WET_DAY_MM = float(os.getenv("CLIMATOLOGY_WET_DAY_MM", "1.0"))
+
+# ---------- DATOS EN MALLA SIN RED ----------
+
+# NetCDF/Zarr local (NASA POWER, ERA5, ...) usado antes que NASA POWER para fechas pasadas
+OFFLINE_DATASET_PATH = os.getenv("OFFLINE_DATASET_PATH", "")
+# Nombre NASA POWER -> variable del archivo, p. ej. "T2M:t2m,PRECTOT:tp"
+OFFLINE_DATASET_VARIABLES = os.getenv("OFFLINE_DATASET_VARIABLES", "T2M,PRECTOT,ALLSKY_SFC_SW_DWN")
+
+# ---------- MÉTRICAS ----------
+
+# Cabecera Server-Timing con la duración de cada etapa en todas las respuestas
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0").lower() in ("1", "true", "yes")
+# Cada cuántos segundos se mide el retraso del event loop
+EVENT_LOOP_LAG_INTERVAL = float(os.getenv("EVENT_LOOP_LAG_INTERVAL", "0.5"))
+
+# ---------- PRECARGA DE CONSULTAS POPULARES ----------
+
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "1").lower() in ("1", "true", "yes")
+# Cada cuántos segundos se revisan las ubicaciones populares
+PREFETCH_INTERVAL = float(os.getenv("PREFETCH_INTERVAL", "60"))
+# Ubicaciones (celdas) que se mantienen calientes y días de pronóstico por ubicación
+PREFETCH_TOP_K = int(os.getenv("PREFETCH_TOP_K", "20"))
+PREFETCH_FORECAST_DAYS = int(os.getenv("PREFETCH_FORECAST_DAYS", "2"))
+# Un pronóstico se refresca cuando le quedan menos de estos segundos en el cache
+PREFETCH_REFRESH_MARGIN = float(os.getenv("PREFETCH_REFRESH_MARGIN", "120"))
+# Vida media (segundos) de la popularidad de una consulta
+PREFETCH_HALF_LIFE = float(os.getenv("PREFETCH_HALF_LIFE", "3600"))
+# Llamadas por hora que la precarga puede gastar en cada proveedor
+PREFETCH_BUDGET_METEOMATICS = float(os.getenv("PREFETCH_BUDGET_METEOMATICS", "120"))
+PREFETCH_BUDGET_NASA_POWER = float(os.getenv("PREFETCH_BUDGET_NASA_POWER", "60"))
+# Horas (locales, "inicio-fin") en las que se completa el histórico de NASA POWER
+PREFETCH_OFFPEAK_HOURS = os.getenv("PREFETCH_OFFPEAK_HOURS", "0-6")
@@ -1,64 +1,109 @@
+import functools
+import warnings
+
 import numpy as np
-import pandas as pd
 
-def compute_risk_probabilities(timeseries: dict) -> dict:
+from models.timeseries import TimeSeries
+
+RISK_LABELS = ("hot", "cold", "windy", "wet")
+
+
+@functools.lru_cache(maxsize=64)
+def resolve_columns(variables: tuple) -> tuple:
+    """
+    Identifica qué variable es temperatura, viento y precipitación (una sola vez por
+    combinación de nombres; el resultado queda en cache).
+    Retorna: (índice_temp, índice_viento, índice_precip), None si falta la variable.
+    """
+    names = [str(v).lower() for v in variables]
+    temp_idx = next((i for i, c in enumerate(names) if "temp" in c or "t_2m" in c or c == "t2m"), None)
+    wind_idx = next((i for i, c in enumerate(names) if "wind" in c or "speed" in c or c.startswith("ws")), None)
+    precip_idx = next((i for i, c in enumerate(names) if "precip" in c or "rain" in c or c.startswith("prectot")), None)
+    return temp_idx, wind_idx, precip_idx
+
+
+def stack_timeseries(series_list: list, variables: tuple) -> np.ndarray:
+    """
+    Junta varias TimeSeries en un arreglo (N ubicaciones × T horas × V variables) float32.
+    Las series más cortas y las variables ausentes se rellenan con NaN.
+    """
+    steps = max((len(s) for s in series_list), default=0)
+    stacked = np.full((len(series_list), steps, len(variables)), np.nan, dtype=np.float32)
+    for n, series in enumerate(series_list):
+        for v, name in enumerate(variables):
+            column = series.values.get(name)
+            if column is not None:
+                stacked[n, :len(column), v] = column
+    return stacked
+
+
+def compute_risk_batch(values: np.ndarray, variables: tuple) -> np.ndarray:
+    """
+    Riesgos para N ubicaciones a la vez.
+    values: arreglo (N × T × V) con NaN donde falta el dato.
+    variables: nombres de las V variables (en el orden del último eje).
+    Retorna: arreglo (N × 4) con probabilidades (%) en el orden de RISK_LABELS.
+    """
+    temp_idx, wind_idx, precip_idx = resolve_columns(tuple(variables))
+    if temp_idx is None and wind_idx is None and precip_idx is None:
+        raise ValueError("No se encontraron variables adecuadas en los datos del clima.")
+
+    # ----------------------------
+    # 1️⃣  Promedios por ubicación (ignorando NaN)
+    # ----------------------------
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)  # ubicaciones sin ningún dato
+        means = np.nanmean(values, axis=1, dtype=np.float64)  # N × V
+
+    n = values.shape[0]
+    missing = np.full(n, np.nan)
+    mean_temp = means[:, temp_idx] if temp_idx is not None else missing
+    mean_wind = means[:, wind_idx] if wind_idx is not None else missing
+    mean_precip = means[:, precip_idx] if precip_idx is not None else missing
+
+    # ----------------------------
+    # 2️⃣  Riesgos simples (placeholder estadístico); variable ausente = sin riesgo
+    # ----------------------------
+    risks = np.stack([
+        np.clip((mean_temp - 25) / 10, 0, 1),
+        np.clip((15 - mean_temp) / 10, 0, 1),
+        np.clip(mean_wind / 15, 0, 1),
+        np.clip(mean_precip / 10, 0, 1),
+    ], axis=1)
+    risks = np.nan_to_num(risks, nan=0.0)
+
+    # ----------------------------
+    # 3️⃣  Normalización final (para que sumen 1 en cada ubicación)
+    # ----------------------------
+    risks = risks / (risks.sum(axis=1, keepdims=True) + 1e-9)
+    return np.round(risks * 100, 2)
+
+
+def compute_risk_probabilities(timeseries) -> dict:
     """
     Calcula riesgos climáticos básicos a partir de datos crudos (temperatura, viento, precipitación, etc.)
-    timeseries: dict con datos del clima obtenidos desde Meteomatics.
+    timeseries: TimeSeries de cualquier proveedor (o dict con columnas, formato antiguo).
     Retorna: diccionario con probabilidades (%) de riesgo.
     """
 
     try:
-        # Convierte a DataFrame si los datos vienen en formato JSON Meteomatics
-        if "data" in timeseries:
-            df = pd.DataFrame(timeseries["data"])
+        if isinstance(timeseries, TimeSeries):
+            variables = tuple(timeseries.variables)
+            values = stack_timeseries([timeseries], variables)
         else:
-            df = pd.DataFrame(timeseries)
-
-        # Normaliza nombres de columnas
-        df.columns = [col.lower() for col in df.columns]
-
-        # ----------------------------
-        # 1️⃣  Identificar variables principales
-        # ----------------------------
-        temp_col = next((c for c in df.columns if "temp" in c or "t_2m" in c), None)
-        wind_col = next((c for c in df.columns if "wind" in c or "speed" in c), None)
-        precip_col = next((c for c in df.columns if "precip" in c or "rain" in c), None)
-
-        if not any([temp_col, wind_col, precip_col]):
-            raise ValueError("No se encontraron variables adecuadas en los datos del clima.")
-
-        # ----------------------------
-        # 2️⃣  Calcular valores promedio recientes
-        # ----------------------------
-        mean_temp = df[temp_col].mean() if temp_col else np.nan
-        mean_wind = df[wind_col].mean() if wind_col else np.nan
-        mean_precip = df[precip_col].mean() if precip_col else np.nan
-
-        # ----------------------------
-        # 3️⃣  Calcular riesgos simples (placeholder estadístico)
-        # ----------------------------
-        # Escalas normalizadas básicas
-        risk_hot = np.clip((mean_temp - 25) / 10, 0, 1)
-        risk_cold = np.clip((15 - mean_temp) / 10, 0, 1)
-        risk_windy = np.clip(mean_wind / 15, 0, 1)
-        risk_wet = np.clip(mean_precip / 10, 0, 1)
-
-        # ----------------------------
-        # 4️⃣  Normalización final (para que sumen 1)
-        # ----------------------------
-        risks = np.array([risk_hot, risk_cold, risk_windy, risk_wet])
-        risks = risks / (risks.sum() + 1e-9)
-
-        # ----------------------------
-        # 5️⃣  Generar salida con etiquetas claras
-        # ----------------------------
-        return {
-            "hot": round(float(risks[0]) * 100, 2),
-            "cold": round(float(risks[1]) * 100, 2),
-            "windy": round(float(risks[2]) * 100, 2),
-            "wet": round(float(risks[3]) * 100, 2)
-        }
+            # Convierte a DataFrame si los datos vienen en formato JSON Meteomatics
+            # (formato antiguo; pandas solo se importa en este camino)
+            import pandas as pd
+            if "data" in timeseries:
+                df = pd.DataFrame(timeseries["data"])
+            else:
+                df = pd.DataFrame(timeseries)
+            df = df.select_dtypes("number")
+            variables = tuple(str(col) for col in df.columns)
+            values = df.to_numpy(dtype=np.float32)[np.newaxis, :, :]
+
+        risks = compute_risk_batch(values, variables)[0]
+        return {label: float(risk) for label, risk in zip(RISK_LABELS, risks)}
 
     except Exception as e:
         raise RuntimeError(f"Error al calcular riesgos: {e}")
@@ -0,0 +1,161 @@
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+
+
+def to_float(value) -> Optional[float]:
+    """float32 -> float de Python con la representación corta (20.3 y no 20.299999237), NaN -> None."""
+    if value is None or np.isnan(value):
+        return None
+    return float(str(np.float32(value)))
+
+
+class TimeSeries:
+    """
+    Serie temporal columnar compartida por todos los proveedores.
+    times: np.datetime64[s] (UTC), una entrada por muestra.
+    values: {variable: np.float32 de la misma longitud}, NaN donde falta el dato.
+    """
+
+    __slots__ = ("times", "values", "_records_json")
+
+    def __init__(self, times: np.ndarray, values: dict):
+        self.times = np.asarray(times, dtype="datetime64[s]")
+        self.values = {name: np.asarray(column, dtype=np.float32) for name, column in values.items()}
+        self._records_json = None
+
+    @classmethod
+    def empty(cls) -> "TimeSeries":
+        return cls(np.empty(0, dtype="datetime64[s]"), {})
+
+    @classmethod
+    def from_meteomatics(cls, variables: dict) -> "TimeSeries":
+        """
+        variables: {parametro: [{"date": "...Z", "value": v}, ...]} de una coordenada de Meteomatics.
+        Todas las variables de una llamada comparten el eje de tiempo.
+        """
+        if not variables:
+            return cls.empty()
+        times = None
+        values = {}
+        for name, dates_list in variables.items():
+            if times is None:
+                times = np.array([d["date"].rstrip("Z") for d in dates_list], dtype="datetime64[s]")
+            values[name] = np.array([np.nan if d.get("value") is None else d["value"] for d in dates_list], dtype=np.float32)
+        return cls(times, values)
+
+    @classmethod
+    def from_nasa_power(cls, parameter: dict, fill_value: float = -999.0) -> "TimeSeries":
+        """
+        parameter: properties.parameter de NASA POWER: {VARIABLE: {"YYYYMMDD" o "YYYYMMDDHH": v}}.
+        El valor de relleno de NASA (-999) se convierte en NaN.
+        """
+        keys = sorted({key for series in parameter.values() for key in series})
+        if not keys:
+            return cls.empty()
+        times = np.array(
+            [f"{k[:4]}-{k[4:6]}-{k[6:8]}T{k[8:10] or '00'}:00:00" for k in keys],
+            dtype="datetime64[s]",
+        )
+        values = {}
+        for name, series in parameter.items():
+            column = np.array([series.get(k, np.nan) for k in keys], dtype=np.float32)
+            column[column == fill_value] = np.nan
+            values[name] = column
+        return cls(times, values)
+
+    # ---------- ACCESO ----------
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.values
+
+    @property
+    def variables(self) -> list:
+        return list(self.values)
+
+    def has_values(self) -> bool:
+        """True si alguna variable tiene al menos un valor (no NaN)."""
+        return any(bool(np.any(~np.isnan(column))) for column in self.values.values())
+
+    def get(self, name: str) -> np.ndarray:
+        """Columna de la variable o un arreglo vacío si no existe."""
+        column = self.values.get(name)
+        return column if column is not None else np.empty(0, dtype=np.float32)
+
+    def first(self, name: str) -> Optional[float]:
+        """Primer valor de la variable (None si falta)."""
+        column = self.values.get(name)
+        if column is None or len(column) == 0:
+            return None
+        return to_float(column[0])
+
+    def value_at(self, name: str, moment: datetime) -> Optional[float]:
+        """Valor de la variable en la muestra más cercana a moment (None si falta)."""
+        column = self.values.get(name)
+        if column is None or len(column) == 0:
+            return None
+        target = np.datetime64(moment.replace(tzinfo=None), "s")
+        return to_float(column[int(np.argmin(np.abs(self.times - target)))])
+
+    def slice_dates(self, start: str, end: str) -> "TimeSeries":
+        """Muestras entre los días start y end (YYYY-MM-DD, ambos inclusive)."""
+        days = self.times.astype("datetime64[D]")
+        mask = (days >= np.datetime64(start, "D")) & (days <= np.datetime64(end, "D"))
+        return TimeSeries(self.times[mask], {name: column[mask] for name, column in self.values.items()})
+
+    def to_records(self) -> dict:
+        """Formato antiguo {variable: [{"datetime", "value"}]} para respuestas JSON (raw_data)."""
+        stamps = [f"{t}Z" for t in self.times.astype(str)]
+        return {
+            name: [{"datetime": stamp, "value": to_float(v)} for stamp, v in zip(stamps, column)]
+            for name, column in self.values.items()
+        }
+
+    def records_json(self) -> bytes:
+        """
+        to_records() ya codificado en JSON. Se calcula una sola vez por serie: las series del cache
+        se comparten entre peticiones, así que raw_data no se vuelve a construir ni a codificar.
+        """
+        encoded = getattr(self, "_records_json", None)  # series antiguas del cache en disco no lo tienen
+        if encoded is None:
+            from services.fast_json import dumps
+            encoded = self._records_json = dumps(self.to_records())
+        return encoded
+
+
+class AreaSeries:
+    """
+    Series de muchos puntos de un área con el mismo eje de tiempo (consultas de área/regionales).
+    points: (N × 2) lat/lon; times: np.datetime64[s] (T); values: (N × T × V) float32 con NaN
+    donde falta el dato, en el orden de variables.
+    """
+
+    __slots__ = ("points", "times", "variables", "values")
+
+    def __init__(self, points: np.ndarray, times: np.ndarray, variables: list, values: np.ndarray):
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        self.times = np.asarray(times, dtype="datetime64[s]")
+        self.variables = list(variables)
+        self.values = np.asarray(values, dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    @classmethod
+    def concat(cls, parts: list) -> "AreaSeries":
+        """Une áreas con las mismas fechas y variables (p. ej. los tramos de un rectángulo grande)."""
+        parts = [part for part in parts if len(part)]
+        if not parts:
+            return cls(np.empty((0, 2)), np.empty(0, dtype="datetime64[s]"), [], np.empty((0, 0, 0)))
+        if len(parts) == 1:
+            return parts[0]
+        return cls(
+            np.concatenate([part.points for part in parts]),
+            parts[0].times,
+            parts[0].variables,
+            np.concatenate([part.values for part in parts]),
+        )
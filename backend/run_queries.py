@@ -1,27 +1,45 @@
-from fastapi import FastAPI, APIRouter, Query, HTTPException
+from fastapi import FastAPI, Header, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
+from contextlib import asynccontextmanager
 from typing import Optional
-from datetime import datetime
+import asyncio
 import logging
-from geopy.geocoders import Nominatim
 from api.models import WeatherQueryData 
-
-try:
-    from api.meteomatics import fetch_meteomatics_timeseries 
-    from services.nasa_power import fetch_nasa_power 
-except ImportError as e:
-    logging.error(f"Error al importar módulos de servicios externos: {e}")
-
-    def fetch_meteomatics_timeseries(lat, lon, start, end, interval="PT1H"):
-        raise HTTPException(status_code=500, detail="Meteomatics service import failed.")
-    def fetch_nasa_power(lat, lon, start, end, parameters, community):
-        raise HTTPException(status_code=500, detail="NASA Power service import failed.")
+from api.engine import engine
+from services.http_client import close_clients
+from api.io import close_gridded
+from services.deadline import Deadline
+from services.geocoder import geocoder
+from services.metrics import registry, metrics_middleware, start_loop_lag_monitor
+from services.prefetch import prefetcher
+from services.fast_json import FastJSONResponse
+import config
 
 # -------------------------------------------------------------------------
 
 logger = logging.getLogger(__name__)
-geolocator = Nominatim(user_agent="check_now_app")
-app = FastAPI()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Índice local de lugares (GeoNames), fuera del event loop
+    await asyncio.to_thread(geocoder.load)
+    # Un proveedor sin credenciales queda no disponible (503 / climatología) en vez de impedir el arranque
+    engine.check_providers()
+    lag_monitor = start_loop_lag_monitor()
+    # Mantiene calientes en el cache las consultas populares
+    prefetch_task = prefetcher.start() if config.PREFETCH_ENABLED else None
+    yield
+    lag_monitor.cancel()
+    if prefetch_task is not None:
+        prefetch_task.cancel()
+    # Cierra los pools HTTP compartidos de Meteomatics / NASA POWER y los datasets locales
+    await close_clients()
+    close_gridded()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
 
 # -------------------------------------------------------------------------
 # CONFIGURACIÓN CORS 
@@ -38,162 +56,63 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.middleware("http")(metrics_middleware)
 # -------------------------------------------------------------------------
 
 
-# ---------- UTILS Y VALIDACIONES (MANTENIDOS IGUAL) ----------
-
-def validate_date_input(date_str: str):
-    """Valida y convierte la cadena YYYY-MM-DDTmm:ss a datetime."""
-    try:
-        return datetime.strptime(date_str, "%Y-%m-%dT%H:%M")
-    except ValueError:
-        raise HTTPException(status_code=400, detail=f"Fecha/Hora inválida: {date_str}. Usar YYYY-MM-DDTmm:ss.")
-
-def validate_lat_lon(lat: float, lon: float):
-    if not (-90 <= lat <= 90) or not (-180 <= lon <= 180):
-        raise HTTPException(status_code=400, detail=f"Lat/Lon fuera de rango: lat={lat}, lon={lon}")
-
-def get_lat_lon_from_location(country: Optional[str], city: Optional[str], locality: Optional[str]):
-    """Obtiene Lat/Lon usando Nominatim basado en los campos disponibles."""
-    query_parts = [p for p in [locality, city, country] if p]
-    query = ", ".join(query_parts)
-    
-    if not query_parts or not query.strip():
-        raise HTTPException(status_code=400, detail="Debe proporcionar coordenadas o al menos un campo de ubicación.")
-
-    try:
-        location = geolocator.geocode(query, timeout=10)
-    except Exception as e:
-        logger.error(f"Error en geocodificación: {e}")
-        raise HTTPException(status_code=500, detail="Error al contactar al servicio de ubicación (Nominatim).")
-
-    if not location:
-        raise HTTPException(status_code=404, detail=f"No se encontró la ubicación: {query}. Intente ser más específico.")
-        
-    return location.latitude, location.longitude
-
-def calculate_rain_prediction(data: dict) -> str:
-    """Calcula una probabilidad simple de lluvia para el día (Meteomatics)."""
-    precip_data = data.get("precip_1h:mm", [])
-    total_hours = len(precip_data)
-    if total_hours == 0:
-        return "No hay datos de precipitación disponibles"
-    rainy_hours = sum(1 for h in precip_data if h["value"] > 0.1)
-    rain_prob = round((rainy_hours / total_hours) * 100, 1)
-    return f"Probabilidad de lluvia: {rain_prob}%"
-
-def format_weather_response(data: dict, rain_prediction: str) -> dict:
-    """Formatea la respuesta de Meteomatics."""
-    def get_first_value(key):
-        values = data.get(key, [])
-        return values[0]['value'] if values and values[0].get('value') is not None else None
-
-    temp = get_first_value("t_2m:C")
-    precip = get_first_value("precip_1h:mm")
-    wind = get_first_value("wind_speed_10m:ms")
-    solar = get_first_value("global_rad:wm2")
-
-    return {
-        "temperature": f"{temp}°C" if temp is not None else "--",
-        "precipitation": f"{precip} mm" if precip is not None else "--",
-        "wind": f"{wind} m/s" if wind is not None else "--",
-        "solarRadiation": f"{solar} W/m²" if solar is not None else "--",
-        "rain_prediction": rain_prediction
-    }
-
-def format_nasa_response(nasa_data: dict) -> dict:
-    """Formatea la respuesta de NASA POWER."""
-    props = nasa_data.get("properties", {})
-    parameter = props.get("parameter", {})
-    
-    date_key = list(parameter.get("T2M", {}).keys())[0] if parameter.get("T2M") and list(parameter.get("T2M", {}).keys()) else None
-    
-    temp = parameter.get("T2M", {}).get(date_key)
-    precip = parameter.get("PRECTOT", {}).get(date_key)
-    solar = parameter.get("ALLSKY_SFC_SW_DWN", {}).get(date_key)
-
-    return {
-        "temperature": f"{temp}°C (Avg)" if temp is not None else "--",
-        "precipitation": f"{precip} mm" if precip is not None else "--",
-        "wind": f"N/A", 
-        "solarRadiation": f"{solar} W/m²" if solar is not None else "--",
-        "rain_prediction": "Datos históricos (NASA POWER)"
-    }
-
-
 # ------------------------------------------------------------------------
 # ---------- ENDPOINT PRINCIPAL (RUTA CORREGIDA) ----------
 # ------------------------------------------------------------------------
+# Mismo pipeline que /api/query_weather de app.py (api/engine.py); aquí los datos llegan en el body
 
-# En run_queries.py
 @app.post("/query_weather") # <--- DEBE SER ASÍ
-async def query_weather(query_data: WeatherQueryData):
-    
-    
-    # 1. DETERMINAR LAT/LON
-    if query_data.lat is None or query_data.lon is None: 
-        lat_final, lon_final = get_lat_lon_from_location(
-            query_data.country, 
-            query_data.city, 
-            query_data.locality
-        )
-    else:
-        validate_lat_lon(query_data.lat, query_data.lon)
-        lat_final, lon_final = query_data.lat, query_data.lon
-        
-    # 2. VALIDAR FECHA Y ESCOGER API
-    query_dt = validate_date_input(query_data.dateTime) 
-    
-    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-    query_date_str = query_dt.strftime("%Y-%m-%d")
-    is_future_or_present = query_dt.date() >= today.date()
-    
-    try:
-        if is_future_or_present:
-            # A. PRONÓSTICO (Meteomatics - REAL)
-            data = fetch_meteomatics_timeseries(
-                lat_final, 
-                lon_final, 
-                query_date_str, 
-                query_date_str,
-            )
-            
-            if not isinstance(data, dict) or "error" in data or not data.get("t_2m:C"):
-                 raise HTTPException(status_code=502, detail=f"Error en datos de Meteomatics. Detalle: {data.get('error', 'Datos insuficientes o formato incorrecto.')}")
-
-            rain_prediction = calculate_rain_prediction(data)
-            return {
-                "status": "success", 
-                "source": "Meteomatics", 
-                "location": {"lat": lat_final, "lon": lon_final},
-                **format_weather_response(data, rain_prediction)
-            }
-
-        else:
-            # B. HISTÓRICO (NASA POWER - REAL)
-            nasa_data = fetch_nasa_power(
-                lat_final, 
-                lon_final, 
-                query_date_str, 
-                query_date_str,
-                parameters="T2M,PRECTOT,ALLSKY_SFC_SW_DWN", 
-                community="AG"
-            )
-            
-            if "errors" in nasa_data or not nasa_data.get("properties"):
-                raise HTTPException(status_code=502, detail="NASA POWER devolvió error o datos vacíos.")
-
-            return {
-                "status": "success", 
-                "source": "NASA POWER",
-                "location": {"lat": lat_final, "lon": lon_final},
-                **format_nasa_response(nasa_data)
-            }
-            
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Error en query_weather: {e}")
-        # Este error puede ser por credenciales, red, o la respuesta de la API real.
-        raise HTTPException(status_code=500, detail=f"Error al llamar a la API externa. Revise logs: {str(e)}")
\ No newline at end of file
+async def query_weather(query_data: WeatherQueryData, request: Request, raw_data: bool = False):
+    """
+    raw_data=true (query) añade la serie completa del proveedor, solo para debug.
+    X-Request-Deadline-Ms acota la consulta; al agotarse se responde lo que haya (status partial).
+    """
+    return await engine.query(query_data, raw_data, Deadline.from_request(request))
+
+
+@app.get("/query_weather")
+async def query_weather_get(request: Request, dateTime: str, lat: Optional[float] = None, lon: Optional[float] = None,
+                            country: Optional[str] = None, city: Optional[str] = None, locality: Optional[str] = None,
+                            raw_data: bool = False, if_none_match: Optional[str] = Header(None)):
+    """La misma consulta como GET cacheable (ETag, Cache-Control, 304); ver api/engine.py."""
+    query_data = WeatherQueryData(lat=lat, lon=lon, country=country, city=city, locality=locality, dateTime=dateTime)
+    return await engine.query_cached(query_data, raw_data, if_none_match, request.url.path, request.url.query,
+                                     Deadline.from_request(request))
+
+
+@app.post("/query_weather/batch")
+async def query_weather_batch(queries: list[WeatherQueryData], request: Request, raw_data: bool = False):
+    """Lote de consultas: llamadas agrupadas por celda/fechas y respuesta NDJSON en orden."""
+    return await engine.batch(queries, raw_data, Deadline.from_request(request))
+
+
+@app.post("/query_weather/stream")
+async def query_weather_stream(query_data: WeatherQueryData, request: Request, raw_data: bool = False,
+                               accept: Optional[str] = Header(None)):
+    """Consulta en streaming (SSE o NDJSON): ubicación, climatología, datos y riesgos según van llegando."""
+    return await engine.stream(query_data, accept, raw_data, Deadline.from_request(request))
+
+
+@app.get("/risk_grid")
+async def risk_grid(request: Request, south: float, west: float, north: float, east: float,
+                    date_query: str = Query(..., alias="date"), resolution: float = 0.25,
+                    format: str = "json", layer: str = "wet"):
+    """Mapa de riesgo de un rectángulo para el globo (JSON, .npy o PNG de una capa); ver api/engine.py."""
+    return await engine.risk_grid(south, west, north, east, resolution, date_query, format, layer,
+                                  Deadline.from_request(request))
+
+
+@app.get("/metrics")
+async def metrics():
+    """Métricas en formato de texto de Prometheus."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Contadores de aciertos/fallos del cache, peticiones deduplicadas y geocodificación."""
+    return engine.stats()
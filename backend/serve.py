@@ -0,0 +1,69 @@
+# serve.py
+#
+# Punto de entrada de producción: N procesos de uvicorn detrás del mismo puerto.
+#   python serve.py --workers 0              (uno por núcleo)
+#   python serve.py --app run_queries:app    (la app que usa el frontend)
+#   python serve.py --profile-startup        (tiempo de importación por módulo y del lifespan; no arranca)
+#
+# Cada worker corre el lifespan de la app (índice de lugares, monitor del loop, precarga).
+# Lo que se comparte entre procesos vive fuera de ellos:
+#   - respuestas de proveedores, memo de Nominatim y cuotas: SHARED_CACHE_URL (SQLite o Redis)
+#   - índice de lugares y climatología: archivos .npy abiertos con mmap (caché de páginas del SO)
+
+import argparse
+import logging
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("serve")
+
+
+def warm_shared_state():
+    """
+    Trabajo que no debe repetir cada worker: construir el índice de lugares (si el volcado
+    cambió) y crear las tablas del almacén compartido antes de que arranquen los procesos.
+    """
+    import config
+    from services.cache import open_store
+    from services.geocoder import load_index
+
+    if config.GEONAMES_PATH and os.path.exists(config.GEONAMES_PATH):
+        load_index(config.GEONAMES_PATH, config.GEONAMES_COUNTRY_INFO_PATH or None)
+    if config.SHARED_CACHE_URL:
+        for namespace in ("cache", "geocoder", "quota"):
+            open_store(config.SHARED_CACHE_URL, namespace)
+    elif config.WORKERS > 1:
+        logger.warning("SHARED_CACHE_URL vacío: cada worker tendrá su propio cache y repetirá llamadas a los proveedores")
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Servidor Check-now con varios procesos")
+    parser.add_argument("--app", default="app:app", help="app ASGI (app:app o run_queries:app)")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WORKERS", "0")), help="0 = uno por núcleo")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--profile-startup", action="store_true", help="Perfil de arranque en frío y salir")
+    args = parser.parse_args()
+
+    if args.profile_startup:
+        from bench.startup_profile import report
+        report(args.app)
+        return
+
+    workers = args.workers or os.cpu_count() or 1
+    # Los workers lo heredan: reparten el límite de tasa y coordinan el cache compartido
+    os.environ["WORKERS"] = str(workers)
+    warm_shared_state()
+
+    logger.info(f"Iniciando {workers} workers de {args.app} en {args.host}:{args.port}")
+    uvicorn.run(args.app, host=args.host, port=args.port, workers=workers, log_level="info")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,459 @@
+import asyncio
+import functools
+import inspect
+import logging
+import os
+import pickle
+import socket
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+import config
+from services.metrics import registry
+from services.single_flight import provider_flights
+from services.tiling import snap_coordinates
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+MISSING = object()
+
+# Identifica a este proceso en los turnos (leases) del nivel compartido
+OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def make_key(provider: str, lat: float, lon: float, start: str, end: str, **extra) -> str:
+    """Clave de cache: proveedor, celda de la malla, ventana de fechas y parámetros extra."""
+    extra_part = ",".join(f"{k}={extra[k]}" for k in sorted(extra))
+    return f"{provider}|{lat:.4f},{lon:.4f}|{start}--{end}|{extra_part}"
+
+
+# ---------- NIVEL 1: MEMORIA (LRU + TTL) ----------
+
+class MemoryCache:
+    """LRU en proceso con expiración por entrada."""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._data: OrderedDict = OrderedDict()
+
+    def get(self, key: str):
+        entry = self._data.get(key)
+        if entry is None:
+            return MISSING
+        expires_at, value = entry
+        if expires_at < time.time():
+            # Las entradas vencidas se conservan hasta que el LRU las desaloje (ver get_stale)
+            return MISSING
+        self._data.move_to_end(key)
+        return value
+
+    def get_stale(self, key: str):
+        """Valor aunque haya vencido (respaldo cuando el proveedor no responde)."""
+        entry = self._data.get(key)
+        return MISSING if entry is None else entry[1]
+
+    def remaining(self, key: str) -> float:
+        """Segundos de vida que le quedan a la entrada (0 si no está)."""
+        entry = self._data.get(key)
+        return max(0.0, entry[0] - time.time()) if entry is not None else 0.0
+
+    def set(self, key: str, value: Any, ttl: float):
+        self._data[key] = (time.time() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+# ---------- NIVEL 2: DISCO (SQLite, sobrevive reinicios) ----------
+
+class DiskCache:
+    """
+    Cache persistente en SQLite. Los valores se guardan serializados con pickle.
+    Varios procesos pueden abrir el mismo archivo (WAL): es el nivel compartido entre workers.
+    """
+
+    def __init__(self, path: str, table: str = "cache"):
+        self.path = path
+        self.table = table
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._conn.execute(f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return MISSING, 0
+        value, expires_at = row
+        remaining = expires_at - time.time()
+        if remaining <= 0:
+            return MISSING, 0
+        return pickle.loads(value), remaining
+
+    def remaining(self, key: str) -> float:
+        """Segundos de vida que le quedan a key (0 si no está), sin leer el valor."""
+        with self._lock:
+            row = self._conn.execute(f"SELECT expires_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        return max(0.0, row[0] - time.time()) if row is not None else 0.0
+
+    def set(self, key: str, value: Any, ttl: float):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, blob, time.time() + ttl),
+            )
+            self._conn.commit()
+
+    def incr(self, key: str, ttl: float) -> int:
+        """Suma 1 al contador (atómico también entre procesos) y devuelve el nuevo valor."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    f"SELECT value FROM {self.table} WHERE key = ? AND expires_at > ?", (key, time.time())
+                ).fetchone()
+                count = (pickle.loads(row[0]) if row else 0) + 1
+                self._conn.execute(
+                    f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, pickle.dumps(count), time.time() + ttl),
+                )
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+        return count
+
+    def lease(self, key: str, owner: str, ttl: float) -> bool:
+        """Toma (o renueva) el turno de key por ttl segundos; False si lo tiene otro proceso."""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO leases (key, owner, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                "WHERE leases.expires_at < ? OR leases.owner = excluded.owner",
+                (key, owner, now + ttl, now),
+            )
+            self._conn.commit()
+        return cursor.rowcount == 1
+
+    def release(self, key: str, owner: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM leases WHERE key = ? AND owner = ?", (key, owner))
+            self._conn.commit()
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE expires_at < ?", (now,))
+            self._conn.execute("DELETE FROM leases WHERE expires_at < ?", (now,))
+            self._conn.commit()
+
+
+# ---------- NIVEL 2: REDIS (o compatible, compartido entre máquinas) ----------
+
+class RedisCache:
+    """
+    Misma interfaz que DiskCache sobre un cliente Redis síncrono (se llama desde hilos, igual que SQLite).
+    client solo necesita get/set(nx, px)/pttl/incr/expire/pexpire/delete: sirve cualquier servidor
+    compatible (Redis, Valkey, KeyDB, ...) o un cliente falso en pruebas (bench/fake_redis.py).
+    """
+
+    def __init__(self, client, prefix: str = "checknow:cache:"):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url: str, prefix: str = "checknow:cache:") -> "RedisCache":
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError(f"SHARED_CACHE_URL={url} requiere el paquete redis (pip install redis)")
+        return cls(redis.Redis.from_url(url), prefix)
+
+    def get(self, key: str):
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            return MISSING, 0
+        ttl_ms = self.client.pttl(self.prefix + key)
+        if ttl_ms == -2:
+            return MISSING, 0
+        remaining = float("inf") if ttl_ms == -1 else ttl_ms / 1000
+        # Los contadores de incr() se guardan como entero en texto, el resto con pickle
+        return (int(raw) if raw.isdigit() else pickle.loads(raw)), remaining
+
+    def remaining(self, key: str) -> float:
+        ttl_ms = self.client.pttl(self.prefix + key)
+        if ttl_ms == -2:
+            return 0.0
+        return float("inf") if ttl_ms == -1 else ttl_ms / 1000
+
+    def set(self, key: str, value: Any, ttl: float):
+        self.client.set(self.prefix + key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), px=max(1, int(ttl * 1000)))
+
+    def incr(self, key: str, ttl: float) -> int:
+        count = self.client.incr(self.prefix + key)
+        if count == 1:
+            self.client.expire(self.prefix + key, max(1, int(ttl)))
+        return count
+
+    def lease(self, key: str, owner: str, ttl: float) -> bool:
+        name = f"{self.prefix}lease:{key}"
+        if self.client.set(name, owner, nx=True, px=max(1, int(ttl * 1000))):
+            return True
+        current = self.client.get(name)
+        if current is not None and current.decode() == owner:
+            self.client.pexpire(name, max(1, int(ttl * 1000)))
+            return True
+        return False
+
+    def release(self, key: str, owner: str):
+        name = f"{self.prefix}lease:{key}"
+        current = self.client.get(name)
+        if current is not None and current.decode() == owner:
+            self.client.delete(name)
+
+    def purge_expired(self):
+        """Redis expira las claves por su cuenta."""
+
+
+def open_store(url: str, namespace: str = "cache"):
+    """
+    Nivel 2 a partir de una URL: "redis://..." / "rediss://..." o una ruta SQLite
+    (con o sin "sqlite:///"). namespace separa los datos que comparten el mismo almacén.
+    """
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisCache.from_url(url, prefix=f"checknow:{namespace}:")
+    return DiskCache(url.removeprefix("sqlite:///"), table=namespace)
+
+
+# ---------- CACHE POR NIVELES ----------
+
+class WeatherCache:
+    """
+    Memoria primero, luego disco o Redis (opcional). Lleva contadores de aciertos/fallos.
+    Con varios workers el nivel 2 es compartido: un proceso llama al proveedor y los demás leen su resultado.
+    """
+
+    def __init__(self, max_entries: int = 1024, disk_path: Optional[str] = None, workers: int = 1):
+        self.memory = MemoryCache(max_entries)
+        self.disk = open_store(disk_path) if disk_path else None
+        # Solo hace falta coordinarse si hay otros procesos usando el mismo nivel 2
+        self.shared = self.disk is not None and workers > 1
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "stale_served": 0, "peer_waits": 0}
+
+    async def get(self, key: str):
+        value = self.memory.get(key)
+        if value is not MISSING:
+            self.counters["memory_hits"] += 1
+            return value
+        if self.disk is not None:
+            value, remaining = await asyncio.to_thread(self.disk.get, key)
+            if value is not MISSING:
+                self.counters["disk_hits"] += 1
+                self.memory.set(key, value, remaining)
+                return value
+        self.counters["misses"] += 1
+        return MISSING
+
+    async def set(self, key: str, value: Any, ttl: float):
+        self.counters["stores"] += 1
+        self.memory.set(key, value, ttl)
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.set, key, value, ttl)
+
+    async def claim(self, key: str, wait: float):
+        """
+        Turno entre procesos para llamar al proveedor por key. Si lo tiene otro proceso se espera
+        (hasta wait segundos) a que su respuesta aparezca en el nivel compartido.
+        Retorna el valor traído por otro proceso, o MISSING si le toca a este llamar.
+        """
+        deadline = time.monotonic() + wait
+        waited = False
+        while True:
+            leased = await asyncio.to_thread(self.disk.lease, f"fetch|{key}", OWNER, wait)
+            # Otro proceso pudo guardar el valor justo antes de soltar el turno
+            value, remaining = await asyncio.to_thread(self.disk.get, key)
+            if value is not MISSING:
+                if leased:
+                    await self.release(key)
+                self.counters["peer_waits"] += waited
+                self.memory.set(key, value, remaining)
+                return value
+            if leased or time.monotonic() > deadline:
+                return MISSING
+            waited = True
+            await asyncio.sleep(0.05)
+
+    async def release(self, key: str):
+        await asyncio.to_thread(self.disk.release, f"fetch|{key}", OWNER)
+
+    async def lead(self, name: str, ttl: float) -> bool:
+        """True si este proceso es el encargado de una tarea de fondo (siempre, si no hay otros procesos)."""
+        if not self.shared:
+            return True
+        return await asyncio.to_thread(self.disk.lease, f"leader|{name}", OWNER, ttl)
+
+    async def remaining(self, key: str) -> float:
+        """Vida que le queda a key; con nivel compartido cuenta también lo que guardaron otros procesos."""
+        remaining = self.memory.remaining(key)
+        if self.disk is None:
+            return remaining
+        return max(remaining, await asyncio.to_thread(self.disk.remaining, key))
+
+    async def update(self, key: str, fn, ttl: float, wait: float = 5.0):
+        """
+        Read-modify-write de key en el nivel 2 con su turno tomado (atómico entre procesos):
+        guarda y retorna fn(valor actual o MISSING). TimeoutError si no obtiene el turno en wait s.
+        """
+        deadline = time.monotonic() + wait
+        while not await asyncio.to_thread(self.disk.lease, f"update|{key}", OWNER, wait):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Sin turno para actualizar {key}")
+            await asyncio.sleep(0.05)
+        try:
+            value, _ = await asyncio.to_thread(self.disk.get, key)
+            value = fn(value)
+            await asyncio.to_thread(self.disk.set, key, value, ttl)
+            return value
+        finally:
+            await asyncio.to_thread(self.disk.release, f"update|{key}", OWNER)
+
+    def get_stale(self, key: str):
+        value = self.memory.get_stale(key)
+        if value is not MISSING:
+            self.counters["stale_served"] += 1
+        return value
+
+    def clear(self):
+        """Vacía el nivel en memoria y reinicia los contadores (el disco se conserva)."""
+        self.memory.clear()
+        self.counters = dict.fromkeys(self.counters, 0)
+
+    def stats(self) -> dict:
+        hits = self.counters["memory_hits"] + self.counters["disk_hits"]
+        lookups = hits + self.counters["misses"]
+        return {
+            **self.counters,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self.memory),
+            "disk_enabled": self.disk is not None,
+            "shared": self.shared,
+        }
+
+
+weather_cache = WeatherCache(config.CACHE_MAX_ENTRIES, config.SHARED_CACHE_URL or config.CACHE_DB_PATH or None, config.WORKERS)
+registry.register_stats("checknow_weather_cache", "Aciertos/fallos del cache de proveedores", weather_cache.stats)
+
+
+def cached_provider(provider: str, ttl: float):
+    """
+    Decorador para funciones async fetch(lat, lon, start, end, ...).
+    Ajusta las coordenadas a la malla del proveedor y guarda solo respuestas exitosas.
+    Los fallos simultáneos con la misma clave comparten una sola llamada al proveedor.
+    Si el proveedor falla se devuelve la última respuesta vencida que siga en memoria.
+    Con varios workers y nivel compartido, la deduplicación se extiende a todos los procesos.
+    La función decorada expone además cache_key(...) y refresh(...) (consulta sin leer el cache).
+    """
+    def decorator(fetch):
+        signature = inspect.signature(fetch)
+
+        def _bind(*args, **kwargs):
+            # Normaliza argumentos (posicionales, nombrados y por defecto) para que la clave sea estable
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            call = dict(bound.arguments)
+            call["lat"], call["lon"] = snap_coordinates(provider, call["lat"], call["lon"])
+            extra = {k: v for k, v in call.items() if k not in ("lat", "lon", "start", "end")}
+            key = make_key(provider, call["lat"], call["lon"], call["start"], call["end"], **extra)
+            return key, call
+
+        @functools.wraps(fetch)
+        async def wrapper(*args, **kwargs):
+            key, call = _bind(*args, **kwargs)
+            value = await weather_cache.get(key)
+            if value is not MISSING:
+                logger.info(f"Cache hit {key}")
+                return value
+            try:
+                return await provider_flights.do(key, lambda: _fetch_and_store(key, call))
+            except RuntimeError as e:
+                # Proveedor caído o sin cuota: mejor un dato vencido que ninguno
+                stale = weather_cache.get_stale(key)
+                if stale is MISSING:
+                    raise
+                logger.warning(f"Se sirve el dato vencido {key}: {e}")
+                return stale
+
+        async def refresh(*args, **kwargs):
+            key, call = _bind(*args, **kwargs)
+            return await provider_flights.do(key, lambda: _fetch_and_store(key, call))
+
+        async def _fetch_and_store(key, call):
+            if not weather_cache.shared:
+                value = await fetch(**call)
+                await weather_cache.set(key, value, ttl)
+                return value
+            # Varios workers: solo uno llama al proveedor por clave, los demás esperan su resultado
+            value = await weather_cache.claim(key, config.SHARED_FETCH_WAIT)
+            if value is not MISSING:
+                return value
+            try:
+                value = await fetch(**call)
+                await weather_cache.set(key, value, ttl)
+                return value
+            finally:
+                await weather_cache.release(key)
+
+        wrapper.cache_key = lambda *args, **kwargs: _bind(*args, **kwargs)[0]
+        wrapper.refresh = refresh
+        return wrapper
+    return decorator
+
+
+def cached_area(provider: str, ttl: float):
+    """
+    Como cached_provider, para consultas de un rectángulo fetch(south, west, north, east, ...):
+    no se ajusta a la malla, la clave son todos los argumentos. Guarda solo respuestas exitosas
+    y las llamadas simultáneas iguales comparten una sola petición al proveedor.
+    """
+    def decorator(fetch):
+        signature = inspect.signature(fetch)
+
+        @functools.wraps(fetch)
+        async def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            call = dict(bound.arguments)
+            key = f"{provider}|area|" + ",".join(f"{k}={call[k]}" for k in signature.parameters)
+            value = await weather_cache.get(key)
+            if value is not MISSING:
+                logger.info(f"Cache hit {key}")
+                return value
+
+            async def fetch_and_store():
+                value = await fetch(**call)
+                await weather_cache.set(key, value, ttl)
+                return value
+
+            return await provider_flights.do(key, fetch_and_store)
+
+        return wrapper
+    return decorator
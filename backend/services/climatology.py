@@ -0,0 +1,202 @@
+import argparse
+import asyncio
+import logging
+import os
+import warnings
+from datetime import date
+from typing import Optional
+
+import numpy as np
+
+import config
+from services.metrics import registry
+from services.nasa_power import fetch_nasa_power_range
+from services.tiling import snap_coordinates
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Columnas de cada fila (un día del año) del arreglo de una celda
+FIELDS = ("rain_probability", "precip_p50", "precip_p90", "t2m_p10", "t2m_p50", "t2m_p90", "samples")
+
+# Días del año en calendario bisiesto: el 1 de marzo es siempre el índice 60
+DAYS = 366
+_CUMULATIVE_DAYS = np.cumsum([0, 31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30])
+
+
+def day_index(day: date) -> int:
+    """Índice 0..365 del día del año, igual para años bisiestos y no bisiestos."""
+    return int(_CUMULATIVE_DAYS[day.month - 1]) + day.day - 1
+
+
+def compute_climatology(times: np.ndarray, precip: np.ndarray, t2m: np.ndarray,
+                        window: int = 7, wet_day_mm: float = 1.0) -> np.ndarray:
+    """
+    Percentiles y probabilidad de lluvia por día del año, usando los días dentro de ±window
+    de cada fecha en todos los años disponibles.
+    Retorna: arreglo (366 × len(FIELDS)) float32.
+    """
+    months = times.astype("datetime64[M]").astype(int) % 12
+    days = (times.astype("datetime64[D]") - times.astype("datetime64[M]")).astype(int)
+    indexes = _CUMULATIVE_DAYS[months] + days
+
+    table = np.full((DAYS, len(FIELDS)), np.nan, dtype=np.float32)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)  # días sin muestras
+        for d in range(DAYS):
+            distance = np.abs(indexes - d)
+            selected = np.minimum(distance, DAYS - distance) <= window
+            p = precip[selected]
+            p = p[~np.isnan(p)]
+            t = t2m[selected]
+            table[d, 0] = np.mean(p >= wet_day_mm) * 100 if len(p) else np.nan
+            table[d, 1:3] = np.nanpercentile(p, [50, 90]) if len(p) else np.nan
+            table[d, 3:6] = np.nanpercentile(t, [10, 50, 90]) if np.any(~np.isnan(t)) else np.nan
+            table[d, 6] = len(p)
+    return table
+
+
+class ClimatologyStore:
+    """
+    Un archivo .npy por celda de NASA POWER (366 × FIELDS) en `directory`, abierto con mmap.
+    Las consultas son una lectura de fila: O(1) y sin llamadas a la red.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._tables: dict = {}
+        self.counters = {"hits": 0, "misses": 0}
+
+    def _path(self, lat: float, lon: float) -> str:
+        return os.path.join(self.directory, f"clim_{lat:+08.3f}_{lon:+09.3f}.npy")
+
+    def _table(self, lat: float, lon: float) -> Optional[np.ndarray]:
+        cell = snap_coordinates("nasa_power", lat, lon)
+        table = self._tables.get(cell)
+        if table is None:
+            path = self._path(*cell)
+            if not os.path.exists(path):
+                return None
+            table = np.load(path, mmap_mode="r")
+            self._tables[cell] = table
+        return table
+
+    def has_cell(self, lat: float, lon: float) -> bool:
+        return self._table(lat, lon) is not None
+
+    def lookup(self, lat: float, lon: float, day: date) -> Optional[dict]:
+        """Climatología del día del año para la celda (None si la celda no se ha construido)."""
+        table = self._table(lat, lon)
+        if table is None:
+            self.counters["misses"] += 1
+            return None
+        self.counters["hits"] += 1
+        row = table[day_index(day)]
+        return {name: (None if np.isnan(value) else round(float(value), 2)) for name, value in zip(FIELDS, row)}
+
+    def save(self, lat: float, lon: float, table: np.ndarray):
+        os.makedirs(self.directory, exist_ok=True)
+        cell = snap_coordinates("nasa_power", lat, lon)
+        path = self._path(*cell)
+        # Archivo temporal + rename: los demás workers ven la celda completa o no la ven
+        partial_path = f"{path[:-4]}.{os.getpid()}.tmp.npy"
+        np.save(partial_path, table.astype(np.float32))
+        os.replace(partial_path, path)
+        self._tables.pop(cell, None)
+        logger.info(f"Climatología guardada: {path}")
+
+    def stats(self) -> dict:
+        return {**self.counters, "cells_loaded": len(self._tables)}
+
+
+climatology_store = ClimatologyStore(config.CLIMATOLOGY_DIR)
+registry.register_stats("checknow_climatology", "Consultas a la climatología precalculada", climatology_store.stats)
+
+
+def rain_prediction_text(climatology: Optional[dict]) -> Optional[str]:
+    """Texto para 'rain_prediction' a partir de la climatología (None si no hay datos)."""
+    if not climatology or climatology["rain_probability"] is None:
+        return None
+    return f"Probabilidad climatológica de lluvia: {climatology['rain_probability']}%"
+
+
+def degraded_response(lat: float, lon: float, day: date, detail: str) -> Optional[dict]:
+    """
+    Respuesta con la climatología del día cuando el proveedor no responde (circuito abierto,
+    cuota agotada, errores). None si la celda no está precalculada.
+    """
+    climatology = climatology_store.lookup(lat, lon, day)
+    if climatology is None:
+        return None
+    temp = climatology["t2m_p50"]
+    precip = climatology["precip_p50"]
+    return {
+        "status": "degraded",
+        "source": "NASA POWER (climatología)",
+        "location": {"lat": lat, "lon": lon},
+        "temperature": f"{temp}°C" if temp is not None else "--",
+        "precipitation": f"{precip} mm" if precip is not None else "--",
+        "wind": "N/A",
+        "solarRadiation": "--",
+        "rain_prediction": rain_prediction_text(climatology),
+        "detail": detail,
+    }
+
+
+# ---------- CONSTRUCCIÓN (descarga única desde NASA POWER) ----------
+
+async def build_cell(lat: float, lon: float, start_year: int = None, end_year: int = None,
+                     store: ClimatologyStore = climatology_store):
+    """Descarga PRECTOT/T2M diarios de varias décadas para la celda y guarda su climatología."""
+    start_year = start_year or config.CLIMATOLOGY_START_YEAR
+    end_year = end_year or config.CLIMATOLOGY_END_YEAR
+    # El rango se pide en tramos paralelos (NASA_POWER_DAILY_CHUNK_DAYS) que quedan en el cache
+    series = await fetch_nasa_power_range(lat, lon, f"{start_year}-01-01", f"{end_year}-12-31", parameters="T2M,PRECTOT")
+    precip = series.get("PRECTOT") if "PRECTOT" in series else np.full(len(series), np.nan, np.float32)
+    t2m = series.get("T2M") if "T2M" in series else np.full(len(series), np.nan, np.float32)
+    table = compute_climatology(series.times, precip, t2m, config.CLIMATOLOGY_WINDOW_DAYS, config.CLIMATOLOGY_WET_DAY_MM)
+    await asyncio.to_thread(store.save, lat, lon, table)
+
+
+async def build_grid(south: float, west: float, north: float, east: float, concurrency: int = 4):
+    """Construye la climatología de todas las celdas NASA POWER dentro del rectángulo."""
+    dlat, dlon = 0.5, 0.625
+    cells = {
+        snap_coordinates("nasa_power", lat, lon)
+        for lat in np.arange(south, north + dlat, dlat)
+        for lon in np.arange(west, east + dlon, dlon)
+    }
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def build(cell):
+        async with semaphore:
+            if climatology_store.has_cell(*cell):
+                return
+            try:
+                await build_cell(*cell)
+            except Exception as e:
+                logger.error(f"No se pudo construir la climatología de {cell}: {e}")
+
+    logger.info(f"Construyendo climatología de {len(cells)} celdas")
+    await asyncio.gather(*(build(cell) for cell in sorted(cells)))
+
+
+if __name__ == "__main__":
+    # Ejemplo: python -m services.climatology 13.5 -92.5 18.0 -88.0   (Guatemala)
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Precalcula la climatología NASA POWER de una región")
+    parser.add_argument("south", type=float)
+    parser.add_argument("west", type=float)
+    parser.add_argument("north", type=float)
+    parser.add_argument("east", type=float)
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    async def main():
+        from services.http_client import close_clients
+        try:
+            await build_grid(args.south, args.west, args.north, args.east, args.concurrency)
+        finally:
+            await close_clients()
+
+    asyncio.run(main())
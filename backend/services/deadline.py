@@ -0,0 +1,102 @@
+import asyncio
+import contextlib
+import logging
+import time
+from typing import Optional
+
+from fastapi import HTTPException, Request
+
+import config
+from services.metrics import registry
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+HEADER = "X-Request-Deadline-Ms"
+
+
+class DeadlineExceeded(Exception):
+    """Se agotó el plazo de la consulta durante la etapa stage."""
+
+    def __init__(self, stage: str):
+        super().__init__(f"Se agotó el plazo de la consulta en la etapa {stage}")
+        self.stage = stage
+
+
+class Deadline:
+    """
+    Plazo de una consulta, compartido por todas sus etapas:
+
+        |---- geocode ----|------ proveedor(es) ------|-- derivados --|
+        0                                                          budget
+
+    Cada etapa corre con el tiempo que queda (run) y se cancela al agotarse; las llamadas
+    bloqueantes reciben ese resto como timeout (cap). Con un Request se cancela también si el
+    cliente se desconecta (watch).
+    """
+
+    def __init__(self, budget: float, request: Optional[Request] = None):
+        self.budget = budget
+        self.at = time.monotonic() + budget
+        self.request = request
+
+    @classmethod
+    def from_request(cls, request: Optional[Request] = None) -> "Deadline":
+        """Plazo de la cabecera X-Request-Deadline-Ms (hasta REQUEST_DEADLINE_MAX_MS) o REQUEST_DEADLINE_MS."""
+        ms = config.REQUEST_DEADLINE_MS
+        value = request.headers.get(HEADER) if request is not None else None
+        if value:
+            try:
+                ms = float(value)
+            except ValueError:
+                ms = 0
+            if not ms > 0:
+                raise HTTPException(status_code=400, detail=f"{HEADER} inválido: {value}. Usar milisegundos > 0")
+        return cls(min(ms, config.REQUEST_DEADLINE_MAX_MS) / 1000, request)
+
+    def remaining(self) -> float:
+        return max(0.0, self.at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def cap(self, timeout: float) -> float:
+        """timeout recortado a lo que queda del plazo (para llamadas que no se pueden cancelar)."""
+        return min(timeout, self.remaining())
+
+    async def run(self, stage: str, awaitable):
+        """awaitable con el tiempo que queda; si se agota se cancela y se lanza DeadlineExceeded(stage)."""
+        try:
+            return await asyncio.wait_for(awaitable, self.remaining())
+        except asyncio.TimeoutError:
+            deadline_counters["exceeded"] += 1
+            deadline_counters[f"exceeded_{stage}"] = deadline_counters.get(f"exceeded_{stage}", 0) + 1
+            logger.warning(f"Plazo de {self.budget * 1000:.0f} ms agotado en {stage}")
+            raise DeadlineExceeded(stage) from None
+
+    @contextlib.asynccontextmanager
+    async def watch(self):
+        """Cancela la tarea actual si el cliente se desconecta antes de terminar."""
+        if self.request is None:
+            yield
+            return
+        task = asyncio.current_task()
+
+        async def poll():
+            while not await self.request.is_disconnected():
+                await asyncio.sleep(config.REQUEST_DISCONNECT_POLL_MS / 1000)
+            deadline_counters["disconnects"] += 1
+            logger.info(f"Cliente desconectado: se cancela {self.request.url.path}")
+            task.cancel()
+
+        watcher = asyncio.ensure_future(poll())
+        try:
+            yield
+        finally:
+            watcher.cancel()
+
+
+deadline_counters = {"exceeded": 0, "partial": 0, "disconnects": 0}
+registry.register_stats("checknow_deadlines", "Consultas que agotaron su plazo o cuyo cliente se desconectó",
+                        lambda: {**deadline_counters})
@@ -0,0 +1,72 @@
+import json
+import logging
+
+import numpy as np
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # orjson es opcional: sin él se usa el json de la librería estándar
+    orjson = None
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+if orjson is None:
+    logger.info("orjson no está instalado; se usa el módulo json estándar")
+
+
+def _default(value):
+    """Tipos que no son JSON nativo: escalares de numpy -> número, el resto como texto."""
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+
+def loads(data):
+    """bytes/str -> objeto. Lanza ValueError si no es JSON válido (también con orjson)."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(value) -> bytes:
+    """Objeto -> JSON en UTF-8 (sin escapar acentos ni °)."""
+    if orjson is not None:
+        return orjson.dumps(value, default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, default=_default, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def dumps_line(value) -> bytes:
+    """Una línea NDJSON."""
+    return dumps(value) + b"\n"
+
+
+def with_fields(body: dict, **encoded: bytes) -> bytes:
+    """
+    JSON de body más campos que ya vienen codificados (p. ej. raw_data precalculado de la serie):
+    se pegan al final del objeto en vez de volver a recorrer y codificar sus dicts anidados.
+    """
+    head = dumps(body)
+    parts = [b'"' + name.encode() + b'":' + value for name, value in encoded.items() if value is not None]
+    if not parts:
+        return head
+    separator = b"," if len(head) > 2 else b""
+    return head[:-1] + separator + b",".join(parts) + b"}"
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    Respuesta JSON codificada con orjson. Devolverla directamente desde un endpoint también evita
+    el jsonable_encoder de FastAPI (que recorre el dict entero antes de serializarlo).
+    """
+
+    def render(self, content) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return dumps(content)
+
+
+def response(body: dict, status_code: int = 200, **encoded: bytes) -> FastJSONResponse:
+    """Respuesta ya codificada; encoded son campos precodificados (ver with_fields)."""
+    return FastJSONResponse(with_fields(body, **encoded), status_code=status_code)
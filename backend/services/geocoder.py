@@ -0,0 +1,229 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import time
+import unicodedata
+from typing import Optional
+
+import numpy as np
+
+import config
+from services.cache import MemoryCache, MISSING, open_store
+from services.governor import governors
+from services.metrics import registry
+from services.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Tipos de registro en el índice
+KIND_PLACE = 0
+KIND_COUNTRY = 1
+
+# Registro compacto (24 bytes): hash del nombre normalizado, coordenadas, población, país, tipo
+INDEX_DTYPE = np.dtype([
+    ("key", "<u8"),
+    ("lat", "<f4"),
+    ("lon", "<f4"),
+    ("population", "<u4"),
+    ("country", "S2"),
+    ("kind", "u1"),
+    ("_pad", "u1"),
+])
+
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+
+
+def normalize_name(name: str) -> str:
+    """Minúsculas, sin acentos y sin signos: 'Ciudad de Guatemala' == 'ciudad de guatemala'."""
+    folded = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode("ascii")
+    return _NON_ALNUM.sub(" ", folded.lower()).strip()
+
+
+def name_key(name: str) -> int:
+    digest = hashlib.blake2b(normalize_name(name).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+# ---------- ÍNDICE LOCAL (GeoNames) ----------
+
+def build_index(dump_path: str, country_info_path: Optional[str] = None) -> np.ndarray:
+    """
+    Lee un volcado con formato GeoNames (cities500.txt, allCountries.txt, ...) y devuelve
+    el índice ordenado por clave. Cada nombre alternativo genera su propio registro.
+    """
+    rows = []
+
+    def add(name, lat, lon, population, country, kind):
+        if name:
+            rows.append((name_key(name), lat, lon, population, country, kind, 0))
+
+    with open(dump_path, encoding="utf-8") as f:
+        for line in f:
+            cols = line.rstrip("\n").split("\t")
+            if len(cols) < 15:
+                continue
+            lat, lon = float(cols[4]), float(cols[5])
+            population = min(int(cols[14] or 0), 2**32 - 1)
+            country = cols[8].encode("ascii", "ignore")[:2]
+            kind = KIND_COUNTRY if cols[7].startswith("PCL") else KIND_PLACE
+            names = {cols[1], cols[2], *cols[3].split(",")} if cols[3] else {cols[1], cols[2]}
+            for name in names:
+                add(name, lat, lon, population, country, kind)
+
+    # countryInfo.txt solo aporta nombres -> código ISO (sin coordenadas)
+    if country_info_path:
+        with open(country_info_path, encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("#"):
+                    continue
+                cols = line.rstrip("\n").split("\t")
+                if len(cols) > 4:
+                    add(cols[4], np.nan, np.nan, 0, cols[0].encode("ascii"), KIND_COUNTRY)
+
+    index = np.array(rows, dtype=INDEX_DTYPE)
+    index.sort(order="key")
+    return index
+
+
+def load_index(dump_path: str, country_info_path: Optional[str] = None) -> np.ndarray:
+    """
+    Carga el índice memory-mapped desde '<dump>.idx.npy'; lo reconstruye si el volcado es más nuevo.
+    """
+    index_path = f"{dump_path}.idx.npy"
+    if not os.path.exists(index_path) or os.path.getmtime(index_path) < os.path.getmtime(dump_path):
+        started = time.perf_counter()
+        # Se escribe aparte y se renombra: otros procesos nunca abren un índice a medio escribir
+        partial_path = f"{dump_path}.{os.getpid()}.tmp.npy"
+        np.save(partial_path, build_index(dump_path, country_info_path))
+        os.replace(partial_path, index_path)
+        logger.info(f"Índice de lugares construido en {time.perf_counter() - started:.1f}s: {index_path}")
+    return np.load(index_path, mmap_mode="r")
+
+
+# ---------- GEOCODIFICADOR ----------
+
+class Geocoder:
+    """
+    Resuelve país/ciudad/localidad a lat/lon: primero el índice local, luego la memoria
+    de resultados anteriores de Nominatim y, por último, Nominatim (máx. 1 petición/s).
+    """
+
+    def __init__(self, dump_path: Optional[str] = None, country_info_path: Optional[str] = None,
+                 memo_path: Optional[str] = None):
+        self.dump_path = dump_path
+        self.country_info_path = country_info_path
+        self.index: Optional[np.ndarray] = None
+        self.memo = MemoryCache(4096)
+        self.memo_disk = open_store(memo_path, "geocoder") if memo_path else None
+        self._nominatim = None
+        # Consultas concurrentes del mismo lugar esperan una sola llamada a Nominatim
+        self.flights = SingleFlight()
+        self.counters = {"index_hits": 0, "memo_hits": 0, "nominatim_calls": 0, "not_found": 0}
+
+    def load(self):
+        """Carga el índice local (si se configuró un volcado GeoNames)."""
+        if self.dump_path and os.path.exists(self.dump_path):
+            self.index = load_index(self.dump_path, self.country_info_path)
+            logger.info(f"Índice de lugares cargado: {len(self.index)} nombres")
+        elif self.dump_path:
+            logger.warning(f"No existe el volcado GeoNames {self.dump_path}; se usará solo Nominatim")
+
+    def _matches(self, name: str, kind: int, country: Optional[bytes] = None) -> np.ndarray:
+        key = np.uint64(name_key(name))
+        lo = np.searchsorted(self.index["key"], key, side="left")
+        hi = np.searchsorted(self.index["key"], key, side="right")
+        found = self.index[lo:hi]
+        found = found[found["kind"] == kind]
+        if country is not None:
+            found = found[found["country"] == country]
+        return found
+
+    def lookup_local(self, country: Optional[str], city: Optional[str], locality: Optional[str]):
+        """Búsqueda en el índice local. Devuelve (lat, lon) o None."""
+        if self.index is None or len(self.index) == 0:
+            return None
+
+        country_code = None
+        country_rows = None
+        if country:
+            country_rows = self._matches(country, KIND_COUNTRY)
+            if len(country_rows) == 0:
+                return None
+            country_code = country_rows[0]["country"]
+
+        # Gana el lugar más poblado con ese nombre dentro del país (localidad antes que ciudad)
+        names = [n for n in (locality, city) if n]
+        for name in names:
+            places = self._matches(name, KIND_PLACE, country_code)
+            if len(places):
+                best = places[np.argmax(places["population"])]
+                return round(float(best["lat"]), 5), round(float(best["lon"]), 5)
+        if names:
+            return None
+
+        located = country_rows[~np.isnan(country_rows["lat"])] if country_rows is not None else []
+        if len(located):
+            return round(float(located[0]["lat"]), 5), round(float(located[0]["lon"]), 5)
+        return None
+
+    async def _nominatim_geocode(self, query: str, timeout: Optional[float] = None):
+        from geopy.exc import GeocoderRateLimited, GeocoderTimedOut, GeocoderUnavailable
+        from geopy.geocoders import Nominatim
+
+        if self._nominatim is None:
+            self._nominatim = Nominatim(user_agent=config.NOMINATIM_USER_AGENT)
+        # Nominatim permite 1 petición/s: lo aplica governors["nominatim"] (sin ráfagas)
+        self.counters["nominatim_calls"] += 1
+        return await governors["nominatim"].call(
+            lambda: asyncio.to_thread(self._nominatim.geocode, query, timeout=config.NOMINATIM_TIMEOUT if timeout is None else timeout),
+            is_retryable=lambda e: isinstance(e, (GeocoderRateLimited, GeocoderTimedOut, GeocoderUnavailable)),
+        )
+
+    async def geocode(self, country: Optional[str], city: Optional[str], locality: Optional[str],
+                      timeout: Optional[float] = None):
+        """Devuelve (lat, lon) o None si la ubicación no existe. timeout acota la llamada a Nominatim (segundos)."""
+        local = self.lookup_local(country, city, locality)
+        if local is not None:
+            self.counters["index_hits"] += 1
+            return local
+
+        query = ", ".join(p for p in [locality, city, country] if p)
+        memo_key = normalize_name(query)
+        return await self.flights.do(memo_key, lambda: self._remote_geocode(query, memo_key, timeout))
+
+    async def _remote_geocode(self, query: str, memo_key: str, timeout: Optional[float] = None):
+        """Memoria de resultados (local y compartida) y, si no está, Nominatim; una vez por lugar a la vez."""
+        cached = self.memo.get(memo_key)
+        if cached is MISSING and self.memo_disk is not None:
+            cached, remaining = await asyncio.to_thread(self.memo_disk.get, memo_key)
+            if cached is not MISSING:
+                self.memo.set(memo_key, cached, remaining)
+        if cached is not MISSING:
+            self.counters["memo_hits"] += 1
+            return tuple(cached) if cached else None
+
+        location = await self._nominatim_geocode(query, timeout)
+        result = (location.latitude, location.longitude) if location else None
+        # Los "no encontrado" también se recuerdan, pero por menos tiempo
+        ttl = config.GEOCODER_MEMO_TTL if result else config.GEOCODER_NEGATIVE_TTL
+        self.memo.set(memo_key, result, ttl)
+        if self.memo_disk is not None:
+            await asyncio.to_thread(self.memo_disk.set, memo_key, result, ttl)
+        if result is None:
+            self.counters["not_found"] += 1
+        return result
+
+    def stats(self) -> dict:
+        return {**self.counters, "deduplicated": self.flights.counters["deduplicated"],
+                "index_size": 0 if self.index is None else len(self.index)}
+
+
+geocoder = Geocoder(
+    config.GEONAMES_PATH or None,
+    config.GEONAMES_COUNTRY_INFO_PATH or None,
+    config.SHARED_CACHE_URL or config.GEOCODER_MEMO_PATH or None,
+)
+registry.register_stats("checknow_geocoder", "Resoluciones por índice local, memo y Nominatim", geocoder.stats)
@@ -0,0 +1,270 @@
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+import httpx
+
+import config
+from services.cache import MISSING, open_store
+from services.metrics import registry
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Host de cada proveedor HTTP (Nominatim pasa por geopy, no por http_client)
+PROVIDER_HOSTS = {
+    "api.meteomatics.com": "meteomatics",
+    "power.larc.nasa.gov": "nasa_power",
+}
+
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class ProviderUnavailable(RuntimeError):
+    """El proveedor no se llama: circuito abierto, cuota agotada o límite de tasa saturado."""
+
+
+def is_retryable_http(error: Exception) -> bool:
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in RETRYABLE_STATUS
+    return isinstance(error, httpx.TransportError)
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    if isinstance(error, httpx.HTTPStatusError):
+        value = error.response.headers.get("Retry-After", "")
+        if value.isdigit():
+            return float(value)
+    return None
+
+
+# ---------- CUOTA DIARIA ----------
+
+class QuotaLedger:
+    """
+    Llamadas por proveedor y día (UTC); opcionalmente persistidas en SQLite o Redis.
+    Con varios workers (shared) el contador vive en el almacén compartido y se suma de forma atómica.
+    """
+
+    def __init__(self, path: Optional[str] = None, shared: bool = False):
+        self.disk = open_store(path, "quota") if path else None
+        self.shared = shared and self.disk is not None
+        self._counts: dict = {}
+
+    @staticmethod
+    def _key(provider: str) -> str:
+        return f"quota|{provider}|{datetime.now(timezone.utc).date().isoformat()}"
+
+    async def used(self, provider: str) -> int:
+        key = self._key(provider)
+        if self.shared:
+            # Los demás procesos también gastan cuota: se lee siempre el contador compartido
+            stored, _ = await asyncio.to_thread(self.disk.get, key)
+            return 0 if stored is MISSING else stored
+        count = self._counts.get(key)
+        if count is None:
+            # Día nuevo (o primer uso): se olvidan los días anteriores de ese proveedor
+            for old in [k for k in self._counts if k.startswith(f"quota|{provider}|")]:
+                del self._counts[old]
+            count = 0
+            if self.disk is not None:
+                stored, _ = await asyncio.to_thread(self.disk.get, key)
+                count = 0 if stored is MISSING else stored
+            self._counts[key] = count
+        return count
+
+    async def add(self, provider: str):
+        key = self._key(provider)
+        if self.shared:
+            await asyncio.to_thread(self.disk.incr, key, 2 * 24 * 3600)
+            return
+        count = await self.used(provider) + 1
+        self._counts[key] = count
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.set, key, count, 2 * 24 * 3600)
+
+
+# ---------- GOVERNOR ----------
+
+class ProviderGovernor:
+    """
+    Delante de cada proveedor: límite de tasa (token bucket), cuota diaria, reintentos
+    acotados con espera exponencial aleatoria y circuito que falla de inmediato mientras
+    el proveedor está caído. clock y sleep se pueden reemplazar (reloj simulado en los tests).
+    """
+
+    def __init__(self, name: str, rate: float, daily_quota: int = 0, ledger: Optional[QuotaLedger] = None,
+                 max_retries: int = 2, backoff_base: float = 0.25, backoff_max: float = 4.0,
+                 max_rate_wait: float = 5.0, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 burst: Optional[float] = None, clock=time.monotonic, sleep=asyncio.sleep):
+        self.name = name
+        self.clock = clock
+        self.sleep = sleep
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate * 2)
+        self.tokens = self.burst
+        self.updated = clock()
+        self.daily_quota = daily_quota
+        self.ledger = ledger or QuotaLedger()
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_rate_wait = max_rate_wait
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self.counters = {"calls": 0, "retries": 0, "failures": 0, "rejected_open": 0,
+                         "rejected_quota": 0, "rejected_rate": 0, "circuit_opened": 0}
+
+    # ---------- circuito ----------
+
+    def _allow(self) -> bool:
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and self.clock() - self.opened_at >= self.reset_timeout:
+            self.state = HALF_OPEN
+            self._probing = False
+        if self.state == HALF_OPEN and not self._probing:
+            # Una sola petición de prueba decide si se cierra o se vuelve a abrir
+            self._probing = True
+            return True
+        return False
+
+    def _success(self):
+        if self.state != CLOSED:
+            logger.info(f"Circuito de {self.name} cerrado")
+        self.state = CLOSED
+        self.failures = 0
+        self._probing = False
+
+    def _failure(self):
+        self.failures += 1
+        self.counters["failures"] += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                self.counters["circuit_opened"] += 1
+                logger.warning(f"Circuito de {self.name} abierto tras {self.failures} fallos")
+            self.state = OPEN
+            self.opened_at = self.clock()
+            self._probing = False
+
+    # ---------- tasa y cuota ----------
+
+    async def _acquire(self):
+        while True:
+            now = self.clock()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            wait = (1 - self.tokens) / self.rate
+            if wait > self.max_rate_wait:
+                self.counters["rejected_rate"] += 1
+                raise ProviderUnavailable(f"{self.name}: límite de tasa saturado")
+            await self.sleep(wait)
+
+    async def _check_quota(self):
+        if self.daily_quota and await self.ledger.used(self.name) >= self.daily_quota:
+            self.counters["rejected_quota"] += 1
+            raise ProviderUnavailable(f"{self.name}: cuota diaria agotada ({self.daily_quota} llamadas)")
+
+    # ---------- llamada ----------
+
+    async def call(self, fn, is_retryable=is_retryable_http):
+        """Ejecuta fn() (corrutina) respetando límites, reintentos y circuito."""
+        for attempt in range(self.max_retries + 1):
+            if not self._allow():
+                self.counters["rejected_open"] += 1
+                raise ProviderUnavailable(f"{self.name} no disponible (circuito abierto)")
+            probe = self.state == HALF_OPEN
+            try:
+                await self._check_quota()
+                await self._acquire()
+                self.counters["calls"] += 1
+                await self.ledger.add(self.name)
+                try:
+                    result = await fn()
+                except Exception as e:
+                    if not is_retryable(e):
+                        # Errores del cliente (401, 404, ...) ni se reintentan ni cuentan como caída;
+                        # http_client.get los devuelve como respuesta y ya cuentan como éxito
+                        raise
+                    self._failure()
+                    if attempt == self.max_retries or self.state == OPEN:
+                        raise
+                    delay = _retry_after(e) or random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                    self.counters["retries"] += 1
+                    logger.warning(f"Reintento {attempt + 1} de {self.name} en {delay:.2f}s: {e}")
+                    await self.sleep(min(delay, self.backoff_max))
+                else:
+                    self._success()
+                    return result
+            finally:
+                # Prueba sin veredicto (cancelada por plazo o desconexión, sin cuota, sin turno de
+                # tasa u otro error): se libera el turno para que la siguiente llamada pruebe
+                if probe and self.state == HALF_OPEN:
+                    self._probing = False
+
+    def stats(self) -> dict:
+        return {**self.counters, "state": self.state, "consecutive_failures": self.failures}
+
+
+_ledger = QuotaLedger(config.SHARED_CACHE_URL or config.QUOTA_LEDGER_PATH or None, shared=config.WORKERS > 1)
+
+
+def _worker_quota(quota: int) -> int:
+    # Sin contador compartido cada worker solo puede gastar su parte de la cuota diaria
+    if not quota or _ledger.shared:
+        return quota
+    return max(1, quota // max(1, config.WORKERS))
+
+
+# Cada worker tiene su propio token bucket: el límite de tasa del proveedor se reparte entre ellos
+governors = {
+    name: ProviderGovernor(
+        name,
+        rate=config.PROVIDER_RATE[name] / max(1, config.WORKERS),
+        daily_quota=_worker_quota(config.PROVIDER_DAILY_QUOTA[name]),
+        ledger=_ledger,
+        max_retries=config.PROVIDER_MAX_RETRIES,
+        backoff_base=config.PROVIDER_BACKOFF_BASE,
+        backoff_max=config.PROVIDER_BACKOFF_MAX,
+        max_rate_wait=config.PROVIDER_MAX_RATE_WAIT,
+        failure_threshold=config.CIRCUIT_FAILURE_THRESHOLD,
+        reset_timeout=config.CIRCUIT_RESET_TIMEOUT,
+        # Nominatim no admite ráfagas: como máximo 1 petición/s
+        burst=1 if name == "nominatim" else None,
+    )
+    for name in config.PROVIDER_RATE
+}
+
+
+def governor_for_host(host: str) -> Optional[ProviderGovernor]:
+    name = PROVIDER_HOSTS.get(host)
+    return governors.get(name) if name else None
+
+
+def governor_stats() -> dict:
+    return {name: governor.stats() for name, governor in governors.items()}
+
+
+def _flat_stats() -> dict:
+    # Para /metrics: estado del circuito como número (0 cerrado, 1 medio abierto, 2 abierto)
+    states = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+    flat = {}
+    for name, governor in governors.items():
+        for key, value in governor.stats().items():
+            flat[f"{name}_{key}"] = states[value] if key == "state" else value
+    return flat
+
+
+registry.register_stats("checknow_governor", "Límites, reintentos y circuito de cada proveedor", _flat_stats)
@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Optional
+
+import config
+from services.metrics import registry
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class LatencyWindow:
+    """Últimas latencias (segundos) de cada proveedor, para calcular percentiles recientes."""
+
+    def __init__(self, size: int = 256, min_samples: int = 20):
+        self.size = size
+        self.min_samples = min_samples
+        self._samples: dict = {}
+
+    def record(self, name: str, seconds: float):
+        self._samples.setdefault(name, deque(maxlen=self.size)).append(seconds)
+
+    def percentile(self, name: str, pct: float) -> Optional[float]:
+        """Percentil pct (0-100) de las muestras recientes; None si aún no hay suficientes."""
+        samples = self._samples.get(name)
+        if samples is None or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class Hedger:
+    """
+    Carrera entre proveedores con pedidos de respaldo (hedging):
+
+        proveedor 1 ──────────────x (tarda más que su percentil)
+                         └─ proveedor 2 ────✓ -> gana, se cancela el resto
+
+    El siguiente intento sale cuando el anterior supera el percentil HEDGE_PERCENTILE de su
+    latencia reciente (o de inmediato si falló). Gana el primer resultado válido y los demás
+    se cancelan. Con deadline (time.monotonic()) no se espera ni se lanza nada más allá de él.
+    """
+
+    def __init__(self, percentile: float, default_delay: float, min_delay: float, max_delay: float):
+        self.percentile = percentile
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.latencies = LatencyWindow()
+        self.counters = {"races": 0, "hedged": 0, "failovers": 0, "hedge_wins": 0, "deadline_exceeded": 0}
+
+    def delay(self, name: str) -> float:
+        """Segundos que se espera a name antes de lanzar el siguiente intento."""
+        observed = self.latencies.percentile(name, self.percentile)
+        if observed is None:
+            return self.default_delay
+        return min(self.max_delay, max(self.min_delay, observed))
+
+    async def race(self, attempts: list, deadline: Optional[float] = None) -> tuple:
+        """
+        attempts: [(nombre, fábrica)] en orden de preferencia; fábrica() devuelve la corrutina.
+        Retorna: (nombre, resultado) del primer intento que termina sin error.
+        Si todos fallan se relanza el error del primero; al pasar el deadline, asyncio.TimeoutError.
+        """
+        self.counters["races"] += 1
+        remaining = list(attempts)
+        pending: dict = {}
+        errors = []
+        last_started = None
+
+        def launch():
+            nonlocal last_started
+            name, factory = remaining.pop(0)
+            last_started = (name, time.perf_counter())
+            pending[asyncio.ensure_future(factory())] = last_started
+
+        launch()
+        try:
+            while pending:
+                timeout = None
+                if remaining:
+                    name, started = last_started
+                    timeout = max(0.0, started + self.delay(name) - time.perf_counter())
+                if deadline is not None:
+                    left = deadline - time.monotonic()
+                    if left <= 0:
+                        self.counters["deadline_exceeded"] += 1
+                        raise asyncio.TimeoutError()
+                    timeout = left if timeout is None else min(timeout, left)
+
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if remaining and (deadline is None or time.monotonic() < deadline):
+                        logger.info(f"Pedido de respaldo: {remaining[0][0]} ({last_started[0]} tarda más de {self.delay(last_started[0]) * 1000:.0f} ms)")
+                        self.counters["hedged"] += 1
+                        launch()
+                    continue
+
+                for task in done:
+                    name, started = pending.pop(task)
+                    error = task.exception()
+                    if error is None:
+                        self.latencies.record(name, time.perf_counter() - started)
+                        if name != attempts[0][0]:
+                            self.counters["hedge_wins"] += 1
+                        return name, task.result()
+                    errors.append(error)
+                # Todo lo que estaba en curso falló: el siguiente sale sin esperar
+                if not pending and remaining:
+                    logger.warning(f"{errors[-1]!r}; se consulta {remaining[0][0]}")
+                    self.counters["failovers"] += 1
+                    launch()
+            raise errors[0]
+        finally:
+            # Los perdedores se cancelan; las llamadas compartidas (single-flight) siguen y llenan el cache
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> dict:
+        return {**self.counters}
+
+
+hedger = Hedger(
+    config.HEDGE_PERCENTILE,
+    config.HEDGE_DEFAULT_DELAY_MS / 1000,
+    config.HEDGE_MIN_DELAY_MS / 1000,
+    config.HEDGE_MAX_DELAY_MS / 1000,
+)
+registry.register_stats("checknow_hedging", "Carreras entre proveedores y pedidos de respaldo", hedger.stats)
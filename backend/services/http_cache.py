@@ -0,0 +1,82 @@
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from fastapi.responses import Response
+
+import config
+from models.timeseries import TimeSeries
+from services.metrics import registry
+
+# Cambia si cambia el formato de la respuesta: invalida los ETags anteriores
+RESPONSE_VERSION = "1"
+
+
+def etag_for(provider: str, key: str, data: TimeSeries) -> str:
+    """
+    ETag fuerte a partir de la versión de los datos: proveedor, URL canónica y el contenido
+    de la serie (fechas y valores). Misma serie en el cache -> mismo ETag.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{RESPONSE_VERSION}|{provider}|{key}".encode())
+    digest.update(data.times.tobytes())
+    for name in sorted(data.values):
+        digest.update(name.encode())
+        digest.update(data.values[name].tobytes())
+    return f'"{digest.hexdigest()}"'
+
+
+def matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match (lista de ETags, W/ o *) contra el ETag actual (comparación débil, RFC 9110)."""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in (tag.removeprefix("W/") for tag in candidates)
+
+
+def cache_control(max_age: int) -> str:
+    return f"public, max-age={max_age}" if max_age > 0 else "no-cache"
+
+
+def not_modified(etag: str, max_age: int) -> Response:
+    """304 sin cuerpo con las mismas cabeceras de cache."""
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control(max_age)})
+
+
+class ETagIndex:
+    """
+    Último ETag de cada URL canónica mientras sigue fresco (max-age): un If-None-Match que
+    coincide se responde 304 sin volver a consultar el proveedor ni construir la respuesta.
+    """
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+        self.counters = {"not_modified_indexed": 0, "not_modified": 0, "full": 0, "redirects": 0}
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        etag, expires = entry
+        if expires <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return etag
+
+    def put(self, key: str, etag: str, max_age: int):
+        if max_age <= 0:
+            return
+        self._entries[key] = (etag, time.time() + max_age)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {**self.counters, "entries": len(self._entries)}
+
+
+etag_index = ETagIndex(config.HTTP_ETAG_ENTRIES)
+registry.register_stats("checknow_http_cache", "Respuestas 304, completas y redirecciones a la URL canónica", etag_index.stats)
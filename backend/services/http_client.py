@@ -0,0 +1,85 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+import config
+from services.governor import RETRYABLE_STATUS, governor_for_host
+from services.metrics import record_upstream
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Un cliente (pool keep-alive) y un semáforo por host, compartidos por todas las peticiones
+_clients: dict = {}
+_semaphores: dict = {}
+
+# Transporte alternativo (p. ej. servidores falsos en pruebas o benchmarks)
+_transport: Optional[httpx.AsyncBaseTransport] = None
+
+
+def set_transport(transport: Optional[httpx.AsyncBaseTransport]):
+    """Reemplaza el transporte de red de los clientes nuevos (None = red real)."""
+    global _transport
+    _transport = transport
+
+
+def _get_client(host: str) -> httpx.AsyncClient:
+    client = _clients.get(host)
+    if client is None or client.is_closed:
+        limits = httpx.Limits(
+            max_connections=config.HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=config.HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=config.HTTP_KEEPALIVE_EXPIRY,
+        )
+        client = httpx.AsyncClient(limits=limits, transport=_transport)
+        _clients[host] = client
+    return client
+
+
+def _get_semaphore(host: str) -> asyncio.Semaphore:
+    semaphore = _semaphores.get(host)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(config.HOST_CONCURRENCY.get(host, config.HTTP_HOST_CONCURRENCY))
+        _semaphores[host] = semaphore
+    return semaphore
+
+
+async def get(url: str, *, params: Optional[dict] = None, auth=None, timeout: float = 20) -> httpx.Response:
+    """
+    GET asíncrono reutilizando el pool del host y respetando su límite de concurrencia.
+    Si el host es un proveedor conocido pasa por su governor (tasa, cuota, reintentos, circuito);
+    las respuestas 429/5xx se lanzan como httpx.HTTPStatusError.
+    """
+    host = urlsplit(url).netloc
+    request_timeout = httpx.Timeout(timeout, connect=min(config.HTTP_CONNECT_TIMEOUT, timeout))
+
+    async def attempt():
+        async with _get_semaphore(host):
+            start = time.perf_counter()
+            try:
+                response = await _get_client(host).get(url, params=params, auth=auth, timeout=request_timeout)
+            except httpx.RequestError:
+                record_upstream(host, "error", time.perf_counter() - start)
+                raise
+            record_upstream(host, response.status_code, time.perf_counter() - start, len(response.content))
+        if response.status_code in RETRYABLE_STATUS:
+            response.raise_for_status()
+        return response
+
+    governor = governor_for_host(host)
+    if governor is None:
+        return await attempt()
+    return await governor.call(attempt)
+
+
+async def close_clients():
+    """Cierra todos los pools (se llama al apagar la aplicación)."""
+    for host, client in list(_clients.items()):
+        await client.aclose()
+        logger.info(f"Cliente HTTP cerrado: {host}")
+    _clients.clear()
+    _semaphores.clear()
@@ -0,0 +1,209 @@
+import asyncio
+import bisect
+import contextlib
+import logging
+import threading
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+import config
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Límites (segundos) de los histogramas de latencia
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+# ---------- TIPOS DE MÉTRICA (formato de texto de Prometheus) ----------
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name, self.help, self.labelnames = name, help, labelnames
+        self._values: dict = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels[n]) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    def set(self, value: float, **labels):
+        key = tuple(str(labels[n]) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self) -> list:
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, labelnames
+        self.buckets = tuple(sorted(buckets))
+        self._series: dict = {}  # etiquetas -> [conteo por bucket, suma, total]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[n]) for n in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labelnames + ("le",)
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f"{self.name}_bucket{_labels(names, key + (_number(bound),))} {cumulative}")
+                lines.append(f"{self.name}_bucket{_labels(names, key + ('+Inf',))} {count}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    """Métricas propias más colectores que leen los stats() de los demás servicios al exportar."""
+
+    def __init__(self):
+        self._metrics: list = []
+        self._collectors: list = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def register_stats(self, prefix: str, help: str, stats_fn):
+        """Expone cada valor numérico de stats_fn() como gauge prefix{key="..."}."""
+        self._collectors.append((prefix, help, stats_fn))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        for prefix, help, stats_fn in self._collectors:
+            gauge = Gauge(prefix, help, ("key",))
+            try:
+                stats = stats_fn()
+            except Exception as e:
+                logger.error(f"No se pudieron leer las métricas de {prefix}: {e}")
+                continue
+            for key, value in stats.items():
+                if isinstance(value, (int, float)):
+                    gauge.set(value, key=key)
+            lines += gauge.render()
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUEST_SECONDS = registry.register(Histogram(
+    "checknow_request_duration_seconds", "Duración de las peticiones HTTP", ("method", "path", "status")))
+STAGE_SECONDS = registry.register(Histogram(
+    "checknow_stage_duration_seconds", "Duración de cada etapa de una consulta", ("stage",)))
+UPSTREAM_SECONDS = registry.register(Histogram(
+    "checknow_upstream_duration_seconds", "Latencia de las llamadas a proveedores externos", ("host",)))
+UPSTREAM_REQUESTS = registry.register(Counter(
+    "checknow_upstream_requests_total", "Llamadas a proveedores externos por código de estado", ("host", "status")))
+UPSTREAM_BYTES = registry.register(Counter(
+    "checknow_upstream_response_bytes_total", "Bytes recibidos de proveedores externos", ("host",)))
+LOOP_LAG_SECONDS = registry.register(Histogram(
+    "checknow_event_loop_lag_seconds", "Retraso del event loop respecto al intervalo esperado",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)))
+
+
+# ---------- ETAPAS POR PETICIÓN ----------
+
+# Etapas medidas durante la petición en curso (para la cabecera Server-Timing)
+_request_stages: ContextVar[Optional[list]] = ContextVar("request_stages", default=None)
+
+
+@contextlib.contextmanager
+def stage(name: str):
+    """with stage("geocode"): ...  -> histograma por etapa y entrada en Server-Timing."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        stages = _request_stages.get()
+        if stages is not None:
+            stages.append((name, elapsed))
+
+
+def record_upstream(host: str, status, elapsed: float, size: int = 0):
+    UPSTREAM_SECONDS.observe(elapsed, host=host)
+    UPSTREAM_REQUESTS.inc(host=host, status=status)
+    if size:
+        UPSTREAM_BYTES.inc(size, host=host)
+
+
+def server_timing(stages: list, total: float) -> str:
+    parts = [f"{name};dur={elapsed * 1000:.1f}" for name, elapsed in stages]
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+async def metrics_middleware(request, call_next):
+    """Middleware HTTP: duración por ruta y, si SERVER_TIMING está activo, la cabecera Server-Timing."""
+    stages = []
+    token = _request_stages.set(stages)
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        _request_stages.reset(token)
+    elapsed = time.perf_counter() - start
+    route = request.scope.get("route")
+    path = getattr(route, "path", "unmatched")
+    REQUEST_SECONDS.observe(elapsed, method=request.method, path=path, status=response.status_code)
+    if config.SERVER_TIMING:
+        response.headers["Server-Timing"] = server_timing(stages, elapsed)
+    return response
+
+
+# ---------- RETRASO DEL EVENT LOOP ----------
+
+async def _monitor_loop_lag(interval: float):
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        LOOP_LAG_SECONDS.observe(max(0.0, time.perf_counter() - start - interval))
+
+
+def start_loop_lag_monitor(interval: float = None) -> asyncio.Task:
+    """Tarea de fondo que mide cuánto tarda el loop en despertar (bloqueos = latencia para todos)."""
+    return asyncio.create_task(_monitor_loop_lag(interval or config.EVENT_LOOP_LAG_INTERVAL))
@@ -1,37 +1,47 @@
-import requests
+import asyncio
+import httpx
 import logging
+from collections import OrderedDict
+from datetime import date, timedelta
+
+import numpy as np
+
+import config
+from services import http_client, fast_json
+from services.cache import cached_area, cached_provider, make_key, weather_cache, MISSING
+from services.metrics import stage
+from services.tiling import snap_coordinates
+from models.timeseries import AreaSeries, TimeSeries
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
-def fetch_nasa_power(lat: float, lon: float, start: str, end: str, parameters: str = "T2M,PRECTOT,ALLSKY_SFC_SW_DWN", community: str = "AG"):
-    """
-    Consulta la API de NASA POWER y devuelve series temporales.
-    """
-    base_url = "https://power.larc.nasa.gov/api/temporal/daily/point"
-    url = base_url
-    params = {
-        "start": start.replace("-", ""),
-        "end": end.replace("-", ""),
-        "latitude": lat,
-        "longitude": lon,
-        "parameters": parameters,
-        "community": community,
-        "format": "JSON"
-    }
+BASE_URL = "https://power.larc.nasa.gov/api/temporal/{temporal}/{spatial}"
 
+DAILY = "daily"
+HOURLY = "hourly"
+# El horario usa el nombre nuevo de la precipitación (PRECTOT ya no existe en ese endpoint) y trae viento
+HOURLY_PARAMETERS = "T2M,PRECTOTCORR,WS10M,ALLSKY_SFC_SW_DWN"
+
+
+async def _request(temporal: str, params: dict, spatial: str = "point") -> dict:
+    """Una llamada a NASA POWER (daily, hourly o climatology; point o regional); devuelve el JSON ya validado."""
+    url = BASE_URL.format(temporal=temporal, spatial=spatial)
+    # El punto trae properties; el regional es un GeoJSON con un feature por nodo
+    expected = "features" if spatial == "regional" else "properties"
     try:
         logger.info(f"Consultando NASA POWER: {url} con {params}")
-        response = requests.get(url, params=params, timeout=20)
+        response = await http_client.get(url, params={**params, "format": "JSON"}, timeout=config.NASA_POWER_TIMEOUT)
         response.raise_for_status()
 
         try:
-            data = response.json()
+            with stage("parse_nasa_power"):
+                data = fast_json.loads(response.content)
         except ValueError:
             logger.error("Respuesta no es JSON válido.")
             raise RuntimeError("Respuesta no válida de NASA POWER (no es JSON).")
 
-        if not isinstance(data, dict) or "properties" not in data:
+        if not isinstance(data, dict) or expected not in data:
             logger.error(f"Estructura inesperada: {data}")
             raise RuntimeError("Estructura inesperada recibida desde NASA POWER.")
 
@@ -39,15 +49,309 @@ def fetch_nasa_power(lat: float, lon: float, start: str, end: str, parameters: s
             logger.error(f"Errores NASA POWER: {data['errors']}")
             raise RuntimeError(f"Errores desde NASA POWER: {data['errors']}")
 
-        logger.info("Datos de NASA POWER obtenidos correctamente.")
         return data
 
-    except requests.exceptions.HTTPError as http_err:
+    except httpx.HTTPStatusError as http_err:
         logger.error(f"HTTPError NASA POWER: {http_err}")
         raise RuntimeError(f"Error HTTP al consultar NASA POWER: {http_err}")
-    except requests.exceptions.RequestException as req_err:
+    except httpx.RequestError as req_err:
         logger.error(f"Error de conexión con NASA POWER: {req_err}")
         raise RuntimeError(f"Error de conexión con NASA POWER: {req_err}")
+    except RuntimeError:
+        raise
     except Exception as e:
         logger.error(f"Error desconocido NASA POWER: {e}")
         raise RuntimeError(f"Error desconocido al consultar NASA POWER: {e}")
+
+
+def _series(data: dict) -> TimeSeries:
+    fill_value = data.get("header", {}).get("fill_value", -999.0)
+    return TimeSeries.from_nasa_power(data["properties"].get("parameter", {}), fill_value)
+
+
+def _point_params(lat: float, lon: float, start: str, end: str, parameters: str, community: str) -> dict:
+    return {
+        "start": start.replace("-", ""),
+        "end": end.replace("-", ""),
+        "latitude": lat,
+        "longitude": lon,
+        "parameters": parameters,
+        "community": community,
+    }
+
+
+@cached_provider("nasa_power", ttl=config.CACHE_TTL_NASA_POWER)
+async def fetch_nasa_power(lat: float, lon: float, start: str, end: str, parameters: str = "T2M,PRECTOT,ALLSKY_SFC_SW_DWN", community: str = "AG"):
+    """
+    Consulta la API de NASA POWER y devuelve series temporales (TimeSeries, un valor por día).
+    """
+    data = await _request(DAILY, _point_params(lat, lon, start, end, parameters, community))
+    series = _series(data)
+    logger.info("Datos de NASA POWER obtenidos correctamente.")
+    return series
+
+
+@cached_provider("nasa_power_hourly", ttl=config.CACHE_TTL_NASA_POWER)
+async def fetch_nasa_power_hourly(lat: float, lon: float, start: str, end: str, parameters: str = HOURLY_PARAMETERS, community: str = "AG"):
+    """
+    Endpoint horario de NASA POWER (TimeSeries, un valor por hora).
+    Las horas son de tiempo solar local (time-standard=LST), como la hora que pide el usuario.
+    """
+    params = {**_point_params(lat, lon, start, end, parameters, community), "time-standard": "LST"}
+    data = await _request(HOURLY, params)
+    series = _series(data)
+    logger.info("Datos horarios de NASA POWER obtenidos correctamente.")
+    return series
+
+
+@cached_provider("nasa_power_climatology", ttl=config.CACHE_TTL_NASA_POWER)
+async def fetch_nasa_power_climatology(lat: float, lon: float, start: str, end: str, parameters: str = "T2M,PRECTOTCORR", community: str = "AG"):
+    """
+    Endpoint climatology de NASA POWER: promedios mensuales de los años start..end (YYYY).
+    Retorna: {VARIABLE: {"JAN": v, ..., "DEC": v, "ANN": v}} con None donde NASA no tiene dato.
+    """
+    data = await _request("climatology", _point_params(lat, lon, start, end, parameters, community))
+    fill_value = data.get("header", {}).get("fill_value", -999.0)
+    return {
+        name: {month: (None if value == fill_value else value) for month, value in months.items()}
+        for name, months in data["properties"].get("parameter", {}).items()
+    }
+
+
+# ---------- RANGOS LARGOS EN TRAMOS ----------
+
+FETCHERS = {DAILY: fetch_nasa_power, HOURLY: fetch_nasa_power_hourly}
+PROVIDER_NAMES = {DAILY: "nasa_power", HOURLY: "nasa_power_hourly"}
+CHUNK_DAYS = {DAILY: config.NASA_POWER_DAILY_CHUNK_DAYS, HOURLY: config.NASA_POWER_HOURLY_CHUNK_DAYS}
+
+# Máximo de series (nodo + resolución + parámetros) cuyos tramos se recuerdan
+MAX_TRACKED_SERIES = 4096
+
+
+class SegmentIndex:
+    """
+    Tramos ya descargados de cada serie (nodo, resolución, parámetros). Los datos viven en el
+    cache de respuestas (una entrada por tramo); aquí solo se recuerda qué fechas cubre cada uno.
+    """
+
+    def __init__(self, max_series: int = MAX_TRACKED_SERIES):
+        self.max_series = max_series
+        self._segments: OrderedDict = OrderedDict()
+
+    def get(self, series_key: tuple) -> list:
+        segments = self._segments.get(series_key, [])
+        if segments:
+            self._segments.move_to_end(series_key)
+        return list(segments)
+
+    def add(self, series_key: tuple, start: date, end: date):
+        segments = self._segments.setdefault(series_key, [])
+        if (start, end) not in segments:
+            segments.append((start, end))
+        self._segments.move_to_end(series_key)
+        while len(self._segments) > self.max_series:
+            self._segments.popitem(last=False)
+
+    def discard(self, series_key: tuple, start: date, end: date):
+        segments = self._segments.get(series_key)
+        if segments and (start, end) in segments:
+            segments.remove((start, end))
+
+
+segment_index = SegmentIndex()
+
+
+def _gaps(start: date, end: date, covered: list) -> list:
+    """Partes de [start, end] que no cubre ningún tramo (todas las fechas inclusivas)."""
+    gaps = []
+    cursor = start
+    for seg_start, seg_end in sorted(covered):
+        if seg_end < cursor:
+            continue
+        if seg_start > end:
+            break
+        if seg_start > cursor:
+            gaps.append((cursor, seg_start - timedelta(days=1)))
+        cursor = max(cursor, seg_end + timedelta(days=1))
+        if cursor > end:
+            break
+    if cursor <= end:
+        gaps.append((cursor, end))
+    return gaps
+
+
+def _chunks(gaps: list, chunk_days: int) -> list:
+    """Parte cada hueco en tramos de como máximo chunk_days días (límite de una llamada)."""
+    chunks = []
+    for gap_start, gap_end in gaps:
+        cursor = gap_start
+        while cursor <= gap_end:
+            chunk_end = min(gap_end, cursor + timedelta(days=chunk_days - 1))
+            chunks.append((cursor, chunk_end))
+            cursor = chunk_end + timedelta(days=1)
+    return chunks
+
+
+def _merge(parts: list) -> TimeSeries:
+    """Une las series de varios tramos en una sola, ordenada y sin horas repetidas."""
+    parts = [part for part in parts if len(part)]
+    if not parts:
+        return TimeSeries.empty()
+    if len(parts) == 1:
+        return parts[0]
+    names = list(dict.fromkeys(name for part in parts for name in part.variables))
+    times = np.concatenate([part.times for part in parts])
+    values = {
+        name: np.concatenate([part.values[name] if name in part.values else np.full(len(part), np.nan, np.float32) for part in parts])
+        for name in names
+    }
+    order = np.argsort(times, kind="stable")
+    times = times[order]
+    keep = np.concatenate(([True], times[1:] != times[:-1]))
+    return TimeSeries(times[keep], {name: column[order][keep] for name, column in values.items()})
+
+
+async def fetch_nasa_power_range(lat: float, lon: float, start: str, end: str, resolution: str = DAILY,
+                                 parameters: str = None, community: str = "AG") -> TimeSeries:
+    """
+    Serie de NASA POWER para un rango de fechas de cualquier longitud (daily u hourly).
+    Solo se piden los huecos que no cubren tramos anteriores (del cache); los huecos se parten
+    en tramos dentro del límite de la API que se piden en paralelo y se guardan cada uno por
+    separado, así que una consulta que se solapa con otra anterior solo descarga lo que falta.
+    """
+    fetch = FETCHERS[resolution]
+    provider = PROVIDER_NAMES[resolution]
+    parameters = parameters or (HOURLY_PARAMETERS if resolution == HOURLY else "T2M,PRECTOT,ALLSKY_SFC_SW_DWN")
+    node_lat, node_lon = snap_coordinates(provider, lat, lon)
+    series_key = (resolution, node_lat, node_lon, parameters, community)
+    first, last = date.fromisoformat(start), date.fromisoformat(end)
+
+    # 1. Tramos ya descargados que se solapan con el rango (si siguen en el cache)
+    parts, covered = [], []
+    for seg_start, seg_end in segment_index.get(series_key):
+        if seg_end < first or seg_start > last:
+            continue
+        key = make_key(provider, node_lat, node_lon, seg_start.isoformat(), seg_end.isoformat(),
+                       parameters=parameters, community=community)
+        cached = await weather_cache.get(key)
+        if cached is MISSING:
+            segment_index.discard(series_key, seg_start, seg_end)
+            continue
+        parts.append(cached)
+        covered.append((seg_start, seg_end))
+
+    # 2. Huecos en tramos, pedidos en paralelo (hasta NASA_POWER_RANGE_CONCURRENCY a la vez)
+    chunks = _chunks(_gaps(first, last, covered), CHUNK_DAYS[resolution])
+    if chunks:
+        logger.info(f"NASA POWER {resolution} {start}--{end}: {len(covered)} tramos en cache, {len(chunks)} por descargar")
+
+    semaphore = asyncio.Semaphore(config.NASA_POWER_RANGE_CONCURRENCY)
+
+    async def fetch_chunk(chunk_start: date, chunk_end: date):
+        async with semaphore:
+            series = await fetch(node_lat, node_lon, chunk_start.isoformat(), chunk_end.isoformat(),
+                                 parameters=parameters, community=community)
+        segment_index.add(series_key, chunk_start, chunk_end)
+        return series
+
+    tasks = [asyncio.ensure_future(fetch_chunk(a, b)) for a, b in chunks]
+    try:
+        # Cada tramo se incorpora en cuanto llega
+        for finished in asyncio.as_completed(tasks):
+            parts.append(await finished)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    return _merge(parts).slice_dates(start, end)
+
+
+# ---------- REGIONES (mapa de riesgo) ----------
+
+# Límites del endpoint regional: cada lado del rectángulo entre 2 y 10 grados, un parámetro por llamada
+REGIONAL_MIN_DEG = 2.0
+REGIONAL_MAX_DEG = 10.0
+REGIONAL_PARAMETERS = "T2M,PRECTOT,WS10M"
+
+
+def _regional_boxes(south: float, west: float, north: float, east: float) -> list:
+    """Parte el rectángulo en cajas dentro de los límites del endpoint regional (las pequeñas se amplían)."""
+    def spans(low, high, floor, ceiling):
+        edges = []
+        cursor = low
+        while True:
+            top = min(high, cursor + REGIONAL_MAX_DEG)
+            if top - cursor < REGIONAL_MIN_DEG:
+                middle = (cursor + top) / 2
+                cursor = max(floor, middle - REGIONAL_MIN_DEG / 2)
+                top = min(ceiling, cursor + REGIONAL_MIN_DEG)
+                cursor = top - REGIONAL_MIN_DEG
+            edges.append((cursor, top))
+            if top >= high:
+                return edges
+            cursor = top
+
+    return [
+        (lat_low, lon_low, lat_high, lon_high)
+        for lat_low, lat_high in spans(south, north, -90.0, 90.0)
+        for lon_low, lon_high in spans(west, east, -180.0, 180.0)
+    ]
+
+
+@cached_area("nasa_power_regional", ttl=config.CACHE_TTL_NASA_POWER)
+async def _fetch_regional_box(south: float, west: float, north: float, east: float, start: str, end: str,
+                              parameter: str, community: str = "AG") -> dict:
+    """Una caja del endpoint regional, un parámetro. Retorna: {(lat, lon): {"YYYYMMDD": v}}."""
+    params = {
+        "latitude-min": south,
+        "latitude-max": north,
+        "longitude-min": west,
+        "longitude-max": east,
+        "start": start.replace("-", ""),
+        "end": end.replace("-", ""),
+        "parameters": parameter,
+        "community": community,
+    }
+    data = await _request(DAILY, params, spatial="regional")
+    fill_value = data.get("header", {}).get("fill_value", -999.0)
+    by_point = {}
+    for feature in data["features"]:
+        lon, lat = feature["geometry"]["coordinates"][:2]
+        series = feature.get("properties", {}).get("parameter", {}).get(parameter, {})
+        by_point[(float(lat), float(lon))] = {day: (np.nan if value == fill_value else value) for day, value in series.items()}
+    return by_point
+
+
+async def fetch_nasa_power_regional(south: float, west: float, north: float, east: float, start: str, end: str,
+                                    parameters: str = REGIONAL_PARAMETERS, community: str = "AG") -> AreaSeries:
+    """
+    Datos diarios de NASA POWER de todos los nodos (0.5° × 0.625°) de un rectángulo con el
+    endpoint regional: unas pocas llamadas por caja y parámetro en vez de una por punto.
+    """
+    names = parameters.split(",")
+    boxes = _regional_boxes(south, west, north, east)
+    semaphore = asyncio.Semaphore(config.NASA_POWER_RANGE_CONCURRENCY)
+
+    async def fetch_box(box, name):
+        async with semaphore:
+            return name, await _fetch_regional_box(*box, start, end, name, community)
+
+    logger.info(f"NASA POWER regional: {len(boxes)} cajas × {len(names)} parámetros")
+    results = await asyncio.gather(*(fetch_box(box, name) for box in boxes for name in names))
+
+    first, last = date.fromisoformat(start), date.fromisoformat(end)
+    days = [(first + timedelta(days=i)).strftime("%Y%m%d") for i in range((last - first).days + 1)]
+    by_point: dict = {}
+    for name, box_points in results:
+        v = names.index(name)
+        for point, series in box_points.items():
+            # Nodos del rectángulo pedido más un nodo de margen (el más cercano a cada borde)
+            if not (south - 0.5 <= point[0] <= north + 0.5 and west - 0.625 <= point[1] <= east + 0.625):
+                continue
+            row = by_point.setdefault(point, np.full((len(days), len(names)), np.nan, dtype=np.float32))
+            row[:, v] = [series.get(day, np.nan) for day in days]
+
+    points = sorted(by_point)
+    times = np.array([f"{d[:4]}-{d[4:6]}-{d[6:8]}" for d in days], dtype="datetime64[s]")
+    values = np.stack([by_point[p] for p in points]) if points else np.empty((0, len(days), len(names)), dtype=np.float32)
+    return AreaSeries(np.array(points).reshape(-1, 2), times, names, values)
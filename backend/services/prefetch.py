@@ -0,0 +1,241 @@
+import asyncio
+import heapq
+import logging
+import time
+from datetime import date, datetime, timedelta
+
+import config
+from api.io import fetch_offline_timeseries
+from api.meteomatics import fetch_meteomatics_node
+from services.cache import MISSING, weather_cache
+from services.climatology import build_cell, climatology_store
+from services.metrics import registry
+from services.nasa_power import fetch_nasa_power
+from services.tiling import locate
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Entradas máximas de cada contador de popularidad
+MAX_TRACKED = 10000
+# Puntajes sumados de todos los workers en el nivel compartido
+SHARED_SCORES_KEY = "prefetch|scores"
+
+
+class TokenBucket:
+    """Presupuesto de llamadas por hora; permite ráfagas de hasta 5 minutos de presupuesto."""
+
+    def __init__(self, per_hour: float):
+        self.rate = per_hour / 3600
+        self.capacity = max(1.0, per_hour / 12)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def try_acquire(self, count: int = 1) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < count:
+            return False
+        self.tokens -= count
+        return True
+
+
+def _in_hours(hours: str, hour: int) -> bool:
+    """'0-6' incluye de 00:00 a 06:59; '22-4' cruza la medianoche."""
+    start, _, end = hours.partition("-")
+    start, end = int(start), int(end or start)
+    return start <= hour <= end if start <= end else hour >= start or hour <= end
+
+
+def _decay_scores(scores: dict, factor: float):
+    """Aplica el decaimiento, olvida lo que dejó de ser popular y acota el tamaño."""
+    for key in list(scores):
+        scores[key] *= factor
+        if scores[key] < 0.05:
+            del scores[key]
+    if len(scores) > MAX_TRACKED:
+        for key in heapq.nsmallest(len(scores) - MAX_TRACKED, scores, key=scores.get):
+            del scores[key]
+
+
+def _add_scores(scores: dict, extra: dict):
+    for key, score in extra.items():
+        scores[key] = scores.get(key, 0.0) + score
+
+
+class Prefetcher:
+    """
+    Lleva la popularidad (con decaimiento exponencial) de cada nodo de la malla y fecha consultada y,
+    en segundo plano:
+      - refresca los pronósticos de Meteomatics de las K celdas más populares antes de que caduquen;
+      - en horas de poca demanda, precarga las fechas históricas populares de NASA POWER y
+        construye la climatología de las celdas populares.
+    Nunca gasta más llamadas por proveedor que su presupuesto por hora.
+    Con varios workers y nivel compartido cada proceso suma lo que registra a los puntajes
+    compartidos (share) y el que precarga elige con el total, no solo con su parte del tráfico.
+    """
+
+    def __init__(self, top_k: int = 20, forecast_days: int = 2, refresh_margin: float = 120,
+                 half_life: float = 3600, budgets: dict = None, offpeak_hours: str = "0-6"):
+        self.top_k = top_k
+        self.forecast_days = forecast_days
+        self.refresh_margin = refresh_margin
+        self.half_life = half_life
+        self.budgets = {name: TokenBucket(per_hour) for name, per_hour in (budgets or {}).items()}
+        self.offpeak_hours = offpeak_hours
+        self.cells: dict = {}  # (proveedor, lat, lon) -> puntaje
+        self.days: dict = {}   # (proveedor, lat, lon, fecha) -> puntaje
+        # Registrado en este proceso y aún no sumado a los puntajes compartidos
+        self._unshared_cells: dict = {}
+        self._unshared_days: dict = {}
+        self._decayed_at = time.monotonic()
+        self.counters = {"recorded": 0, "refreshed": 0, "backfilled": 0, "climatology_built": 0,
+                         "skipped_budget": 0, "errors": 0}
+
+    # ---------- POPULARIDAD ----------
+
+    def record(self, provider: str, lat: float, lon: float, day: date):
+        """Anota una consulta (se llama desde los endpoints; no bloquea)."""
+        # La popularidad se reparte entre los nodos de la malla que usa el punto
+        _, nodes, weights = locate(provider, lat, lon)
+        targets = [(self.cells, self.days)]
+        if weather_cache.shared:
+            targets.append((self._unshared_cells, self._unshared_days))
+        for node, weight in zip(nodes, weights):
+            cell = (provider, *node)
+            for cells, days in targets:
+                cells[cell] = cells.get(cell, 0.0) + weight
+                days[(*cell, day)] = days.get((*cell, day), 0.0) + weight
+        self.counters["recorded"] += 1
+
+    def _decay(self):
+        now = time.monotonic()
+        factor = 0.5 ** ((now - self._decayed_at) / self.half_life)
+        self._decayed_at = now
+        for scores in (self.cells, self.days):
+            _decay_scores(scores, factor)
+
+    async def share(self):
+        """
+        Suma lo registrado en este proceso a los puntajes compartidos (con su decaimiento, por
+        reloj de pared) y se queda con el total. Cada worker lo hace en cada ciclo.
+        """
+        cells, days = self._unshared_cells, self._unshared_days
+        self._unshared_cells, self._unshared_days = {}, {}
+
+        def merge(stored):
+            now = time.time()
+            shared_cells, shared_days, decayed_at = ({}, {}, now) if stored is MISSING else stored
+            factor = 0.5 ** ((now - decayed_at) / self.half_life)
+            for shared, local in ((shared_cells, cells), (shared_days, days)):
+                _decay_scores(shared, factor)
+                _add_scores(shared, local)
+            return shared_cells, shared_days, now
+
+        try:
+            self.cells, self.days, _ = await weather_cache.update(SHARED_SCORES_KEY, merge, self.half_life * 10)
+        except Exception as e:
+            # Se vuelve a intentar en el próximo ciclo junto con lo que se registre hasta entonces
+            _add_scores(self._unshared_cells, cells)
+            _add_scores(self._unshared_days, days)
+            logger.warning(f"No se pudieron compartir los puntajes de precarga: {e}")
+
+    def top_cells(self, provider: str) -> list:
+        cells = [(score, key) for key, score in self.cells.items() if key[0] == provider]
+        return [(lat, lon) for _, (_, lat, lon) in heapq.nlargest(self.top_k, cells)]
+
+    def top_days(self, provider: str) -> list:
+        days = [(score, key) for key, score in self.days.items() if key[0] == provider]
+        return [(lat, lon, day) for _, (_, lat, lon, day) in heapq.nlargest(self.top_k, days)]
+
+    # ---------- TAREAS ----------
+
+    def _spend(self, provider: str, count: int = 1) -> bool:
+        bucket = self.budgets.get(provider)
+        if bucket is None or bucket.try_acquire(count):
+            return True
+        self.counters["skipped_budget"] += 1
+        return False
+
+    async def _run(self, name: str, coro):
+        try:
+            await coro
+            self.counters[name] += 1
+        except Exception as e:
+            self.counters["errors"] += 1
+            logger.warning(f"Precarga fallida ({name}): {e}")
+
+    async def refresh_forecasts(self):
+        """Pronósticos de los próximos días de las celdas populares que están por caducar."""
+        today = datetime.now().date()
+        jobs = []
+        for lat, lon in self.top_cells("meteomatics"):
+            for offset in range(self.forecast_days):
+                day = (today + timedelta(days=offset)).isoformat()
+                key = fetch_meteomatics_node.cache_key(lat, lon, day, day)
+                if await weather_cache.remaining(key) > self.refresh_margin:
+                    continue
+                if not self._spend("meteomatics"):
+                    break
+                jobs.append(self._run("refreshed", fetch_meteomatics_node.refresh(lat, lon, day, day)))
+        # Concurrentes: el planner las une en llamadas multipunto
+        await asyncio.gather(*jobs)
+
+    async def backfill_history(self):
+        """Fechas históricas populares que no están en cache y climatología de las celdas populares."""
+        for lat, lon, day in self.top_days("nasa_power"):
+            day = day.isoformat()
+            key = fetch_nasa_power.cache_key(lat, lon, day, day)
+            if await weather_cache.remaining(key) > 0 or await fetch_offline_timeseries(lat, lon, day, day) is not None:
+                continue
+            if not self._spend("nasa_power"):
+                return
+            await self._run("backfilled", fetch_nasa_power(lat, lon, day, day))
+        for lat, lon in self.top_cells("nasa_power"):
+            if climatology_store.has_cell(lat, lon):
+                continue
+            # Una celda son varias llamadas de NASA_POWER_DAILY_CHUNK_DAYS días (ver build_cell)
+            days = (date(config.CLIMATOLOGY_END_YEAR, 12, 31) - date(config.CLIMATOLOGY_START_YEAR, 1, 1)).days + 1
+            chunks = -(-days // config.NASA_POWER_DAILY_CHUNK_DAYS)
+            if not self._spend("nasa_power", chunks):
+                return
+            await self._run("climatology_built", build_cell(lat, lon))
+
+    async def run_once(self):
+        if not weather_cache.shared:
+            # Compartidos: el decaimiento se aplica al sumar (share)
+            self._decay()
+        await self.refresh_forecasts()
+        if _in_hours(self.offpeak_hours, datetime.now().hour):
+            await self.backfill_history()
+
+    async def run(self, interval: float):
+        while True:
+            try:
+                if weather_cache.shared:
+                    await self.share()
+                # Con varios workers precarga solo uno (el cache es compartido; los demás gastarían de más)
+                if await weather_cache.lead("prefetch", interval * 3):
+                    await self.run_once()
+            except Exception as e:
+                logger.error(f"Error en el ciclo de precarga: {e}")
+            await asyncio.sleep(interval)
+
+    def start(self, interval: float = None) -> asyncio.Task:
+        """Tarea de fondo (se inicia en el lifespan de la app)."""
+        return asyncio.create_task(self.run(interval or config.PREFETCH_INTERVAL))
+
+    def stats(self) -> dict:
+        return {**self.counters, "tracked_cells": len(self.cells), "tracked_days": len(self.days)}
+
+
+prefetcher = Prefetcher(
+    top_k=config.PREFETCH_TOP_K,
+    forecast_days=config.PREFETCH_FORECAST_DAYS,
+    refresh_margin=config.PREFETCH_REFRESH_MARGIN,
+    half_life=config.PREFETCH_HALF_LIFE,
+    budgets={"meteomatics": config.PREFETCH_BUDGET_METEOMATICS, "nasa_power": config.PREFETCH_BUDGET_NASA_POWER},
+    offpeak_hours=config.PREFETCH_OFFPEAK_HOURS,
+)
+registry.register_stats("checknow_prefetch", "Consultas registradas y precargas realizadas", prefetcher.stats)
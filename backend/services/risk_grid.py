@@ -0,0 +1,108 @@
+import io
+import logging
+import struct
+import zlib
+
+import numpy as np
+
+from models.risk_model import RISK_LABELS, compute_risk_batch
+from models.timeseries import AreaSeries
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Rampa del PNG: (riesgo %, R, G, B, A); 0 % es transparente para superponerlo al globo
+PNG_RAMP = (
+    (0, 255, 255, 178, 0),
+    (25, 254, 204, 92, 140),
+    (50, 253, 141, 60, 180),
+    (75, 240, 59, 32, 210),
+    (100, 189, 0, 38, 235),
+)
+
+
+# ---------- MALLA DE SALIDA ----------
+
+def output_axes(south: float, west: float, north: float, east: float, resolution: float) -> tuple:
+    """
+    Nodos de la malla de salida: latitudes de norte a sur y longitudes de oeste a este cada
+    resolution grados (la misma malla que devuelve Meteomatics para el área).
+    """
+    rows = int(np.floor((north - south) / resolution + 1e-9)) + 1
+    cols = int(np.floor((east - west) / resolution + 1e-9)) + 1
+    lats = np.round(north - resolution * np.arange(rows), 6)
+    lons = np.round(west + resolution * np.arange(cols), 6)
+    return lats, lons
+
+
+def _nearest(axis: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """Índice del elemento de axis (ordenado) más cercano a cada valor."""
+    if len(axis) == 1:
+        return np.zeros(len(values), dtype=np.intp)
+    right = np.clip(np.searchsorted(axis, values), 1, len(axis) - 1)
+    left = right - 1
+    return np.where(np.abs(values - axis[left]) <= np.abs(axis[right] - values), left, right)
+
+
+def risk_surface(area: AreaSeries, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """
+    Riesgos (%) de todo el área con el modelo vectorizado, llevados a la malla de salida
+    (nodo más cercano del proveedor). Retorna: (4 × filas × columnas) float32 en el orden
+    de RISK_LABELS, NaN donde el proveedor no tiene datos.
+    """
+    surface = np.full((len(RISK_LABELS), len(lats), len(lons)), np.nan, dtype=np.float32)
+    if len(area) == 0:
+        return surface
+
+    risks = compute_risk_batch(area.values, tuple(area.variables)).astype(np.float32)  # N × 4
+    risks[np.all(np.isnan(area.values), axis=(1, 2))] = np.nan
+
+    # Los nodos del proveedor forman una malla regular: tabla (lat, lon) -> fila de risks
+    node_lats, lat_index = np.unique(area.points[:, 0], return_inverse=True)
+    node_lons, lon_index = np.unique(area.points[:, 1], return_inverse=True)
+    table = np.full((len(node_lats), len(node_lons)), -1, dtype=np.intp)
+    table[lat_index, lon_index] = np.arange(len(area))
+
+    nodes = table[np.ix_(_nearest(node_lats, lats), _nearest(node_lons, lons))]  # filas × columnas
+    valid = nodes >= 0
+    surface[:, valid] = risks[nodes[valid]].T
+    return surface
+
+
+# ---------- FORMATOS ----------
+
+def to_npy(surface: np.ndarray) -> bytes:
+    """Arreglo .npy (4 × filas × columnas, float32): np.load / numpy.js en el frontend."""
+    buffer = io.BytesIO()
+    np.save(buffer, surface, allow_pickle=False)
+    return buffer.getvalue()
+
+
+def to_png(layer: np.ndarray) -> bytes:
+    """Una capa de riesgo (filas × columnas, %) como PNG RGBA coloreado; NaN es transparente."""
+    percent = np.nan_to_num(layer, nan=0.0)
+    stops = [stop[0] for stop in PNG_RAMP]
+    rgba = np.stack([np.interp(percent, stops, [stop[c] for stop in PNG_RAMP]) for c in range(1, 5)], axis=-1)
+    rgba[np.isnan(layer)] = 0
+    return encode_png(np.round(rgba).astype(np.uint8))
+
+
+def encode_png(rgba: np.ndarray) -> bytes:
+    """PNG RGBA de 8 bits sin dependencias (zlib), sin filtro por fila."""
+    height, width, _ = rgba.shape
+    raw = np.concatenate([np.zeros((height, 1), dtype=np.uint8), rgba.reshape(height, width * 4)], axis=1)
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw.tobytes(), 6)) + chunk(b"IEND", b"")
+
+
+def to_json(surface: np.ndarray) -> dict:
+    """{capa: [[riesgo % o None]]} por filas (norte a sur)."""
+    rounded = np.round(surface.astype(np.float64), 2)
+    return {
+        label: [[None if np.isnan(v) else v for v in row] for row in layer.tolist()]
+        for label, layer in zip(RISK_LABELS, rounded)
+    }
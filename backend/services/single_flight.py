@@ -0,0 +1,46 @@
+import asyncio
+import logging
+
+from services.metrics import registry
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class SingleFlight:
+    """
+    Agrupa llamadas concurrentes con la misma clave en una sola ejecución.
+    El primer llamador (líder) lanza la tarea; los demás esperan el mismo resultado
+    o la misma excepción.
+    """
+
+    def __init__(self):
+        self._inflight: dict = {}
+        self.counters = {"leaders": 0, "deduplicated": 0, "errors": 0}
+
+    async def do(self, key: str, fn):
+        """Ejecuta fn() (corrutina) una sola vez por clave mientras esté en curso."""
+        task = self._inflight.get(key)
+        if task is None:
+            self.counters["leaders"] += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+        else:
+            self.counters["deduplicated"] += 1
+            logger.info(f"Petición deduplicada: {key}")
+        # shield: si un llamador se cancela (cliente desconectado) la tarea compartida sigue viva
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: asyncio.Future):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled() and task.exception() is not None:
+            self.counters["errors"] += 1
+
+    def stats(self) -> dict:
+        return {**self.counters, "in_flight": len(self._inflight)}
+
+
+provider_flights = SingleFlight()
+registry.register_stats("checknow_single_flight", "Llamadas a proveedores deduplicadas", provider_flights.stats)
@@ -0,0 +1,87 @@
+import math
+
+import numpy as np
+
+import config
+from models.timeseries import TimeSeries
+
+NEAREST = "nearest"
+BILINEAR = "bilinear"
+
+# Separación de los nodos de la malla de cada proveedor en grados (lat, lon).
+# NASA POWER entrega celdas MERRA-2 de 0.5° x 0.625°; Meteomatics interpola a cualquier
+# punto, así que se piden nodos cada METEOMATICS_GRID_DEG y se interpola entre ellos.
+PROVIDER_GRID = {
+    "meteomatics": (config.METEOMATICS_GRID_DEG, config.METEOMATICS_GRID_DEG),
+    "nasa_power": (0.5, 0.625),
+    "nasa_power_hourly": (0.5, 0.625),
+    "nasa_power_climatology": (0.5, 0.625),
+}
+
+INTERPOLATION = {
+    "meteomatics": config.METEOMATICS_INTERPOLATION,
+    "nasa_power": NEAREST,
+    "nasa_power_hourly": NEAREST,
+    "nasa_power_climatology": NEAREST,
+}
+
+
+def _node(provider: str, i: int, j: int):
+    dlat, dlon = PROVIDER_GRID.get(provider, (0.01, 0.01))
+    return round(i * dlat, 4), round(j * dlon, 4)
+
+
+def snap_coordinates(provider: str, lat: float, lon: float):
+    """Nodo de la malla del proveedor más cercano a lat/lon."""
+    dlat, dlon = PROVIDER_GRID.get(provider, (0.01, 0.01))
+    return _node(provider, round(lat / dlat), round(lon / dlon))
+
+
+def locate(provider: str, lat: float, lon: float):
+    """
+    Nodos de la malla necesarios para el punto y su peso en la interpolación.
+    Retorna: (tile, nodos, pesos). Todos los puntos de un mismo tile usan los mismos nodos
+    (salvo los de peso 0, que no se piden).
+    """
+    if INTERPOLATION.get(provider) != BILINEAR:
+        node = snap_coordinates(provider, lat, lon)
+        return node, [node], [1.0]
+
+    dlat, dlon = PROVIDER_GRID[provider]
+    # 0.3 / 0.05 = 5.999999999999999: un punto sobre un nodo (o una arista) se lleva a él
+    y, x = (round(v) if abs(v - round(v)) < 1e-9 else v for v in (lat / dlat, lon / dlon))
+    i, j = math.floor(y), math.floor(x)
+    fy, fx = y - i, x - j
+    corners = [
+        (_node(provider, i, j), (1 - fy) * (1 - fx)),
+        (_node(provider, i, j + 1), (1 - fy) * fx),
+        (_node(provider, i + 1, j), fy * (1 - fx)),
+        (_node(provider, i + 1, j + 1), fy * fx),
+    ]
+    # Un punto sobre un nodo o una arista no necesita los nodos de peso ~0
+    corners = [(node, weight) for node, weight in corners if weight > 1e-6]
+    total = sum(weight for _, weight in corners)
+    return _node(provider, i, j), [node for node, _ in corners], [weight / total for _, weight in corners]
+
+
+def blend(series_list: list, weights: list) -> TimeSeries:
+    """
+    Promedio ponderado de las series de varios nodos (mismo eje de tiempo).
+    Los NaN no cuentan: el peso se reparte entre los nodos que sí tienen dato.
+    """
+    if len(series_list) == 1:
+        return series_list[0]
+    base = max(series_list, key=len)
+    usable = [(s, w) for s, w in zip(series_list, weights) if np.array_equal(s.times, base.times)]
+    values = {}
+    for name in base.variables:
+        stacked = np.stack([
+            s.values[name] if name in s.values else np.full(len(base), np.nan, dtype=np.float32)
+            for s, _ in usable
+        ]).astype(np.float64)  # nodos × T
+        w = np.array([w for _, w in usable])[:, None] * ~np.isnan(stacked)
+        total = w.sum(axis=0)
+        blended = np.divide(np.nansum(stacked * w, axis=0), total, out=np.full(len(base), np.nan), where=total > 0)
+        values[name] = np.round(blended, 2)
+    return TimeSeries(base.times, values)
+
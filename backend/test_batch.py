@@ -0,0 +1,150 @@
+import asyncio
+import json
+
+import numpy as np
+
+import api.batch as batch
+import api.engine as engine_module
+from api.engine import engine
+from api.models import WeatherQueryData
+from models.timeseries import TimeSeries
+from services.deadline import Deadline
+
+
+def _series(day: str, value: float) -> TimeSeries:
+    return TimeSeries(np.array([f"{day}T00:00:00"], dtype="datetime64[s]"),
+                      {"T2M": [value], "PRECTOT": [value], "ALLSKY_SFC_SW_DWN": [value]})
+
+
+def _patch_nodes(monkeypatch, fetch):
+    """fetch(provider, lat, lon, start, end) por nodo en lugar de la lectura agrupada del proveedor."""
+    async def fetch_nodes(provider, nodes, start, end):
+        return list(await asyncio.gather(*(fetch(provider, lat, lon, start, end) for lat, lon in nodes)))
+
+    monkeypatch.setattr(batch, "fetch_nodes", fetch_nodes)
+
+
+def _run_batch(queries: list) -> list:
+    async def collect():
+        lines = await batch.stream_batch(engine, queries)
+        return [json.loads(line) async for line in lines]
+    return asyncio.run(collect())
+
+
+def test_fill_values_window_is_an_error_line(monkeypatch):
+    # NASA POWER devuelve solo valores de relleno (NaN) para el grupo y para la consulta suelta
+    async def fill_values(provider, lat, lon, start, end):
+        return _series(start, np.nan)
+
+    _patch_nodes(monkeypatch, fill_values)
+    monkeypatch.setattr(engine_module, "fetch_point", fill_values)
+    monkeypatch.setattr(engine_module, "degraded_response", lambda *args: None)
+
+    lines = _run_batch([WeatherQueryData(lat=10, lon=-84, dateTime="2020-02-10")])
+    assert lines == [{"index": 0, "status": "error", "status_code": 502,
+                      "detail": "NASA POWER devolvió una respuesta sin datos"}]
+
+
+def test_failed_group_is_retried_once_then_falls_back_to_climatology(monkeypatch):
+    # Proveedor caído: un reintento por grupo y la climatología para todas sus consultas
+    calls = []
+
+    async def provider_down(provider, lat, lon, start, end):
+        calls.append((lat, lon, start, end))
+        raise RuntimeError("circuito abierto")
+
+    async def no_single_query(*args):
+        raise AssertionError("un grupo caído no se consulta de nuevo por cada consulta")
+
+    _patch_nodes(monkeypatch, provider_down)
+    monkeypatch.setattr(engine_module, "fetch_point", no_single_query)
+    monkeypatch.setattr(engine_module, "degraded_response",
+                        lambda lat, lon, day, detail: {"status": "degraded", "detail": detail})
+
+    lines = _run_batch([WeatherQueryData(lat=10 + i / 10, lon=-84, dateTime=f"2020-02-1{i}") for i in range(3)])
+    assert [(line["index"], line["status"]) for line in lines] == [(0, "degraded"), (1, "degraded"), (2, "degraded")]
+    assert len(calls) == 2
+
+
+def test_lines_do_not_wait_for_slower_geocoding(monkeypatch):
+    calls = []
+
+    async def group_values(provider, lat, lon, start, end):
+        calls.append((lat, lon))
+        return _series(start, 21.5)
+
+    resolve_location = engine.resolve_location
+    release = {}
+
+    async def slow_names(lat, lon, country=None, city=None, locality=None, deadline=None):
+        if lat is None:
+            await release["event"].wait()
+            return 14.6, -90.5
+        return await resolve_location(lat, lon, country, city, locality, deadline)
+
+    _patch_nodes(monkeypatch, group_values)
+    monkeypatch.setattr(engine, "resolve_location", slow_names)
+    queries = [
+        WeatherQueryData(lat=10, lon=-84, dateTime="2020-02-10"),
+        WeatherQueryData(country="Guatemala", city="Antigua", dateTime="2020-02-10"),
+        WeatherQueryData(lat=10.01, lon=-84.01, dateTime="2020-02-10"),
+    ]
+
+    async def main():
+        release["event"] = asyncio.Event()
+        lines = await batch.stream_batch(engine, queries)
+        # La primera línea sale mientras el lugar con nombre sigue geocodificándose
+        first = json.loads(await lines.__anext__())
+        pending_calls = len(calls)
+        release["event"].set()
+        return first, pending_calls, [json.loads(line) async for line in lines]
+
+    first, pending_calls, rest = asyncio.run(main())
+    assert (first["index"], first["status"]) == (0, "success")
+    # Las dos consultas con coordenadas (misma celda) compartieron una llamada
+    assert pending_calls == 1
+    assert [(line["index"], line["status"]) for line in rest] == [(1, "success"), (2, "success")]
+    assert rest[0]["location"] == {"lat": 14.6, "lon": -90.5}
+    assert len(calls) == 2
+
+
+def test_geocoding_past_the_deadline_is_a_partial_line(monkeypatch):
+    async def group_values(provider, lat, lon, start, end):
+        return _series(start, 21.5)
+
+    resolve_location = engine.resolve_location
+
+    async def hanging_names(lat, lon, country=None, city=None, locality=None, deadline=None):
+        if lat is None:
+            await asyncio.Event().wait()
+        return await resolve_location(lat, lon, country, city, locality, deadline)
+
+    _patch_nodes(monkeypatch, group_values)
+    monkeypatch.setattr(engine, "resolve_location", hanging_names)
+
+    async def collect():
+        lines = await batch.stream_batch(engine, [
+            WeatherQueryData(country="Atlantis", dateTime="2020-02-10"),
+            WeatherQueryData(lat=10, lon=-84, dateTime="2020-02-10"),
+        ], deadline=Deadline(0.05))
+        return [json.loads(line) async for line in lines]
+
+    named, located = asyncio.run(collect())
+    assert named["index"] == 0 and named["status"] == "partial"
+    assert "location" in named["missing"]
+    assert located["status"] == "success"
+
+
+def test_valid_window_is_answered_from_the_group(monkeypatch):
+    async def group_values(provider, lat, lon, start, end):
+        return _series(start, 21.5)
+
+    async def no_single_query(*args):
+        raise AssertionError("la consulta no debería repetirse por separado")
+
+    _patch_nodes(monkeypatch, group_values)
+    monkeypatch.setattr(engine_module, "fetch_point", no_single_query)
+
+    [line] = _run_batch([WeatherQueryData(lat=10, lon=-84, dateTime="2020-02-10")])
+    assert line["status"] == "success"
+    assert line["temperature"] == "21.5°C"
@@ -0,0 +1,142 @@
+import asyncio
+
+import pytest
+
+import services.cache as cache
+from services.cache import MISSING, DiskCache, MemoryCache, WeatherCache, cached_provider
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "time", clock)
+    return clock
+
+
+# ---------- MEMORIA ----------
+
+def test_memory_evicts_the_least_recently_used(clock):
+    memory = MemoryCache(max_entries=2)
+    memory.set("a", 1, 60)
+    memory.set("b", 2, 60)
+    # Leer "a" la vuelve la más reciente: sale "b"
+    assert memory.get("a") == 1
+    memory.set("c", 3, 60)
+    assert memory.get("b") is MISSING
+    assert (memory.get("a"), memory.get("c"), len(memory)) == (1, 3, 2)
+
+
+def test_memory_entries_expire_but_stay_as_stale(clock):
+    memory = MemoryCache()
+    memory.set("a", 1, 60)
+    clock.now += 30
+    assert memory.remaining("a") == pytest.approx(30)
+    clock.now += 31
+    assert memory.get("a") is MISSING
+    assert memory.remaining("a") == 0
+    assert memory.get_stale("a") == 1
+    assert memory.get_stale("b") is MISSING
+
+
+# ---------- DISCO ----------
+
+def test_disk_values_survive_a_new_connection_until_they_expire(tmp_path, clock):
+    path = str(tmp_path / "cache.db")
+    DiskCache(path).set("a", {"serie": [1.5, 2.5]}, 60)
+
+    disk = DiskCache(path)
+    assert disk.get("a") == ({"serie": [1.5, 2.5]}, pytest.approx(60))
+    assert disk.remaining("a") == pytest.approx(60)
+    assert disk.get("b") == (MISSING, 0)
+
+    clock.now += 61
+    assert disk.get("a") == (MISSING, 0)
+    disk.purge_expired()
+    clock.now -= 61
+    assert disk.get("a") == (MISSING, 0)
+
+
+def test_disk_leases_belong_to_one_owner_until_they_expire(tmp_path, clock):
+    disk = DiskCache(str(tmp_path / "cache.db"))
+    assert disk.lease("k", "uno", 10)
+    assert not disk.lease("k", "dos", 10)
+    # El dueño renueva su turno
+    assert disk.lease("k", "uno", 10)
+    clock.now += 11
+    assert disk.lease("k", "dos", 10)
+    disk.release("k", "dos")
+    assert disk.lease("k", "uno", 10)
+
+
+def test_weather_cache_fills_memory_from_disk(tmp_path):
+    path = str(tmp_path / "cache.db")
+    asyncio.run(WeatherCache(disk_path=path).set("a", 1, 60))
+
+    restarted = WeatherCache(disk_path=path)
+    assert asyncio.run(restarted.get("a")) == 1
+    assert asyncio.run(restarted.get("a")) == 1
+    assert asyncio.run(restarted.get("b")) is MISSING
+    stats = restarted.stats()
+    assert (stats["disk_hits"], stats["memory_hits"], stats["misses"]) == (1, 1, 1)
+    assert stats["hit_ratio"] == pytest.approx(2 / 3, abs=1e-4)
+
+
+# ---------- DECORADOR ----------
+
+@pytest.fixture
+def weather_cache(monkeypatch):
+    weather_cache = WeatherCache()
+    monkeypatch.setattr(cache, "weather_cache", weather_cache)
+    return weather_cache
+
+
+def _provider(outcomes: list):
+    """fetch cacheado que responde (o lanza) lo siguiente de outcomes en cada llamada."""
+    calls = []
+
+    @cached_provider("nasa_power", ttl=60)
+    async def fetch(lat, lon, start, end):
+        calls.append((lat, lon))
+        outcome = outcomes[len(calls) - 1]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    fetch.calls = calls
+    return fetch
+
+
+def test_points_of_the_same_cell_share_the_entry(weather_cache):
+    fetch = _provider(["serie"])
+    assert asyncio.run(fetch(10.1, -84.1, "2020-02-10", "2020-02-10")) == "serie"
+    assert asyncio.run(fetch(10.2, -84.2, "2020-02-10", "2020-02-10")) == "serie"
+    assert fetch.calls == [(10.0, -84.375)]
+    assert fetch.cache_key(10.2, -84.2, "2020-02-10", "2020-02-10") == "nasa_power|10.0000,-84.3750|2020-02-10--2020-02-10|"
+
+
+def test_provider_down_serves_the_stale_value(weather_cache, clock):
+    fetch = _provider(["vieja", RuntimeError("circuito abierto"), RuntimeError("circuito abierto")])
+    assert asyncio.run(fetch(10, -84.375, "2020-02-10", "2020-02-10")) == "vieja"
+    clock.now += 61
+    assert asyncio.run(fetch(10, -84.375, "2020-02-10", "2020-02-10")) == "vieja"
+    assert weather_cache.counters["stale_served"] == 1
+
+    # Sin dato vencido el error llega al llamador
+    with pytest.raises(RuntimeError, match="circuito abierto"):
+        asyncio.run(fetch(12, -84.375, "2020-02-10", "2020-02-10"))
+
+
+def test_errors_other_than_provider_failures_are_not_hidden(weather_cache, clock):
+    fetch = _provider(["vieja", ValueError("respuesta inválida")])
+    asyncio.run(fetch(10, -84.375, "2020-02-10", "2020-02-10"))
+    clock.now += 61
+    with pytest.raises(ValueError):
+        asyncio.run(fetch(10, -84.375, "2020-02-10", "2020-02-10"))
@@ -0,0 +1,68 @@
+import asyncio
+import json
+import time
+
+import pytest
+from fastapi import HTTPException
+
+import api.batch as batch
+import api.engine as engine_module
+from api.engine import engine
+from api.models import WeatherQueryData
+from services.deadline import Deadline, DeadlineExceeded, deadline_counters
+
+
+async def _hang(*args, **kwargs):
+    await asyncio.Event().wait()
+
+
+def test_run_cancels_the_stage_and_counts_it():
+    before = deadline_counters.get("exceeded_area", 0)
+    with pytest.raises(DeadlineExceeded, match="area"):
+        asyncio.run(Deadline(0.05).run("area", _hang()))
+    assert deadline_counters["exceeded_area"] == before + 1
+
+
+def test_risk_grid_area_fetch_past_the_deadline_is_504(monkeypatch):
+    provider = engine.providers[engine.choose(engine.validate_date("2020-02-10"))]
+    monkeypatch.setattr(provider, "fetch_area", _hang)
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(engine.risk_grid(13.5, -92.5, 15, -90, 0.5, "2020-02-10", deadline=Deadline(0.05)))
+    assert error.value.status_code == 504
+    assert "area" in error.value.detail
+
+
+def test_risk_grid_risk_stage_shares_the_deadline(monkeypatch):
+    provider = engine.providers[engine.choose(engine.validate_date("2020-02-10"))]
+
+    async def area(*args):
+        await asyncio.sleep(0.03)
+        return object()
+
+    def slow_surface(area, lats, lons):
+        time.sleep(0.1)
+
+    monkeypatch.setattr(provider, "fetch_area", area)
+    monkeypatch.setattr(engine_module, "risk_surface", slow_surface)
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(engine.risk_grid(13.5, -92.5, 15, -90, 0.5, "2020-02-10", deadline=Deadline(0.06)))
+    assert error.value.status_code == 504
+    assert "risk" in error.value.detail
+
+
+def test_batch_groups_past_the_deadline_are_partial(monkeypatch):
+    monkeypatch.setattr(batch, "fetch_nodes", _hang)
+    monkeypatch.setattr(engine_module, "cached_point", lambda *args: None)
+    monkeypatch.setattr(engine_module, "degraded_response", lambda *args: None)
+
+    async def collect():
+        lines = await batch.stream_batch(engine, [
+            WeatherQueryData(lat=10, lon=-84, dateTime="2020-02-10"),
+            WeatherQueryData(lat=14.6, lon=-90.5, dateTime="2020-02-10"),
+        ], deadline=Deadline(0.05))
+        return [json.loads(line) async for line in lines]
+
+    lines = asyncio.run(collect())
+    assert [(line["index"], line["status"]) for line in lines] == [(0, "partial"), (1, "partial")]
+    assert lines[0]["location"] == {"lat": 10, "lon": -84}
+    assert lines[0]["missing"] == ["weather", "rain_prediction"]
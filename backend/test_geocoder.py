@@ -0,0 +1,173 @@
+import asyncio
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import config
+import services.geocoder as geocoder_module
+from services.geocoder import Geocoder, build_index, load_index, normalize_name
+from services.governor import ProviderGovernor
+
+# Columnas de GeoNames: id, nombre, nombre ascii, alternativos, lat, lon, clase, código, país, ..., población (14)
+PLACES = [
+    ("Guatemala", "Guatemala", "Republic of Guatemala", 15.5, -90.25, "A", "PCLI", "GT", 16000000),
+    ("Costa Rica", "Costa Rica", "", 10.0, -84.0, "A", "PCLI", "CR", 5000000),
+    ("Ciudad de Guatemala", "Ciudad de Guatemala", "Guatemala City", 14.64072, -90.51327, "P", "PPLC", "GT", 994938),
+    ("Antigua Guatemala", "Antigua Guatemala", "Antigua", 14.56111, -90.73444, "P", "PPLA", "GT", 39368),
+    ("Quetzaltenango", "Quetzaltenango", "Xela", 14.83472, -91.51806, "P", "PPLA", "GT", 180706),
+    ("San José", "San Jose", "", 9.93333, -84.08333, "P", "PPLC", "CR", 335007),
+    ("San José", "San Jose", "", 14.2, -90.8, "P", "PPL", "GT", 2000),
+    ("San José", "San Jose", "", 16.98, -89.9, "P", "PPL", "GT", 8000),
+    ("Flores", "Flores", "", 16.92942, -89.89163, "P", "PPLA", "GT", 13700),
+]
+
+
+def _write_dump(path) -> str:
+    lines = []
+    for i, (name, ascii_name, alternates, lat, lon, cls, code, country, population) in enumerate(PLACES):
+        cols = [str(i), name, ascii_name, alternates, str(lat), str(lon), cls, code, country,
+                "", "", "", "", "", str(population), "", "", "America/Guatemala", "2024-01-01"]
+        lines.append("\t".join(cols))
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    return str(path)
+
+
+@pytest.fixture
+def dump(tmp_path) -> str:
+    return _write_dump(tmp_path / "cities.txt")
+
+
+@pytest.fixture
+def local(dump) -> Geocoder:
+    geocoder = Geocoder(dump)
+    geocoder.load()
+    return geocoder
+
+
+# ---------- ÍNDICE ----------
+
+def test_build_index_has_one_row_per_name_sorted_by_key(dump):
+    index = build_index(dump)
+    # Nombre, nombre ascii y alternativos distintos: Guatemala 2, Costa Rica 1, Ciudad 2, ...
+    assert len(index) == 2 + 1 + 2 + 2 + 2 + 2 + 2 + 2 + 1
+    assert (index["key"][:-1] <= index["key"][1:]).all()
+    assert set(index["country"].tolist()) == {b"GT", b"CR"}
+
+
+def test_load_index_builds_once_and_rebuilds_when_the_dump_changes(dump, tmp_path):
+    index = load_index(dump)
+    index_path = f"{dump}.idx.npy"
+    assert os.path.exists(index_path)
+    assert len(index) == len(build_index(dump))
+    built_at = os.path.getmtime(index_path)
+
+    # Índice al día: se abre tal cual (memory-mapped)
+    assert len(load_index(dump)) == len(index)
+    assert os.path.getmtime(index_path) == built_at
+
+    # Volcado más nuevo: se reconstruye escribiendo aparte y renombrando
+    with open(dump, "a", encoding="utf-8") as f:
+        f.write("\t".join(["99", "Cobán", "Coban", "", "15.47", "-90.37", "P", "PPLA", "GT",
+                           "", "", "", "", "", "70000", "", "", "", ""]) + "\n")
+    os.utime(dump, (built_at + 10, built_at + 10))
+    assert len(load_index(dump)) == len(index) + 2
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["cities.txt", "cities.txt.idx.npy"]
+
+
+# ---------- BÚSQUEDA LOCAL ----------
+
+@pytest.mark.parametrize("name", ["Quetzaltenango", "QUETZALTENANGO", "Quetzaltenángo", "  quetzaltenango ", "Xela"])
+def test_lookup_folds_case_accents_and_alternate_names(local, name):
+    assert local.lookup_local("Guatemala", name, None) == (14.83472, -91.51806)
+
+
+def test_country_filters_places_with_the_same_name(local):
+    assert local.lookup_local("Costa Rica", "San Jose", None) == (9.93333, -84.08333)
+    # En Guatemala gana el San José más poblado
+    assert local.lookup_local("Guatemala", "San José", None) == (16.98, -89.9)
+    # Sin país gana el más poblado de todos
+    assert local.lookup_local(None, "San José", None) == (9.93333, -84.08333)
+
+
+def test_locality_is_looked_up_before_city(local):
+    assert local.lookup_local("Guatemala", "Ciudad de Guatemala", "Antigua") == (14.56111, -90.73444)
+    # Localidad desconocida: se prueba la ciudad
+    assert local.lookup_local("Guatemala", "Flores", "Aldea inexistente") == (16.92942, -89.89163)
+
+
+def test_country_only_and_unknown_names(local):
+    assert local.lookup_local("Republic of Guatemala", None, None) == (15.5, -90.25)
+    assert local.lookup_local("Atlantis", "Flores", None) is None
+    assert local.lookup_local("Costa Rica", "Flores", None) is None
+
+
+def test_normalize_name():
+    assert normalize_name("Ciudad de Guatemala") == normalize_name("ciudad DE guatemala")
+    assert normalize_name("Quetzaltenángo, Guatemala") == "quetzaltenango guatemala"
+
+
+# ---------- NOMINATIM Y MEMORIA ----------
+
+class CountingNominatim:
+    """Nominatim simulado: None para los nombres de unknown, coordenadas fijas para el resto."""
+
+    def __init__(self, unknown=(), latency: float = 0.05):
+        self.unknown = unknown
+        self.latency = latency
+        self.queries = []
+
+    def geocode(self, query, timeout=None):
+        self.queries.append(query)
+        time.sleep(self.latency)
+        if any(name in query for name in self.unknown):
+            return None
+        return SimpleNamespace(latitude=14.5, longitude=-90.7)
+
+
+@pytest.fixture
+def remote(monkeypatch):
+    monkeypatch.setattr(geocoder_module, "governors", {"nominatim": ProviderGovernor("nominatim", rate=1000)})
+    geocoder = Geocoder()
+    geocoder._nominatim = CountingNominatim(unknown=("Atlantis",))
+    return geocoder
+
+
+def test_concurrent_lookups_of_a_place_share_one_nominatim_call(remote):
+    async def main():
+        return await asyncio.gather(*(remote.geocode("Guatemala", "Antigua", None) for _ in range(5)))
+
+    assert asyncio.run(main()) == [(14.5, -90.7)] * 5
+    assert remote._nominatim.queries == ["Antigua, Guatemala"]
+    assert remote.stats()["nominatim_calls"] == 1
+    assert remote.stats()["deduplicated"] == 4
+
+
+def test_results_are_remembered(remote):
+    assert asyncio.run(remote.geocode("Guatemala", "Antigua", None)) == (14.5, -90.7)
+    # Mismo lugar escrito distinto: misma entrada de la memoria
+    assert asyncio.run(remote.geocode("guatemala", "ANTIGUA", None)) == (14.5, -90.7)
+    assert len(remote._nominatim.queries) == 1
+    assert remote.counters["memo_hits"] == 1
+    assert remote.memo.remaining(normalize_name("Antigua, Guatemala")) > config.GEOCODER_MEMO_TTL - 60
+
+
+def test_not_found_is_remembered_for_the_negative_ttl(remote, monkeypatch):
+    monkeypatch.setattr(config, "GEOCODER_NEGATIVE_TTL", 0.2)
+    assert asyncio.run(remote.geocode("Atlantis", None, None)) is None
+    assert asyncio.run(remote.geocode("Atlantis", None, None)) is None
+    assert remote._nominatim.queries == ["Atlantis"]
+    assert remote.counters["not_found"] == 1
+
+    time.sleep(0.25)
+    assert asyncio.run(remote.geocode("Atlantis", None, None)) is None
+    assert remote._nominatim.queries == ["Atlantis", "Atlantis"]
+
+
+def test_index_hits_skip_nominatim(dump, remote):
+    remote.dump_path = dump
+    remote.load()
+    assert asyncio.run(remote.geocode("Guatemala", None, "Antigua Guatemala")) == (14.56111, -90.73444)
+    assert remote._nominatim.queries == []
+    assert remote.counters["index_hits"] == 1
@@ -0,0 +1,250 @@
+import asyncio
+
+import httpx
+import pytest
+
+from services.governor import CLOSED, HALF_OPEN, OPEN, ProviderGovernor, ProviderUnavailable, QuotaLedger
+
+
+class FakeClock:
+    """Reloj simulado: sleep() avanza el tiempo sin esperar y registra cada espera."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    async def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def _governor(clock: FakeClock, **options) -> ProviderGovernor:
+    defaults = dict(rate=100, max_retries=0, failure_threshold=2, reset_timeout=30, clock=clock, sleep=clock.sleep)
+    return ProviderGovernor("test", ledger=QuotaLedger(), **{**defaults, **options})
+
+
+def _http_error(status: int, headers: dict = None) -> httpx.HTTPStatusError:
+    request = httpx.Request("GET", "https://provider.test/")
+    response = httpx.Response(status, request=request, headers=headers or {})
+    return httpx.HTTPStatusError(f"{status}", request=request, response=response)
+
+
+async def _ok():
+    return "ok"
+
+
+async def _server_error():
+    raise _http_error(503)
+
+
+def _call(governor: ProviderGovernor, fn=_ok):
+    return asyncio.run(governor.call(fn))
+
+
+def _open_circuit(governor: ProviderGovernor):
+    for _ in range(governor.failure_threshold):
+        with pytest.raises(httpx.HTTPStatusError):
+            _call(governor, _server_error)
+    assert governor.state == OPEN
+
+
+# ---------- TOKEN BUCKET ----------
+
+def test_token_bucket_allows_a_burst_then_waits_for_tokens():
+    clock = FakeClock()
+    governor = _governor(clock, rate=2)  # ráfaga de 4
+    for _ in range(4):
+        _call(governor)
+    assert clock.sleeps == []
+
+    _call(governor)
+    assert clock.sleeps == [pytest.approx(0.5)]  # 1 token / 2 por segundo
+
+    clock.now += 10  # el balde se llena hasta la ráfaga, no más
+    for _ in range(4):
+        _call(governor)
+    assert len(clock.sleeps) == 1
+
+
+def test_token_bucket_rejects_when_the_wait_is_too_long():
+    clock = FakeClock()
+    governor = _governor(clock, rate=0.1, max_rate_wait=5)  # ráfaga de 1, un token cada 10 s
+    _call(governor)
+    with pytest.raises(ProviderUnavailable, match="límite de tasa"):
+        _call(governor)
+    assert governor.counters["rejected_rate"] == 1
+    assert clock.sleeps == []
+
+
+# ---------- CUOTA ----------
+
+def test_quota_is_exhausted_after_daily_calls():
+    clock = FakeClock()
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        return "ok"
+
+    governor = _governor(clock, daily_quota=3)
+    for _ in range(3):
+        _call(governor, fn)
+    with pytest.raises(ProviderUnavailable, match="cuota diaria agotada"):
+        _call(governor, fn)
+    assert len(calls) == 3
+    assert governor.counters["rejected_quota"] == 1
+
+
+def test_retries_spend_quota():
+    clock = FakeClock()
+    governor = _governor(clock, daily_quota=2, max_retries=3, failure_threshold=10)
+    with pytest.raises(ProviderUnavailable, match="cuota diaria agotada"):
+        _call(governor, _server_error)
+    assert governor.counters["calls"] == 2
+
+
+# ---------- REINTENTOS ----------
+
+def test_retry_after_is_honoured():
+    clock = FakeClock()
+    attempts = []
+
+    async def rate_limited_once():
+        attempts.append(clock())
+        if len(attempts) == 1:
+            raise _http_error(429, {"Retry-After": "3"})
+        return "ok"
+
+    governor = _governor(clock, max_retries=2, backoff_max=10, failure_threshold=10)
+    assert _call(governor, rate_limited_once) == "ok"
+    assert clock.sleeps == [3.0]
+    assert attempts[1] - attempts[0] == 3.0
+    assert governor.counters["retries"] == 1
+
+
+def test_retry_after_is_capped_by_backoff_max():
+    clock = FakeClock()
+    governor = _governor(clock, max_retries=1, backoff_max=4, failure_threshold=10)
+
+    async def always_429():
+        raise _http_error(429, {"Retry-After": "120"})
+
+    with pytest.raises(httpx.HTTPStatusError):
+        _call(governor, always_429)
+    assert clock.sleeps == [4.0]
+
+
+def test_client_errors_are_not_retried():
+    clock = FakeClock()
+    governor = _governor(clock, max_retries=3)
+
+    async def not_found():
+        raise _http_error(404)
+
+    with pytest.raises(httpx.HTTPStatusError):
+        _call(governor, not_found)
+    assert governor.counters["calls"] == 1
+    assert governor.state == CLOSED and governor.failures == 0
+
+
+# ---------- CIRCUITO ----------
+
+def test_circuit_closed_open_half_open_closed():
+    clock = FakeClock()
+    governor = _governor(clock)
+    _open_circuit(governor)
+
+    # Abierto: falla de inmediato sin llamar al proveedor
+    with pytest.raises(ProviderUnavailable, match="circuito abierto"):
+        _call(governor)
+    assert governor.counters["calls"] == 2
+
+    # Pasado reset_timeout una sola llamada de prueba; si responde, se cierra
+    clock.now += 30
+    assert _call(governor) == "ok"
+    assert governor.state == CLOSED
+    assert governor.failures == 0
+    assert _call(governor) == "ok"
+
+
+def test_failed_probe_reopens_the_circuit():
+    clock = FakeClock()
+    governor = _governor(clock)
+    _open_circuit(governor)
+    clock.now += 30
+    with pytest.raises(httpx.HTTPStatusError):
+        _call(governor, _server_error)
+    assert governor.state == OPEN
+    assert governor.counters["circuit_opened"] == 2
+
+    # El nuevo plazo cuenta desde la prueba fallida
+    clock.now += 29
+    with pytest.raises(ProviderUnavailable):
+        _call(governor)
+    clock.now += 1
+    assert _call(governor) == "ok"
+    assert governor.state == CLOSED
+
+
+def test_only_one_probe_at_a_time():
+    clock = FakeClock()
+    governor = _governor(clock)
+    _open_circuit(governor)
+    clock.now += 30
+
+    async def main():
+        release = asyncio.Event()
+
+        async def slow_probe():
+            await release.wait()
+            return "ok"
+
+        probe = asyncio.ensure_future(governor.call(slow_probe))
+        await asyncio.sleep(0)
+        assert governor.state == HALF_OPEN
+        with pytest.raises(ProviderUnavailable):
+            await governor.call(_ok)
+        release.set()
+        return await probe
+
+    assert asyncio.run(main()) == "ok"
+    assert governor.state == CLOSED
+
+
+def test_cancelled_probe_lets_the_next_call_probe():
+    clock = FakeClock()
+    governor = _governor(clock)
+    _open_circuit(governor)
+    clock.now += 30
+
+    async def main():
+        async def hanging_probe():
+            await asyncio.Event().wait()
+
+        # Plazo de la consulta agotado o cliente desconectado durante la prueba
+        probe = asyncio.ensure_future(governor.call(hanging_probe))
+        await asyncio.sleep(0)
+        assert governor.state == HALF_OPEN
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        return await governor.call(_ok)
+
+    assert asyncio.run(main()) == "ok"
+    assert governor.state == CLOSED
+
+
+def test_probe_without_quota_releases_the_probe():
+    clock = FakeClock()
+    governor = _governor(clock, daily_quota=2)
+    _open_circuit(governor)  # gasta las 2 llamadas de la cuota
+    clock.now += 30
+    with pytest.raises(ProviderUnavailable, match="cuota"):
+        _call(governor)
+    assert governor.state == HALF_OPEN
+    governor.daily_quota = 0  # cuota renovada
+    assert _call(governor) == "ok"
+    assert governor.state == CLOSED
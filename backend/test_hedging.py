@@ -0,0 +1,96 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+import api.engine as engine_module
+from api.engine import engine
+from api.models import WeatherQueryData
+from services.deadline import Deadline
+from services.hedging import Hedger
+
+
+def _hedger(delay: float = 0.02) -> Hedger:
+    return Hedger(95, default_delay=delay, min_delay=delay, max_delay=delay)
+
+
+def _attempt(name: str, seconds: float = 0, error: Exception = None, started: list = None):
+    async def run():
+        if started is not None:
+            started.append(name)
+        await asyncio.sleep(seconds)
+        if error is not None:
+            raise error
+        return name
+    return name, run
+
+
+# ---------- CARRERA ----------
+
+def test_fast_first_attempt_wins_without_hedging():
+    hedger, started = _hedger(), []
+    result = asyncio.run(hedger.race([_attempt("a", started=started), _attempt("b", started=started)]))
+    assert result == ("a", "a")
+    assert started == ["a"]
+    assert hedger.counters["hedged"] == 0
+
+
+def test_slow_first_attempt_is_hedged():
+    hedger = _hedger()
+    result = asyncio.run(hedger.race([_attempt("a", 1), _attempt("b", 0)]))
+    assert result == ("b", "b")
+    assert hedger.counters["hedged"] == 1 and hedger.counters["hedge_wins"] == 1
+
+
+def test_failure_launches_the_next_attempt_right_away():
+    hedger = _hedger(delay=10)
+    result = asyncio.run(hedger.race([_attempt("a", error=RuntimeError("caído")), _attempt("b")]))
+    assert result == ("b", "b")
+    assert hedger.counters["failovers"] == 1
+
+
+# ---------- PLAZO ----------
+
+def test_deadline_stops_the_race_before_the_backup():
+    hedger, started = _hedger(delay=1), []
+
+    async def main():
+        return await hedger.race([_attempt("a", 5, started=started), _attempt("b", started=started)],
+                                 time.monotonic() + 0.05)
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(main())
+    # El respaldo (a 1 s) no alcanzaría a responder dentro del plazo: no se lanza
+    assert started == ["a"]
+    assert hedger.counters["deadline_exceeded"] == 1
+
+
+def test_answer_passes_the_request_deadline_to_the_race(monkeypatch):
+    async def hanging(provider, lat, lon, day):
+        await asyncio.Event().wait()
+
+    monkeypatch.setattr(engine, "fetch", hanging)
+    monkeypatch.setattr(engine_module, "degraded_response", lambda *args: {"status": "degraded"})
+    before = engine.hedger.counters["deadline_exceeded"]
+
+    query_dt, provider = engine.plan(WeatherQueryData(lat=10, lon=-84, dateTime="2020-02-10"))
+    # Plazo agotado: no es una caída del proveedor, no se responde con la climatología
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(engine.answer(query_dt, provider, 10, -84, deadline=Deadline(0.05)))
+    assert engine.hedger.counters["deadline_exceeded"] == before + 1
+
+
+def test_query_past_its_deadline_is_partial(monkeypatch):
+    async def hanging(provider, lat, lon, day):
+        await asyncio.Event().wait()
+
+    monkeypatch.setattr(engine, "fetch", hanging)
+    monkeypatch.setattr(engine_module, "degraded_response", lambda *args: None)
+
+    response = asyncio.run(engine.query(WeatherQueryData(lat=10, lon=-84, dateTime="2020-02-10"),
+                                        deadline=Deadline(0.05)))
+    body = json.loads(response.body)
+    assert body["status"] == "partial"
+    assert body["location"] == {"lat": 10, "lon": -84}
+    assert body["missing"] == ["weather", "rain_prediction"]
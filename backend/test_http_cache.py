@@ -0,0 +1,85 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import api.engine as engine_module
+from api.engine import engine
+from app import app
+from bench.fake_upstreams import FakeUpstreams
+from services import http_client
+from services.cache import weather_cache
+from services.http_cache import ETagIndex
+from services.nasa_power import segment_index
+
+CANONICAL = "/api/query_weather?lat=10.1235&lon=-84.0&dateTime=2020-02-10T15%3A00"
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """Cliente sin lifespan (sin índice de lugares) con NASA POWER simulado y caches vacíos."""
+    def install(latency_ms: float = 0):
+        http_client._clients.clear()
+        http_client.set_transport(FakeUpstreams(latency_ms=latency_ms, jitter_ms=0))
+
+    calls = []
+    fetch = engine.fetch
+
+    async def counted_fetch(provider, lat, lon, day):
+        calls.append((provider, lat, lon, day))
+        return await fetch(provider, lat, lon, day)
+
+    monkeypatch.setattr(engine, "fetch", counted_fetch)
+    monkeypatch.setattr(engine_module, "etag_index", ETagIndex())
+    monkeypatch.setattr(engine_module, "degraded_response", lambda *args: None)
+    weather_cache.clear()
+    segment_index._segments.clear()
+    install()
+    test_client = TestClient(app)
+    test_client.calls = calls
+    test_client.install = install
+    yield test_client
+    http_client.set_transport(None)
+    http_client._clients.clear()
+    weather_cache.clear()
+    segment_index._segments.clear()
+
+
+def test_non_canonical_url_redirects_to_the_canonical_one(client):
+    response = client.get("/api/query_weather", params={"lat": 10.123456, "lon": -84, "dateTime": "2020-02-10T15:30"},
+                          follow_redirects=False)
+    assert response.status_code == 308
+    assert response.headers["Location"] == CANONICAL
+    assert "max-age=" in response.headers["Cache-Control"]
+    assert client.calls == []
+
+    # La URL canónica responde sin volver a redirigir
+    response = client.get(response.headers["Location"], follow_redirects=False)
+    assert response.status_code == 200
+    assert response.json()["location"] == {"lat": 10.1235, "lon": -84.0}
+
+
+def test_if_none_match_is_answered_without_the_provider(client):
+    response = client.get(CANONICAL)
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    assert response.headers["Cache-Control"].startswith("public, max-age=")
+    assert len(client.calls) == 1
+
+    response = client.get(CANONICAL, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.content == b""
+    assert len(client.calls) == 1
+
+    # Otro ETag: respuesta completa
+    response = client.get(CANONICAL, headers={"If-None-Match": '"otro"'})
+    assert response.status_code == 200
+    assert response.headers["ETag"] == etag
+
+
+def test_partial_answer_is_not_stored(client):
+    client.install(latency_ms=2000)
+    response = client.get(CANONICAL, headers={"X-Request-Deadline-Ms": "100"})
+    assert response.status_code == 200
+    assert response.json()["status"] == "partial"
+    assert response.headers["Cache-Control"] == "no-store"
+    assert "ETag" not in response.headers
@@ -0,0 +1,46 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+import api.io as io
+import config
+from api.providers import NASA_POWER, PROVIDERS
+
+
+@pytest.fixture
+def offline(tmp_path, monkeypatch):
+    """Dataset local de 3 días en una malla de 0.5°: el valor de T2M codifica el nodo y el día."""
+    import xarray
+    lats, lons = np.arange(9.0, 11.5, 0.5), np.arange(-85.0, -82.5, 0.625)
+    times = np.array(["2020-02-09", "2020-02-10", "2020-02-11"], dtype="datetime64[ns]")
+    t2m = (lats[None, :, None] * 100 + np.abs(lons)[None, None, :] + np.arange(3)[:, None, None] / 10).astype(np.float32)
+    dataset = xarray.Dataset({"T2M": (("time", "lat", "lon"), t2m)}, coords={"time": times, "lat": lats, "lon": lons})
+    path = str(tmp_path / "offline.nc")
+    dataset.to_netcdf(path)
+    monkeypatch.setattr(config, "OFFLINE_DATASET_PATH", path)
+    monkeypatch.setattr(config, "OFFLINE_DATASET_VARIABLES", "T2M")
+    yield path
+    io.close_gridded()
+
+
+def test_nodes_are_read_in_one_selection(offline, monkeypatch):
+    selections = []
+    select_points = io.GriddedDataset.select_points
+
+    def counted(self, varnames, lats, lons, start=None, end=None):
+        selections.append(len(lats))
+        return select_points(self, varnames, lats, lons, start, end)
+
+    monkeypatch.setattr(io.GriddedDataset, "select_points", counted)
+    nodes = [(10.0, -84.375), (10.0, -83.75), (10.5, -84.375), (10.5, -83.75)]
+    series = asyncio.run(PROVIDERS[NASA_POWER].fetch_nodes(nodes, "2020-02-10", "2020-02-11"))
+
+    assert selections == [4]
+    assert [s.first("T2M") for s in series] == pytest.approx([1084.475, 1083.85, 1134.475, 1133.85])
+    assert len(series[0]) == 2
+
+
+def test_dates_outside_the_dataset_are_not_offline(offline):
+    assert asyncio.run(io.fetch_offline_nodes([(10.0, -84.375)], "2020-02-11", "2020-02-12")) is None
+    assert asyncio.run(io.fetch_offline_timeseries(10.0, -84.375, "2020-02-09", "2020-02-09")).first("T2M") == pytest.approx(1084.375)
@@ -0,0 +1,142 @@
+import asyncio
+
+import numpy as np
+
+from api.meteomatics_planner import MeteomaticsPlanner, PendingQuery
+from models.timeseries import TimeSeries
+
+
+def _url(points, start, end, interval):
+    coordinates = "+".join(f"{lat},{lon}" for lat, lon in points)
+    return f"https://api.meteomatics.com/{start}T00:00:00Z--{end}T23:00:00Z:{interval}/t_2m:C/{coordinates}/json"
+
+
+def _planner(fetch_points=None, **limits) -> MeteomaticsPlanner:
+    return MeteomaticsPlanner(fetch_points, _url, **limits)
+
+
+def _query(lat, lon, start, end=None, interval="PT1H", future=None) -> PendingQuery:
+    return PendingQuery(lat, lon, start, end or start, interval, future)
+
+
+def _daily_series(start: str, days: int, lat: float) -> TimeSeries:
+    times = np.arange(np.datetime64(start), np.datetime64(start) + days).astype("datetime64[s]")
+    return TimeSeries(times, {"t_2m:C": lat + np.arange(days)})
+
+
+# ---------- PLAN ----------
+
+def test_same_window_is_one_multipoint_call():
+    calls = _planner().plan([_query(1, 2, "2030-01-01"), _query(3, 4, "2030-01-01"), _query(1, 2, "2030-01-01")])
+    assert len(calls) == 1
+    assert calls[0].points == [(1, 2), (3, 4)]
+    assert len(calls[0].queries) == 3
+
+
+def test_max_points_opens_a_new_call():
+    calls = _planner(max_points=2).plan([_query(i, i, "2030-01-01") for i in range(5)])
+    assert [len(call.points) for call in calls] == [2, 2, 1]
+    assert sum(len(call.queries) for call in calls) == 5
+
+
+def test_url_length_opens_a_new_call():
+    one_point = len(_url([(10.5, -84.5)], "2030-01-01", "2030-01-01", "PT1H"))
+    calls = _planner(max_url_length=one_point + len("+10.5,-84.5") + 1).plan(
+        [_query(10.5, -84.5 + i, "2030-01-01") for i in range(3)])
+    assert [len(call.points) for call in calls] == [2, 1]
+    for call in calls:
+        assert len(_url(call.points, call.start, call.end, call.interval)) <= one_point + len("+10.5,-84.5") + 1
+
+
+def test_windows_merge_up_to_merge_max_days():
+    calls = _planner(merge_max_days=3).plan([
+        _query(1, 1, "2030-01-01"),
+        _query(2, 2, "2030-01-03"),      # ventana unida 01..03 = 3 días
+        _query(3, 3, "2030-01-04"),      # 01..04 = 4 días: otra llamada
+    ])
+    assert [(call.start, call.end) for call in calls] == [("2030-01-01", "2030-01-03"), ("2030-01-04", "2030-01-04")]
+
+
+def test_query_inside_a_long_call_joins_it():
+    calls = _planner(merge_max_days=3).plan([_query(1, 1, "2030-01-01", "2030-01-10"), _query(2, 2, "2030-01-05")])
+    assert len(calls) == 1
+    assert (calls[0].start, calls[0].end) == ("2030-01-01", "2030-01-10")
+
+
+def test_different_intervals_are_not_merged():
+    calls = _planner().plan([_query(1, 1, "2030-01-01", interval="PT1H"), _query(1, 1, "2030-01-01", interval="PT3H")])
+    assert sorted(call.interval for call in calls) == ["PT1H", "PT3H"]
+
+
+# ---------- EJECUCIÓN ----------
+
+def test_each_query_gets_only_its_dates():
+    calls = []
+
+    async def fetch_points(points, start, end, interval):
+        calls.append((sorted(points), start, end))
+        days = (np.datetime64(end) - np.datetime64(start)).astype(int) + 1
+        return {point: _daily_series(start, days, point[0]) for point in points}
+
+    async def main():
+        planner = _planner(fetch_points, window_ms=1)
+        return await asyncio.gather(
+            planner.submit(1, 1, "2030-01-01", "2030-01-01"),
+            planner.submit(2, 2, "2030-01-02", "2030-01-03"),
+            planner.submit(9, 9, "2030-01-01", "2030-01-01"),
+        )
+
+    first, second, third = asyncio.run(main())
+    assert calls == [([(1, 1), (2, 2), (9, 9)], "2030-01-01", "2030-01-03")]
+    assert first.times.astype(str).tolist() == ["2030-01-01T00:00:00"]
+    assert first.get("t_2m:C").tolist() == [1.0]
+    assert second.times.astype(str).tolist() == ["2030-01-02T00:00:00", "2030-01-03T00:00:00"]
+    assert second.get("t_2m:C").tolist() == [3.0, 4.0]
+    assert third.get("t_2m:C").tolist() == [9.0]
+
+
+def test_point_missing_from_the_answer_gets_an_empty_series():
+    async def fetch_points(points, start, end, interval):
+        return {}
+
+    async def main():
+        return await _planner(fetch_points, window_ms=1).submit(1, 1, "2030-01-01", "2030-01-01")
+
+    assert len(asyncio.run(main())) == 0
+
+
+def test_errors_reach_every_query_of_the_call():
+    async def fetch_points(points, start, end, interval):
+        raise RuntimeError("Meteomatics caído")
+
+    async def main():
+        planner = _planner(fetch_points, window_ms=1)
+        return await asyncio.gather(
+            planner.submit(1, 1, "2030-01-01", "2030-01-01"),
+            planner.submit(2, 2, "2030-01-01", "2030-01-01"),
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(main())
+    assert [str(r) for r in results] == ["Meteomatics caído", "Meteomatics caído"]
+
+
+def test_in_flight_calls_are_held_by_the_planner():
+    # El loop solo guarda las tareas débilmente: el planner mantiene la referencia mientras corren
+    seen = []
+
+    async def fetch_points(points, start, end, interval):
+        seen.append(planner.stats()["in_flight"])
+        await asyncio.sleep(0)
+        return {point: _daily_series(start, 1, point[0]) for point in points}
+
+    async def main():
+        series = await planner.submit(5, 5, "2030-01-01", "2030-01-01")
+        await asyncio.sleep(0)  # la tarea termina después de entregar los resultados
+        return series, planner.stats()
+
+    planner = _planner(fetch_points, window_ms=1)
+    series, stats = asyncio.run(main())
+    assert seen == [1]
+    assert series.get("t_2m:C").tolist() == [5.0]
+    assert stats["in_flight"] == 0
@@ -0,0 +1,145 @@
+import asyncio
+from datetime import date
+
+import numpy as np
+import pytest
+
+from bench.fake_upstreams import FakeUpstreams
+from models.timeseries import TimeSeries
+from services import http_client, nasa_power
+from services.cache import weather_cache
+from services.nasa_power import SegmentIndex, _chunks, _gaps, _merge, fetch_nasa_power_range, segment_index
+
+
+def d(day: int, month: int = 1, year: int = 2020) -> date:
+    return date(year, month, day)
+
+
+def _days(series: TimeSeries) -> list:
+    return series.times.astype("datetime64[D]").astype(str).tolist()
+
+
+# ---------- HUECOS Y TRAMOS ----------
+
+@pytest.mark.parametrize("covered, expected", [
+    ([], [(d(1), d(10))]),
+    ([(d(3), d(5))], [(d(1), d(2)), (d(6), d(10))]),                 # contenido
+    ([(d(1), d(5)), (d(6), d(10))], []),                            # adyacentes: cubren todo
+    ([(d(1), d(5)), (d(7), d(10))], [(d(6), d(6))]),                # hueco de un día
+    ([(d(2), d(6)), (d(4), d(8))], [(d(1), d(1)), (d(9), d(10))]),  # solapados
+    ([(d(1, 12, 2019), d(31, 12, 2019)), (d(11), d(20))], [(d(1), d(10))]),  # fuera del rango
+    ([(d(25, 12, 2019), d(1))], [(d(2), d(10))]),                   # termina en el primer día
+    ([(d(10), d(20))], [(d(1), d(9))]),                             # empieza en el último día
+    ([(d(1, 12, 2019), d(31))], []),                                # cubre más que el rango
+])
+def test_gaps(covered, expected):
+    assert _gaps(d(1), d(10), covered) == expected
+
+
+@pytest.mark.parametrize("gaps, chunk_days, expected", [
+    ([(d(1), d(10))], 4, [(d(1), d(4)), (d(5), d(8)), (d(9), d(10))]),
+    ([(d(1), d(8))], 4, [(d(1), d(4)), (d(5), d(8))]),
+    ([(d(1), d(1))], 4, [(d(1), d(1))]),
+    ([(d(1), d(2)), (d(6), d(10))], 3, [(d(1), d(2)), (d(6), d(8)), (d(9), d(10))]),
+    ([(d(1), d(31))], 1, [(d(i), d(i)) for i in range(1, 32)]),
+])
+def test_chunks_cover_every_day_once(gaps, chunk_days, expected):
+    chunks = _chunks(gaps, chunk_days)
+    assert chunks == expected
+    assert all((end - start).days < chunk_days for start, end in chunks)
+
+
+def test_merge_sorts_and_drops_repeated_times():
+    first = TimeSeries(np.array(["2020-01-03", "2020-01-04"], dtype="datetime64[s]"), {"T2M": [3, 4]})
+    second = TimeSeries(np.array(["2020-01-01", "2020-01-02", "2020-01-03"], dtype="datetime64[s]"),
+                        {"T2M": [1, 2, 3], "PRECTOT": [0.1, 0.2, 0.3]})
+    merged = _merge([first, TimeSeries.empty(), second])
+    assert _days(merged) == ["2020-01-01", "2020-01-02", "2020-01-03", "2020-01-04"]
+    assert merged.get("T2M").tolist() == [1, 2, 3, 4]
+    # Variables que faltan en un tramo quedan NaN en sus fechas
+    assert np.isnan(merged.get("PRECTOT")[3])
+    assert _merge([]) is not None and len(_merge([])) == 0
+
+
+def test_segment_index_dedupes_and_evicts_oldest_series():
+    index = SegmentIndex(max_series=2)
+    index.add("a", d(1), d(5))
+    index.add("a", d(1), d(5))
+    index.add("b", d(1), d(5))
+    assert index.get("a") == [(d(1), d(5))]
+    index.add("c", d(1), d(5))  # "b" es la menos usada
+    assert index.get("b") == []
+    assert index.get("a") == [(d(1), d(5))]
+    index.discard("a", d(1), d(5))
+    assert index.get("a") == []
+
+
+# ---------- RANGOS CON EL CACHE ----------
+
+class RecordingUpstream(FakeUpstreams):
+    """NASA POWER simulado que anota el rango (start, end) de cada llamada."""
+
+    def __init__(self):
+        super().__init__(latency_ms=0, jitter_ms=0)
+        self.ranges = []
+
+    async def handle_async_request(self, request):
+        params = request.url.params
+        self.ranges.append((params["start"], params["end"]))
+        return await super().handle_async_request(request)
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    fake = RecordingUpstream()
+    monkeypatch.setitem(nasa_power.CHUNK_DAYS, nasa_power.DAILY, 4)
+    weather_cache.clear()
+    segment_index._segments.clear()
+    http_client._clients.clear()
+    http_client.set_transport(fake)
+    yield fake
+    http_client.set_transport(None)
+    http_client._clients.clear()
+    weather_cache.clear()
+    segment_index._segments.clear()
+
+
+def _fetch_ranges(*ranges) -> list:
+    async def main():
+        return [await fetch_nasa_power_range(14.6, -90.5, start, end) for start, end in ranges]
+    return asyncio.run(main())
+
+
+def test_long_range_is_split_into_chunks(upstream):
+    [series] = _fetch_ranges(("2020-01-01", "2020-01-10"))
+    assert sorted(upstream.ranges) == [("20200101", "20200104"), ("20200105", "20200108"), ("20200109", "20200110")]
+    assert _days(series) == [f"2020-01-{day:02d}" for day in range(1, 11)]
+
+
+def test_cached_and_contained_ranges_make_no_upstream_call(upstream):
+    first, again, inside = _fetch_ranges(
+        ("2020-01-01", "2020-01-10"),
+        ("2020-01-01", "2020-01-10"),
+        ("2020-01-03", "2020-01-07"),
+    )
+    assert len(upstream.ranges) == 3  # solo la primera consulta
+    assert _days(again) == _days(first)
+    assert again.get("T2M").tolist() == first.get("T2M").tolist()
+    assert _days(inside) == [f"2020-01-{day:02d}" for day in range(3, 8)]
+
+
+def test_overlapping_range_downloads_only_the_gap(upstream):
+    _, overlapping = _fetch_ranges(("2020-01-01", "2020-01-10"), ("2020-01-08", "2020-01-15"))
+    assert sorted(upstream.ranges[3:]) == [("20200111", "20200114"), ("20200115", "20200115")]
+    assert _days(overlapping) == [f"2020-01-{day:02d}" for day in range(8, 16)]
+
+
+def test_adjacent_ranges_join_without_gaps_or_repeats(upstream):
+    first, second, whole = _fetch_ranges(
+        ("2020-01-01", "2020-01-04"),
+        ("2020-01-05", "2020-01-08"),
+        ("2020-01-01", "2020-01-08"),
+    )
+    assert upstream.ranges == [("20200101", "20200104"), ("20200105", "20200108")]
+    assert _days(whole) == _days(first) + _days(second)
+    assert whole.get("T2M").tolist() == first.get("T2M").tolist() + second.get("T2M").tolist()
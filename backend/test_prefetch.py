@@ -0,0 +1,170 @@
+import asyncio
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+import services.prefetch as prefetch
+from services.cache import WeatherCache
+from services.prefetch import Prefetcher
+
+DAY = date(2030, 1, 1)
+
+
+@pytest.fixture
+def shared(tmp_path, monkeypatch):
+    """Dos workers: cada uno con su memoria y el mismo nivel compartido (SQLite)."""
+    path = str(tmp_path / "shared.db")
+    caches = [WeatherCache(disk_path=path, workers=2) for _ in range(2)]
+    monkeypatch.setattr(prefetch, "weather_cache", caches[0])
+    return caches
+
+
+# ---------- POPULARIDAD COMPARTIDA ----------
+
+def test_scores_of_every_worker_reach_the_shared_store(shared, monkeypatch):
+    leader, other = Prefetcher(top_k=10), Prefetcher(top_k=10)
+    monkeypatch.setattr(prefetch, "weather_cache", shared[1])
+    for _ in range(3):
+        other.record("nasa_power", 14.5, -90.625, DAY)
+    asyncio.run(other.share())
+
+    monkeypatch.setattr(prefetch, "weather_cache", shared[0])
+    leader.record("nasa_power", 10.0, -84.375, DAY)
+    asyncio.run(leader.share())
+
+    # El encargado de precargar elige con el tráfico de los dos
+    assert leader.top_cells("nasa_power") == [(14.5, -90.625), (10.0, -84.375)]
+    assert leader.days[("nasa_power", 14.5, -90.625, DAY)] == pytest.approx(3.0)
+
+    # Lo ya compartido no se vuelve a sumar
+    asyncio.run(leader.share())
+    asyncio.run(leader.share())
+    assert leader.cells[("nasa_power", 10.0, -84.375)] == pytest.approx(1.0, rel=1e-3)
+
+
+def test_shared_scores_decay_by_wall_clock(shared, monkeypatch):
+    prefetcher = Prefetcher(half_life=3600)
+    prefetcher.record("nasa_power", 14.5, -90.625, DAY)
+    asyncio.run(prefetcher.share())
+
+    clock = [prefetch.time.time() + 3600]
+    monkeypatch.setattr(prefetch.time, "time", lambda: clock[0])
+    asyncio.run(prefetcher.share())
+    assert prefetcher.cells[("nasa_power", 14.5, -90.625)] == pytest.approx(0.5, rel=1e-3)
+
+
+def test_unshared_records_survive_a_failed_share(shared, monkeypatch):
+    prefetcher = Prefetcher()
+    prefetcher.record("nasa_power", 14.5, -90.625, DAY)
+    update = shared[0].update
+
+    async def store_down(*args, **kwargs):
+        raise TimeoutError("sin turno")
+
+    shared[0].update = store_down
+    asyncio.run(prefetcher.share())
+    shared[0].update = update
+
+    prefetcher.record("nasa_power", 14.5, -90.625, DAY)
+    asyncio.run(prefetcher.share())
+    assert prefetcher.cells[("nasa_power", 14.5, -90.625)] == pytest.approx(2.0, rel=1e-3)
+
+
+def test_forecasts_fresh_in_the_shared_store_are_not_refreshed(shared, monkeypatch):
+    today = datetime.now().date()
+    refreshed = []
+
+    async def refresh(lat, lon, start, end):
+        refreshed.append((lat, lon, start))
+
+    node = SimpleNamespace(cache_key=lambda lat, lon, start, end: f"meteomatics|{lat},{lon}|{start}", refresh=refresh)
+    monkeypatch.setattr(prefetch, "fetch_meteomatics_node", node)
+
+    prefetcher = Prefetcher(top_k=2, forecast_days=2, refresh_margin=120)
+    prefetcher.record("meteomatics", 14.6, -90.5, today)
+    # Otro worker ya refrescó hoy: está en el nivel compartido, no en la memoria de este proceso
+    asyncio.run(shared[1].set(node.cache_key(14.6, -90.5, today.isoformat(), None), "serie", 3600))
+    assert shared[0].memory.remaining(node.cache_key(14.6, -90.5, today.isoformat(), None)) == 0
+
+    asyncio.run(prefetcher.refresh_forecasts())
+    assert refreshed == [(14.6, -90.5, (today + timedelta(days=1)).isoformat())]
+
+
+# ---------- UN SOLO PROCESO ----------
+
+@pytest.fixture
+def local(monkeypatch):
+    monkeypatch.setattr(prefetch, "weather_cache", WeatherCache())
+    clock = [1000.0]
+    monkeypatch.setattr(prefetch.time, "monotonic", lambda: clock[0])
+    return clock
+
+
+@pytest.mark.parametrize("hours, hour, inside", [
+    ("0-6", 0, True), ("0-6", 6, True), ("0-6", 7, False),
+    ("22-4", 23, True), ("22-4", 0, True), ("22-4", 4, True), ("22-4", 5, False), ("22-4", 21, False),
+    ("3", 3, True), ("3", 4, False),
+])
+def test_offpeak_hours_can_wrap_midnight(hours, hour, inside):
+    assert prefetch._in_hours(hours, hour) is inside
+
+
+def test_scores_decay_by_half_life_and_are_forgotten(local):
+    prefetcher = Prefetcher(half_life=3600)
+    prefetcher.record("nasa_power", 14.5, -90.625, DAY)
+    assert prefetcher._unshared_cells == {}
+
+    local[0] += 3600
+    prefetcher._decay()
+    assert prefetcher.cells[("nasa_power", 14.5, -90.625)] == pytest.approx(0.5)
+    assert prefetcher.days[("nasa_power", 14.5, -90.625, DAY)] == pytest.approx(0.5)
+
+    local[0] += 3600 * 4
+    prefetcher._decay()
+    assert prefetcher.cells == {} and prefetcher.days == {}
+
+
+def test_budget_refills_over_the_hour(local):
+    bucket = prefetch.TokenBucket(per_hour=24)
+    # Ráfaga de hasta 5 minutos de presupuesto: 2 llamadas
+    assert [bucket.try_acquire() for _ in range(3)] == [True, True, False]
+    local[0] += 150
+    assert bucket.try_acquire() and not bucket.try_acquire()
+
+
+def test_refresh_stops_at_the_budget(local, monkeypatch):
+    refreshed = []
+
+    async def refresh(lat, lon, start, end):
+        refreshed.append((lat, lon))
+
+    node = SimpleNamespace(cache_key=lambda lat, lon, start, end: f"meteomatics|{lat},{lon}|{start}", refresh=refresh)
+    monkeypatch.setattr(prefetch, "fetch_meteomatics_node", node)
+
+    prefetcher = Prefetcher(top_k=3, forecast_days=1, budgets={"meteomatics": 24})
+    for lat in (14.5, 14.75, 15.0):
+        prefetcher.record("meteomatics", lat, -90.5, DAY)
+    asyncio.run(prefetcher.refresh_forecasts())
+    assert len(refreshed) == 2
+    assert prefetcher.counters["refreshed"] == 2 and prefetcher.counters["skipped_budget"] == 1
+
+
+@pytest.mark.parametrize("hour, backfilled", [(23, True), (2, True), (12, False)])
+def test_history_is_backfilled_only_off_peak(local, monkeypatch, hour, backfilled):
+    class Now(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime(2030, 1, 1, hour)
+
+    monkeypatch.setattr(prefetch, "datetime", Now)
+    prefetcher = Prefetcher(offpeak_hours="22-4")
+    calls = []
+
+    async def task(name):
+        calls.append(name)
+
+    monkeypatch.setattr(prefetcher, "refresh_forecasts", lambda: task("refresh"))
+    monkeypatch.setattr(prefetcher, "backfill_history", lambda: task("backfill"))
+    asyncio.run(prefetcher.run_once())
+    assert calls == (["refresh", "backfill"] if backfilled else ["refresh"])
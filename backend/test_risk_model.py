@@ -0,0 +1,97 @@
+import math
+
+import numpy as np
+import pytest
+
+from models.risk_model import RISK_LABELS, compute_risk_batch, compute_risk_probabilities, resolve_columns, stack_timeseries
+from models.timeseries import TimeSeries
+
+HOURS = np.arange("2030-01-01T00", "2030-01-01T06", dtype="datetime64[h]").astype("datetime64[s]")
+METEOMATICS_DATA = {
+    "t_2m:C": [27.0, 29.5, 31.0, 30.0, 28.5, 26.0],
+    "wind_speed_10m:ms": [3.0, 4.5, 6.0, 5.5, 2.0, 1.0],
+    "precip_1h:mm": [0.0, 0.0, 1.2, 4.0, 0.5, 0.0],
+}
+
+
+def _legacy_risks(columns: dict) -> dict:
+    """El cálculo original por columnas (antes de la versión vectorizada): la variable ausente era NaN."""
+    means = {name.lower(): float(np.mean(values)) for name, values in columns.items()}
+    temp = next((v for c, v in means.items() if "temp" in c or "t_2m" in c), np.nan)
+    wind = next((v for c, v in means.items() if "wind" in c or "speed" in c), np.nan)
+    precip = next((v for c, v in means.items() if "precip" in c or "rain" in c), np.nan)
+    risks = np.array([
+        np.clip((temp - 25) / 10, 0, 1),
+        np.clip((15 - temp) / 10, 0, 1),
+        np.clip(wind / 15, 0, 1),
+        np.clip(precip / 10, 0, 1),
+    ])
+    risks = risks / (risks.sum() + 1e-9)
+    return {label: round(float(risk) * 100, 2) for label, risk in zip(RISK_LABELS, risks)}
+
+
+def _batch_n1(columns: dict) -> dict:
+    series = TimeSeries(HOURS, columns)
+    variables = tuple(series.variables)
+    risks = compute_risk_batch(stack_timeseries([series], variables), variables)
+    assert risks.shape == (1, 4)
+    return dict(zip(RISK_LABELS, risks[0].tolist()))
+
+
+def test_batch_n1_matches_legacy_dict_path():
+    legacy = _legacy_risks(METEOMATICS_DATA)
+    assert _batch_n1(METEOMATICS_DATA) == pytest.approx(legacy, abs=0.01)
+    # El formato antiguo (dict de columnas) sigue pasando por el mismo cálculo
+    assert compute_risk_probabilities(METEOMATICS_DATA) == pytest.approx(legacy, abs=0.01)
+    assert compute_risk_probabilities(TimeSeries(HOURS, METEOMATICS_DATA)) == pytest.approx(legacy, abs=0.01)
+
+
+def test_missing_variable_is_zero_risk_not_nan():
+    without_precip = {k: v for k, v in METEOMATICS_DATA.items() if not k.startswith("precip")}
+
+    # Antes: la variable ausente era NaN y contaminaba la normalización (todos los riesgos NaN)
+    assert all(math.isnan(v) for v in _legacy_risks(without_precip).values())
+
+    # Ahora: sin riesgo de lluvia, el resto se normaliza igual que con wet = 0
+    risks = _batch_n1(without_precip)
+    assert risks["wet"] == 0
+    assert sum(risks.values()) == pytest.approx(100, abs=0.05)
+    dry = {**METEOMATICS_DATA, "precip_1h:mm": [0.0] * len(HOURS)}
+    assert risks == pytest.approx(_legacy_risks(dry), abs=0.01)
+    assert compute_risk_probabilities(without_precip) == pytest.approx(risks, abs=0.01)
+
+
+def test_location_without_any_data_has_no_risk():
+    values = np.full((2, len(HOURS), 3), np.nan, dtype=np.float32)
+    values[1] = np.array(list(METEOMATICS_DATA.values()), dtype=np.float32).T
+    risks = compute_risk_batch(values, tuple(METEOMATICS_DATA))
+    assert risks[0].tolist() == [0, 0, 0, 0]
+    assert dict(zip(RISK_LABELS, risks[1].tolist())) == pytest.approx(_legacy_risks(METEOMATICS_DATA), abs=0.01)
+
+
+@pytest.mark.parametrize("variables, expected", [
+    (("t_2m:C", "wind_speed_10m:ms", "precip_1h:mm"), (0, 1, 2)),
+    (("T2M", "PRECTOT", "ALLSKY_SFC_SW_DWN"), (0, None, 1)),
+    (("T2M", "PRECTOTCORR", "WS10M", "ALLSKY_SFC_SW_DWN"), (0, 2, 1)),
+    (("ALLSKY_SFC_SW_DWN",), (None, None, None)),
+])
+def test_resolve_columns(variables, expected):
+    assert resolve_columns(variables) == expected
+
+
+def test_nasa_names_score_like_meteomatics_names():
+    nasa = {
+        "T2M": METEOMATICS_DATA["t_2m:C"],
+        "PRECTOTCORR": METEOMATICS_DATA["precip_1h:mm"],
+        "WS10M": METEOMATICS_DATA["wind_speed_10m:ms"],
+        "ALLSKY_SFC_SW_DWN": [500.0] * len(HOURS),
+    }
+    assert _batch_n1(nasa) == pytest.approx(_batch_n1(METEOMATICS_DATA), abs=0.01)
+    # Diario de NASA POWER: PRECTOT es la lluvia (antes quedaba sin riesgo de lluvia)
+    daily = _batch_n1({"T2M": [12.0] * len(HOURS), "PRECTOT": [8.0] * len(HOURS)})
+    assert daily["wet"] > 0 and daily["cold"] > 0
+
+
+def test_no_usable_variable_is_an_error():
+    with pytest.raises(RuntimeError, match="No se encontraron variables"):
+        compute_risk_probabilities(TimeSeries(HOURS, {"ALLSKY_SFC_SW_DWN": [1.0] * len(HOURS)}))
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+from services.single_flight import SingleFlight
+
+
+def test_concurrent_callers_share_one_execution():
+    flights = SingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "serie"
+
+    async def main():
+        results = await asyncio.gather(*(flights.do("k", fetch) for _ in range(5)))
+        # Terminada la llamada, la siguiente vuelve a ejecutar
+        return results, await flights.do("k", fetch)
+
+    results, again = asyncio.run(main())
+    assert results == ["serie"] * 5 and again == "serie"
+    assert len(calls) == 2
+    assert flights.stats() == {"leaders": 2, "deduplicated": 4, "errors": 0, "in_flight": 0}
+
+
+def test_every_caller_gets_the_shared_error_counted_once():
+    flights = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("proveedor caído")
+
+    async def main():
+        return await asyncio.gather(*(flights.do("k", fail) for _ in range(3)), return_exceptions=True)
+
+    errors = asyncio.run(main())
+    assert [str(e) for e in errors] == ["proveedor caído"] * 3
+    assert flights.counters == {"leaders": 1, "deduplicated": 2, "errors": 1}
+
+
+def test_different_keys_do_not_wait_for_each_other():
+    flights = SingleFlight()
+
+    async def value(v):
+        await asyncio.sleep(0.01)
+        return v
+
+    async def main():
+        return await asyncio.gather(flights.do("a", lambda: value(1)), flights.do("b", lambda: value(2)))
+
+    assert asyncio.run(main()) == [1, 2]
+    assert flights.counters["leaders"] == 2 and flights.counters["deduplicated"] == 0
+
+
+def test_a_cancelled_caller_does_not_cancel_the_others():
+    flights = SingleFlight()
+
+    async def fetch():
+        await asyncio.sleep(0.05)
+        return "serie"
+
+    async def main():
+        first = asyncio.ensure_future(flights.do("k", fetch))
+        second = asyncio.ensure_future(flights.do("k", fetch))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(main()) == "serie"
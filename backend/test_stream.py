@@ -0,0 +1,100 @@
+import asyncio
+import json
+
+import numpy as np
+
+import api.engine as engine_module
+import api.stream as stream
+from api.engine import engine
+from api.models import WeatherQueryData
+from models.timeseries import TimeSeries
+from services.deadline import Deadline
+
+QUERY = WeatherQueryData(lat=10, lon=-84, dateTime="2020-02-10")
+CLIMATOLOGY = {"rain_probability": 35.0, "t2m_p50": 24.0, "precip_p50": 1.5}
+
+
+def _series(value: float) -> TimeSeries:
+    return TimeSeries(np.array(["2020-02-10T00:00:00"], dtype="datetime64[s]"),
+                      {"T2M": [value], "PRECTOT": [value], "ALLSKY_SFC_SW_DWN": [value]})
+
+
+def _events(query=QUERY, deadline=None) -> list:
+    async def collect():
+        events = await stream.stream_query(engine, query, ndjson=True, deadline=deadline)
+        return [json.loads(line) async for line in events]
+    return asyncio.run(collect())
+
+
+def _names(events: list) -> list:
+    return [event["event"] for event in events]
+
+
+def _patch(monkeypatch, fetch, cached=None, climatology=None, degraded=None):
+    monkeypatch.setattr(engine, "fetch", fetch)
+    monkeypatch.setattr(engine_module, "cached_point", lambda *args: cached)
+    monkeypatch.setattr(stream.climatology_store, "lookup", lambda *args: climatology)
+    monkeypatch.setattr(engine_module, "degraded_response", lambda lat, lon, day, detail: degraded)
+
+
+def test_cached_and_climatology_come_before_fresh_data(monkeypatch):
+    async def fresh(provider, lat, lon, day):
+        return _series(30.0)
+
+    _patch(monkeypatch, fresh, cached=_series(20.0), climatology=CLIMATOLOGY)
+    events = _events()
+    assert _names(events) == ["location", "cached", "climatology", "weather", "risk", "done"]
+    assert events[1]["status"] == "cached" and events[1]["temperature"] == "20.0°C"
+    assert events[2]["rain_prediction"] == "Probabilidad climatológica de lluvia: 35.0%"
+    assert events[3]["status"] == "success" and events[3]["temperature"] == "30.0°C"
+
+
+def test_without_cache_or_climatology_only_fresh_data(monkeypatch):
+    async def fresh(provider, lat, lon, day):
+        return _series(30.0)
+
+    _patch(monkeypatch, fresh)
+    assert _names(_events()) == ["location", "weather", "risk", "done"]
+
+
+def test_provider_failure_is_degraded_like_query_weather(monkeypatch):
+    async def provider_down(provider, lat, lon, day):
+        raise RuntimeError("circuito abierto")
+
+    _patch(monkeypatch, provider_down, climatology=CLIMATOLOGY,
+           degraded={"status": "degraded", "source": "NASA POWER (climatología)"})
+    events = _events()
+    assert _names(events) == ["location", "climatology", "weather", "done"]
+    assert events[2]["status"] == "degraded"
+
+
+def test_provider_failure_without_climatology_is_an_error(monkeypatch):
+    async def provider_down(provider, lat, lon, day):
+        raise RuntimeError("circuito abierto")
+
+    _patch(monkeypatch, provider_down)
+    events = _events()
+    assert _names(events) == ["location", "error"]
+    assert events[1]["status_code"] == 500
+
+
+def test_deadline_sends_partial_then_done(monkeypatch):
+    async def hanging(provider, lat, lon, day):
+        await asyncio.Event().wait()
+
+    _patch(monkeypatch, hanging, climatology=CLIMATOLOGY,
+           degraded={"status": "degraded", "rain_prediction": "Probabilidad climatológica de lluvia: 35.0%"})
+    events = _events(deadline=Deadline(0.05))
+    assert _names(events) == ["location", "climatology", "partial", "done"]
+    assert events[2]["status"] == "partial"
+    assert events[2]["missing"] == ["weather"]
+
+
+def test_invalid_location_is_an_error_event(monkeypatch):
+    async def unused(provider, lat, lon, day):
+        raise AssertionError("no se debería consultar al proveedor")
+
+    _patch(monkeypatch, unused)
+    events = _events(WeatherQueryData(dateTime="2020-02-10"))
+    assert _names(events) == ["error"]
+    assert events[0]["status_code"] == 400
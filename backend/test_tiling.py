@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from models.timeseries import TimeSeries
+from services.tiling import blend, locate, snap_coordinates
+
+DAYS = np.array(["2030-01-01", "2030-01-02"], dtype="datetime64[s]")
+
+
+@pytest.mark.parametrize("lat, lon", [
+    (14.6349, -90.5069),
+    (-33.4489, -70.6693),
+    (0.0123, 179.9876),
+    (0.3, 0.72),
+    (89.99, -179.99),
+])
+def test_bilinear_weights_sum_to_one_and_surround_the_point(lat, lon):
+    _, nodes, weights = locate("meteomatics", lat, lon)
+    assert sum(weights) == pytest.approx(1.0, abs=1e-12)
+    assert all(0 < w <= 1 for w in weights)
+    # El punto es el promedio ponderado de los nodos
+    assert sum(w * node[0] for node, w in zip(nodes, weights)) == pytest.approx(lat, abs=1e-4)
+    assert sum(w * node[1] for node, w in zip(nodes, weights)) == pytest.approx(lon, abs=1e-4)
+
+
+@pytest.mark.parametrize("lat, lon", [(14.65, -90.5), (0.3, 0.7), (-0.15, 0.35), (0.0, 0.0), (-12.05, 77.0)])
+def test_point_on_a_node_gets_weight_one(lat, lon):
+    tile, nodes, weights = locate("meteomatics", lat, lon)
+    assert nodes == [(lat, lon)]
+    assert weights == [1.0]
+    # Su tile es el del propio nodo (los puntos del mismo nodo se agrupan juntos en el lote)
+    assert tile == (lat, lon)
+
+
+def test_point_on_an_edge_uses_two_nodes():
+    tile, nodes, weights = locate("meteomatics", 0.3, 0.72)
+    assert tile == (0.3, 0.7)
+    assert nodes == [(0.3, 0.7), (0.3, 0.75)]
+    assert weights == pytest.approx([0.6, 0.4])
+
+
+def test_points_of_a_tile_share_the_tile():
+    tiles = {locate("meteomatics", 14.6 + d, -90.55 + d)[0] for d in (0.001, 0.02, 0.049)}
+    assert tiles == {(14.6, -90.55)}
+
+
+def test_nasa_power_snaps_to_the_nearest_cell():
+    assert locate("nasa_power", 14.6349, -90.5069) == ((14.5, -90.625), [(14.5, -90.625)], [1.0])
+    assert snap_coordinates("nasa_power", 14.76, -90.3) == (15.0, -90.0)
+
+
+def test_blend_weights_and_missing_values():
+    a = TimeSeries(DAYS, {"T2M": [10.0, np.nan]})
+    b = TimeSeries(DAYS, {"T2M": [20.0, 30.0]})
+    blended = blend([a, b], [0.25, 0.75])
+    # Donde un nodo no tiene dato, el otro se lleva todo el peso
+    assert blended.get("T2M").tolist() == [17.5, 30.0]
+
+
+def test_blend_single_node_is_the_same_series():
+    series = TimeSeries(DAYS, {"T2M": [1.0, 2.0]})
+    assert blend([series], [1.0]) is series
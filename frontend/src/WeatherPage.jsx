@@ -112,13 +112,14 @@ const WeatherPage = () => {
     // ********************************************************
  const endpoint = "http://localhost:8000/query_weather";
 
+    // GET so the browser and the CDN can reuse the answer (ETag / Cache-Control);
+    // the backend redirects to the canonical URL of the query
+    const query = new URLSearchParams(
+      Object.entries(bodyParams).filter(([, value]) => value !== undefined && value !== null && value !== "")
+    );
+
     try {
-      const weatherResponse = await fetch(endpoint, {
-        method: "POST",
-        headers: { "Content-Type": "application/json" },
-        // The JSON body is correct if the Backend uses Pydantic
-        body: JSON.stringify(bodyParams),
-      });
+      const weatherResponse = await fetch(`${endpoint}?${query}`);
 
       if (!weatherResponse.ok) {
         // Detailed backend error handling